@@ -0,0 +1,326 @@
+"""
+Асинхронные задачи анализа документов.
+
+POST /jobs сохраняет документ и запись задачи и сразу возвращает ее ID,
+а обработку выполняют воркеры в фоне. Задачи хранятся в SQLite, поэтому
+переживают перезапуск процесса: воркер захватывает задачу на время аренды
+(lease), и задача упавшего процесса после истечения аренды снова доступна.
+Несколько процессов с общей базой и каталогом загрузок делят очередь, так
+что прием задач (JOB_WORKERS=0) и их выполнение масштабируются отдельно.
+
+Пока задача выполняется, воркер продлевает аренду. Захват выдает токен
+аренды: результат принимается только от владельца текущей аренды, так что
+воркер, потерявший аренду, не перезапишет результат нового владельца.
+Задача, захваченная max_attempts раз, завершается ошибкой.
+"""
+
+import os
+import time
+import uuid
+import sqlite3
+import asyncio
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Any, Optional, List, Callable, Awaitable, Union
+
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    query TEXT NOT NULL,
+    filename TEXT,
+    file_path TEXT NOT NULL,
+    sha256 TEXT,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_until REAL,
+    lease_token TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+"""
+
+
+def _timestamp(value: Optional[float]) -> Optional[str]:
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(value)) if value else None
+
+
+class JobStore:
+    """Хранилище задач в SQLite"""
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if "sha256" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN sha256 TEXT")
+        if "lease_token" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN lease_token TEXT")
+        self._lock = threading.Lock()
+
+    def create(self, query: str, filename: Optional[str], file_path: str,
+               sha256: Optional[str] = None, job_id: Optional[str] = None) -> Dict[str, Any]:
+        job_id = job_id or uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, query, filename, file_path, sha256, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, query, filename, file_path, sha256, time.time())
+            )
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def claim(self, lease: float, max_attempts: int = 3) -> Optional[Dict[str, Any]]:
+        """Захват самой старой ожидающей задачи или задачи с истекшей арендой
+
+        Задача, уже захваченная max_attempts раз, не выполняется снова: она
+        возвращается со статусом failed, чтобы воркер удалил ее документ.
+        """
+        now = time.time()
+        token = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT id, attempts FROM jobs WHERE status = ? OR (status = ? AND lease_until < ?) "
+                    "ORDER BY created_at LIMIT 1",
+                    (QUEUED, RUNNING, now)
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                if row["attempts"] >= max_attempts:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = ?, error = ?, lease_until = NULL, lease_token = NULL, "
+                        "finished_at = ? WHERE id = ?",
+                        (FAILED, f"Превышено число попыток: {row['attempts']}", now, row["id"])
+                    )
+                else:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = ?, attempts = attempts + 1, lease_until = ?, lease_token = ?, "
+                        "started_at = ? WHERE id = ?",
+                        (RUNNING, now + lease, token, now, row["id"])
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return self.get(row["id"])
+
+    def renew(self, job_id: str, token: str, lease: float) -> bool:
+        """Продление аренды; False, если задачу уже захватил другой воркер"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND status = ? AND lease_token = ?",
+                (time.time() + lease, job_id, RUNNING, token)
+            )
+        return cursor.rowcount == 1
+
+    def complete(self, job_id: str, token: str, result: str) -> bool:
+        """Сохранение результата; False, если аренда потеряна"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, lease_until = NULL, lease_token = NULL, finished_at = ? "
+                "WHERE id = ? AND status = ? AND lease_token = ?",
+                (COMPLETED, result, time.time(), job_id, RUNNING, token)
+            )
+        return cursor.rowcount == 1
+
+    def fail(self, job_id: str, token: str, error: str) -> bool:
+        """Сохранение ошибки; False, если аренда потеряна"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, lease_until = NULL, lease_token = NULL, finished_at = ? "
+                "WHERE id = ? AND status = ? AND lease_token = ?",
+                (FAILED, error, time.time(), job_id, RUNNING, token)
+            )
+        return cursor.rowcount == 1
+
+    def release(self, job_id: str, token: str) -> bool:
+        """Возврат захваченной задачи в очередь"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, lease_until = NULL, lease_token = NULL "
+                "WHERE id = ? AND status = ? AND lease_token = ?",
+                (QUEUED, job_id, RUNNING, token)
+            )
+        return cursor.rowcount == 1
+
+    def purge(self, older_than: float) -> int:
+        """Удаление завершенных задач старше older_than секунд"""
+        cutoff = time.time() - older_than
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?", (COMPLETED, FAILED, cutoff)
+            )
+        return cursor.rowcount
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def public(job: Dict[str, Any]) -> Dict[str, Any]:
+        """Поля задачи для ответа API"""
+        return {
+            "id": job["id"],
+            "status": job["status"],
+            "query": job["query"],
+            "filename": job["filename"],
+            "error": job["error"],
+            "attempts": job["attempts"],
+            "created_at": _timestamp(job["created_at"]),
+            "started_at": _timestamp(job["started_at"]),
+            "finished_at": _timestamp(job["finished_at"]),
+        }
+
+
+class JobWorkers:
+    """Пул воркеров, выполняющих задачи из хранилища
+
+    handler получает запись задачи (путь к документу, запрос, хэш) и
+    возвращает результат в виде JSON строки. Новые задачи этого процесса будят воркеры сразу,
+    задачи других процессов подхватываются опросом раз в poll_interval.
+    Обращения к SQLite выполняются в пуле потоков, чтобы не блокировать event loop.
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        handler: Callable[[Dict[str, Any]], Awaitable[str]],
+        workers: int = 2,
+        lease: float = 900.0,
+        poll_interval: float = 1.0,
+        max_attempts: int = 3
+    ):
+        self.store = store
+        self.handler = handler
+        self.workers = workers
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        if self._tasks or self.workers < 1:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._work(index)) for index in range(self.workers)]
+        logger.info(f"Запущено воркеров задач: {self.workers}")
+
+    def notify(self) -> None:
+        """Сигнал о новой задаче"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _work(self, index: int) -> None:
+        while True:
+            # Сигнал сбрасывается до проверки очереди, чтобы не пропустить новую задачу
+            self._wakeup.clear()
+            try:
+                job = await run_in_threadpool(self.store.claim, self.lease, self.max_attempts)
+            except sqlite3.Error as e:
+                logger.error(f"Воркер {index}: ошибка хранилища задач: {e}")
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self.run(job)
+
+    async def _heartbeat(self, job: Dict[str, Any]) -> None:
+        """Продление аренды, пока задача выполняется"""
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                renewed = await run_in_threadpool(self.store.renew, job["id"], job["lease_token"], self.lease)
+            except sqlite3.Error as e:
+                logger.warning(f"Задача {job['id']}: не удалось продлить аренду: {e}")
+                continue
+            if not renewed:
+                logger.warning(f"Задача {job['id']}: аренда потеряна, задачу выполняет другой воркер")
+                return
+
+    async def run(self, job: Dict[str, Any]) -> None:
+        """Выполнение задачи и сохранение результата или ошибки"""
+        if job["status"] == FAILED:
+            logger.error(f"Задача {job['id']}: {job['error']}")
+            self._remove_document(job)
+            return
+        logger.info(f"Задача {job['id']}: начало обработки (попытка {job['attempts']})")
+        token = job["lease_token"]
+        heartbeat = asyncio.create_task(self._heartbeat(job))
+        try:
+            result = await self.handler(job)
+        except asyncio.CancelledError:
+            # Остановка процесса: задача будет выполнена заново
+            await run_in_threadpool(self.store.release, job["id"], token)
+            raise
+        except Exception as e:
+            logger.error(f"Задача {job['id']} завершилась с ошибкой: {e}")
+            saved = await run_in_threadpool(self._finish, job, None, str(e))
+        else:
+            saved = await run_in_threadpool(self._finish, job, result, None)
+            if saved:
+                logger.info(f"Задача {job['id']} выполнена")
+        finally:
+            heartbeat.cancel()
+        if not saved:
+            # Документ нужен воркеру, который теперь владеет задачей
+            logger.warning(f"Задача {job['id']}: аренда потеряна, результат не сохранен")
+
+    def _finish(self, job: Dict[str, Any], result: Optional[str], error: Optional[str]) -> bool:
+        """Сохранение результата или ошибки и удаление документа задачи
+
+        Выполняется в пуле потоков целиком: остановка воркера во время
+        сохранения не оставляет документ завершенной задачи на диске.
+        """
+        if error is None:
+            saved = self.store.complete(job["id"], job["lease_token"], result)
+        else:
+            saved = self.store.fail(job["id"], job["lease_token"], error)
+        if saved:
+            self._remove_document(job)
+        return saved
+
+    @staticmethod
+    def _remove_document(job: Dict[str, Any]) -> None:
+        try:
+            os.unlink(job["file_path"])
+        except FileNotFoundError:
+            pass
@@ -1,17 +1,33 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 import uvicorn
 import os
+import asyncio
+import time
 import logging
 from pathlib import Path
 import tempfile
-import shutil
-from typing import Optional
+from typing import Optional, Tuple, BinaryIO
 import openai
-from openai import OpenAI
+from starlette.concurrency import run_in_threadpool
+from starlette.formparsers import MultiPartParser
 
-from .models import DocumentRequest, DocumentResponse, DocumentAnalysis, DSLTemplate
+from document_processor_v2.src.assistant_registry import AssistantRegistry
+from document_processor_v2.src.file_registry import (
+    DEFAULT_FILE_TTL, AsyncFileCollector, FileRegistry, FileTooLargeError, hash_stream, upload_name
+)
+from document_processor_v2.src.http_pool import async_openai_client, pool_stats, shared_transport, timeout_for
+from document_processor_v2.src.metrics import file_samples, metrics_operation, shared_metrics, timed_stage
+from document_processor_v2.src.rate_limiter import (
+    IMAGE_TOKENS, INTERACTIVE, MARKUP_OUTPUT_TOKENS, estimate_tokens, request_budget, request_priority
+)
+from document_processor_v2.src.run_poller import (
+    PollPolicy, RunDurations, RunFailedError, RunTimeoutError, apoll_run, astream_run, streaming_enabled
+)
+
+from .jobs import COMPLETED, FAILED, JobStore, JobWorkers
+from .models import DocumentRequest, DocumentResponse, DocumentAnalysis, DSLTemplate, JobStatus
 
 # Настройка логирования
 logging.basicConfig(
@@ -36,22 +52,54 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Загрузки до UPLOAD_SPOOL_BYTES остаются в памяти, большие уходят во временный файл
+MultiPartParser.spool_max_size = int(os.getenv('UPLOAD_SPOOL_BYTES', 1024 * 1024))
+# Предельный размер загружаемого документа
+MAX_UPLOAD_BYTES = int(os.getenv('MAX_UPLOAD_BYTES', 20 * 1024 * 1024))
+# Запас на заголовки multipart и поле query
+MULTIPART_OVERHEAD = 64 * 1024
+
+@app.middleware("http")
+async def limit_upload_size(request, call_next):
+    """Отказ по Content-Length до чтения тела запроса"""
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD:
+        return JSONResponse(status_code=413, content={"detail": f"Размер файла превышает {MAX_UPLOAD_BYTES} байт"})
+    return await call_next(request)
+
 class DocumentAssistant:
     def __init__(self):
         self.api_key = os.getenv('OPENAI_API_KEY')
         if not self.api_key:
             raise ValueError("Не установлена переменная окружения OPENAI_API_KEY")
         
-        self.client = OpenAI()
+        self.client = async_openai_client()
         self.script_dir = Path(__file__).parent.parent
+        self.registry = AssistantRegistry(
+            os.getenv('ASSISTANT_REGISTRY_PATH') or self.script_dir / 'cache' / 'assistants.json'
+        )
+        self.assistant_id: Optional[str] = None
+        self.assistant_lock = asyncio.Lock()
+        self.poll_policy = PollPolicy.from_env()
+        self.run_durations = RunDurations()
+        self.streaming = streaming_enabled()
+        # Загруженные файлы переиспользуются по хэшу и удаляются фоновым сборщиком
+        self.file_dedup = os.getenv('FILE_DEDUP', 'true').lower() != 'false'
+        self.file_registry = FileRegistry(
+            os.getenv('FILE_REGISTRY_PATH') or self.script_dir / 'cache' / 'files.json',
+            ttl=float(os.getenv('FILE_TTL', DEFAULT_FILE_TTL))
+        )
+        self.file_collector = AsyncFileCollector(self.file_registry, self.client)
+        # Состояние реестра файлов снимается при чтении метрик
+        shared_metrics().collector("file_registry", lambda: file_samples(self.file_registry.stats()))
 
     def load_prompts(self) -> tuple[str, str]:
         """Загрузка промптов из файлов"""
         try:
-            with open(self.script_dir / 'prompts/document_analyzer.prompt') as f:
+            with open(self.script_dir / 'scripts/prompts/document_analyzer.prompt') as f:
                 document_analyzer_prompt = f.read()
             
-            with open(self.script_dir / 'prompts/dsl_generator.prompt') as f:
+            with open(self.script_dir / 'scripts/prompts/dsl_generator.prompt') as f:
                 dsl_generator_prompt = f.read()
             
             return document_analyzer_prompt, dsl_generator_prompt
@@ -59,10 +107,17 @@ class DocumentAssistant:
             logger.error(f"Не удалось загрузить промпты: {e}")
             raise
 
-    def create_assistant(self) -> str:
-        """Создание ассистента"""
-        logger.info("Создание ассистента...")
-        
+    async def assistant_exists(self, assistant_id: str) -> bool:
+        """Проверка, что ассистент из реестра существует в OpenAI"""
+        try:
+            await self.client.beta.assistants.retrieve(assistant_id)
+            return True
+        except openai.NotFoundError:
+            logger.warning(f"Ассистент {assistant_id} не найден, будет создан заново")
+            return False
+
+    def build_instructions(self) -> str:
+        """Формирование инструкций ассистента"""
         document_analyzer_prompt, dsl_generator_prompt = self.load_prompts()
         
         instructions = f"""
@@ -124,45 +179,86 @@ class DocumentAssistant:
             }}
         }}
         """
+        return instructions
+
+    @timed_stage("assistant")
+    async def create_assistant(self) -> str:
+        """Получение ассистента из реестра или его создание при изменении промпта"""
+        async with self.assistant_lock:
+            if self.assistant_id:
+                return self.assistant_id
+
+            instructions = self.build_instructions()
+            name = "Document DSL Generator"
+            model = "gpt-4-vision-preview"
+            tools = [{"type": "code_interpreter"}]
+
+            async def create() -> str:
+                logger.info("Создание ассистента...")
+                assistant = await self.client.beta.assistants.create(
+                    name=name,
+                    description="Анализирует документы и создает DSL шаблоны для извлечения данных",
+                    model=model,
+                    instructions=instructions,
+                    tools=tools
+                )
+                return assistant.id
 
-        try:
-            assistant = self.client.beta.assistants.create(
-                name="Document DSL Generator",
-                description="Анализирует документы и создает DSL шаблоны для извлечения данных",
-                model="gpt-4-vision-preview",
-                instructions=instructions,
-                tools=[{"type": "code_interpreter"}]
-            )
-            return assistant.id
-        except openai.OpenAIError as e:
-            logger.error(f"Ошибка при создании ассистента: {e}")
-            raise
+            try:
+                self.assistant_id = await self.registry.aget_or_create(
+                    name, model, instructions, tools,
+                    create=create,
+                    exists=self.assistant_exists
+                )
+                return self.assistant_id
+            except openai.OpenAIError as e:
+                logger.error(f"Ошибка при создании ассистента: {e}")
+                raise
 
-    def create_thread(self) -> str:
+    @timed_stage("thread")
+    async def create_thread(self) -> str:
         """Создание треда"""
         logger.info("Создание треда...")
         try:
-            thread = self.client.beta.threads.create()
+            thread = await self.client.beta.threads.create()
             return thread.id
         except openai.OpenAIError as e:
             logger.error(f"Ошибка при создании треда: {e}")
             raise
 
-    def upload_file(self, file_path: str) -> str:
-        """Загрузка файла"""
+    @timed_stage("upload")
+    async def upload_file(self, stream: BinaryIO, filename: str, digest: Optional[str] = None) -> str:
+        """Загрузка файла из потока или ID уже загруженного файла с тем же содержимым
+
+        digest - SHA-256 содержимого, если он уже посчитан при приеме файла.
+        """
         logger.info("Загрузка файла...")
         try:
-            with open(file_path, 'rb') as f:
-                file = self.client.files.create(
-                    file=f,
-                    purpose='assistants'
+            if not self.file_dedup:
+                file = await self.client.files.create(
+                    file=(filename, stream), purpose='assistants', timeout=timeout_for("upload")
                 )
-            return file.id
+                return file.id
+
+            if digest is None:
+                digest = (await run_in_threadpool(hash_stream, stream))[0]
+                stream.seek(0)
+            file_id = await run_in_threadpool(self.file_registry.acquire, digest)
+            if file_id:
+                logger.info(f"Файл уже загружен: {file_id}")
+                return file_id
+            file = await self.client.files.create(
+                file=(upload_name(digest, filename, self.file_registry.prefix), stream),
+                purpose='assistants',
+                timeout=timeout_for("upload")
+            )
+            return await run_in_threadpool(self.file_registry.register, digest, file.id, file.bytes)
         except (openai.OpenAIError, IOError) as e:
             logger.error(f"Ошибка при загрузке файла: {e}")
             raise
 
-    def add_message(self, thread_id: str, content: str, file_id: Optional[str] = None) -> str:
+    @timed_stage("message")
+    async def add_message(self, thread_id: str, content: str, file_id: Optional[str] = None) -> str:
         """Добавление сообщения в тред"""
         logger.info("Отправка сообщения...")
         try:
@@ -174,7 +270,7 @@ class DocumentAssistant:
             if file_id:
                 message_params["file_ids"] = [file_id]
             
-            message = self.client.beta.threads.messages.create(
+            message = await self.client.beta.threads.messages.create(
                 thread_id=thread_id,
                 **message_params
             )
@@ -183,11 +279,11 @@ class DocumentAssistant:
             logger.error(f"Ошибка при отправке сообщения: {e}")
             raise
 
-    def run_assistant(self, thread_id: str, assistant_id: str) -> str:
+    async def run_assistant(self, thread_id: str, assistant_id: str) -> str:
         """Запуск выполнения"""
         logger.info("Запуск обработки...")
         try:
-            run = self.client.beta.threads.runs.create(
+            run = await self.client.beta.threads.runs.create(
                 thread_id=thread_id,
                 assistant_id=assistant_id
             )
@@ -196,91 +292,221 @@ class DocumentAssistant:
             logger.error(f"Ошибка при запуске ассистента: {e}")
             raise
 
-    def wait_for_completion(self, thread_id: str, run_id: str) -> None:
-        """Ожидание завершения выполнения"""
+    async def wait_for_completion(self, thread_id: str, run_id: str, assistant_id: Optional[str] = None) -> None:
+        """Ожидание завершения выполнения с адаптивным опросом"""
         logger.info("Ожидание результата...")
-        while True:
-            try:
-                run = self.client.beta.threads.runs.retrieve(
-                    thread_id=thread_id,
-                    run_id=run_id
+        try:
+            elapsed = await apoll_run(
+                lambda: self.client.beta.threads.runs.retrieve(
+                    thread_id=thread_id, run_id=run_id, timeout=timeout_for("poll")
+                ),
+                run_id,
+                self.poll_policy,
+                self.run_durations.expected(assistant_id) if assistant_id else None
+            )
+            if assistant_id:
+                self.run_durations.record(assistant_id, elapsed)
+        except (openai.OpenAIError, RunFailedError, RunTimeoutError) as e:
+            logger.error(f"Ошибка при проверке статуса: {e}")
+            raise
+
+    @timed_stage("run")
+    async def run_and_wait(self, thread_id: str, assistant_id: str) -> str:
+        """Запуск ассистента и ожидание завершения (опросом или по потоку событий)"""
+        if not self.streaming:
+            run_id = await self.run_assistant(thread_id, assistant_id)
+            await self.wait_for_completion(thread_id, run_id, assistant_id)
+            return run_id
+
+        logger.info("Запуск обработки с потоком событий...")
+        try:
+            started = time.monotonic()
+            async with await self.client.beta.threads.runs.create(
+                thread_id=thread_id,
+                assistant_id=assistant_id,
+                stream=True,
+                timeout=timeout_for("stream")
+            ) as events:
+                run_id = await astream_run(
+                    events,
+                    lambda run_id: self.client.beta.threads.runs.retrieve(
+                        thread_id=thread_id, run_id=run_id, timeout=timeout_for("poll")
+                    ),
+                    self.poll_policy,
+                    self.run_durations.expected(assistant_id)
                 )
-                if run.status == "completed":
-                    break
-                elif run.status in ["failed", "cancelled", "expired"]:
-                    raise RuntimeError(f"Выполнение завершилось с ошибкой: {run.status}")
-                time.sleep(1)
-            except openai.OpenAIError as e:
-                logger.error(f"Ошибка при проверке статуса: {e}")
-                raise
+            self.run_durations.record(assistant_id, time.monotonic() - started)
+            return run_id
+        except (openai.OpenAIError, RunFailedError, RunTimeoutError) as e:
+            logger.error(f"Ошибка при выполнении ассистента: {e}")
+            raise
 
-    def get_result(self, thread_id: str) -> str:
+    @timed_stage("result")
+    async def get_result(self, thread_id: str) -> str:
         """Получение результата"""
         logger.info("Получение результата...")
         try:
-            messages = self.client.beta.threads.messages.list(
+            messages = await self.client.beta.threads.messages.list(
                 thread_id=thread_id,
                 order="desc",
-                limit=1
+                limit=1,
+                timeout=timeout_for("list")
             )
             return messages.data[0].content[0].text.value
         except openai.OpenAIError as e:
             logger.error(f"Ошибка при получении результата: {e}")
             raise
 
-    def cleanup(self, file_id: str) -> None:
-        """Очистка временных файлов"""
+    @timed_stage("cleanup")
+    async def cleanup(self, file_id: str) -> None:
+        """Очистка временных файлов; при дедупликации файл удалит сборщик"""
+        if self.file_dedup:
+            await run_in_threadpool(self.file_registry.release, file_id)
+            return
         logger.info("Удаление временных файлов...")
         try:
-            self.client.files.delete(file_id)
+            await self.client.files.delete(file_id)
         except openai.OpenAIError as e:
             logger.warning(f"Ошибка при удалении файла: {e}")
 
-    async def process_document(self, file: UploadFile, query: str) -> DocumentResponse:
-        """Обработка документа через API"""
-        # Сохраняем загруженный файл во временную директорию
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as tmp:
-            shutil.copyfileobj(file.file, tmp)
-            tmp_path = tmp.name
+    @staticmethod
+    @timed_stage("receive")
+    async def receive_upload(file: UploadFile, sink: Optional[BinaryIO] = None) -> str:
+        """Проверка размера и хэш загруженного файла за один проход; возвращает SHA-256
+
+        Файл уже лежит в буфере multipart парсера (в памяти или на диске),
+        поэтому он не копируется, а при sink копируется в тот же проход.
+        """
+        def consume() -> str:
+            file.file.seek(0)
+            digest, _ = hash_stream(file.file, sink, MAX_UPLOAD_BYTES)
+            file.file.seek(0)
+            return digest
 
         try:
-            # 1. Создание ассистента
-            assistant_id = self.create_assistant()
+            return await run_in_threadpool(consume)
+        except FileTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+
+    async def save_upload(self, file: UploadFile, directory: Path) -> Tuple[str, str]:
+        """Сохранение загруженного файла в directory; возвращает путь и SHA-256"""
+        with tempfile.NamedTemporaryFile(
+            delete=False, suffix=os.path.splitext(file.filename or '')[1], dir=directory
+        ) as tmp:
+            try:
+                digest = await self.receive_upload(file, tmp)
+            except BaseException:
+                tmp.close()
+                os.unlink(tmp.name)
+                raise
+            return tmp.name, digest
 
-            # 2. Создание треда
-            thread_id = self.create_thread()
+    @timed_stage("total")
+    async def analyze(self, stream: BinaryIO, filename: str, query: str,
+                      digest: Optional[str] = None) -> DocumentResponse:
+        """Анализ документа из потока"""
+        # 1. Получение ассистента (создается один раз на версию промпта)
+        assistant_id = await self.create_assistant()
 
-            # 3. Загрузка документа
-            file_id = self.upload_file(tmp_path)
+        # 2. Создание треда
+        thread_id = await self.create_thread()
 
-            try:
-                # 4. Добавление сообщения
-                self.add_message(thread_id, query, file_id)
+        # 3. Загрузка документа
+        file_id = await self.upload_file(stream, filename, digest)
 
-                # 5. Запуск ассистента
-                run_id = self.run_assistant(thread_id, assistant_id)
+        try:
+            # 4. Добавление сообщения
+            await self.add_message(thread_id, query, file_id)
 
-                # 6. Ожидание завершения
-                self.wait_for_completion(thread_id, run_id)
+            # 5-6. Запуск ассистента и ожидание завершения
+            with request_budget(IMAGE_TOKENS + MARKUP_OUTPUT_TOKENS + estimate_tokens(query)):
+                await self.run_and_wait(thread_id, assistant_id)
 
-                # 7. Получение результата
-                result = self.get_result(thread_id)
+            # 7. Получение результата
+            result = await self.get_result(thread_id)
 
-                # 8. Преобразование результата в DocumentResponse
-                return DocumentResponse.parse_raw(result)
+            # 8. Преобразование результата в DocumentResponse
+            return DocumentResponse.parse_raw(result)
 
-            finally:
-                # 9. Очистка
-                self.cleanup(file_id)
-                os.unlink(tmp_path)
+        finally:
+            # 9. Очистка
+            await self.cleanup(file_id)
 
+    async def process_document(self, file: UploadFile, query: str) -> DocumentResponse:
+        """Обработка документа через API без промежуточной копии на диске"""
+        digest = await self.receive_upload(file)
+        try:
+            return await self.analyze(file.file, file.filename or 'document', query, digest)
         except Exception as e:
             logger.error(f"Ошибка при обработке документа: {e}")
             raise HTTPException(status_code=500, detail=str(e))
 
+    async def run_job(self, job: dict) -> str:
+        """Обработчик фоновой задачи: результат анализа в виде JSON"""
+        with open(job["file_path"], 'rb') as f, metrics_operation("job"):
+            result = await self.analyze(f, job["filename"] or job["file_path"], job["query"], job["sha256"])
+        return result.json()
+
 # Создание экземпляра DocumentAssistant
 assistant = DocumentAssistant()
 
+# Фоновые задачи: документы ждут обработки в JOBS_DIR, записи - в SQLite
+jobs_dir = Path(os.getenv('JOBS_DIR') or assistant.script_dir / 'cache' / 'jobs')
+job_store = JobStore(os.getenv('JOBS_DB_PATH') or assistant.script_dir / 'cache' / 'jobs.sqlite3')
+job_workers = JobWorkers(
+    job_store,
+    assistant.run_job,
+    workers=int(os.getenv('JOB_WORKERS', 2)),
+    lease=float(os.getenv('JOB_LEASE', 900)),
+    max_attempts=int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+)
+
+@app.on_event("startup")
+async def prepare_assistant() -> None:
+    """Предварительное создание ассистента при старте приложения"""
+    try:
+        await assistant.create_assistant()
+    except Exception as e:
+        logger.warning(f"Не удалось подготовить ассистента при старте: {e}")
+
+@app.on_event("startup")
+async def start_job_workers() -> None:
+    """Удаление старых задач и запуск воркеров"""
+    jobs_dir.mkdir(parents=True, exist_ok=True)
+    purged = await run_in_threadpool(job_store.purge, float(os.getenv('JOB_RETENTION', 7 * 24 * 3600)))
+    if purged:
+        logger.info(f"Удалено устаревших задач: {purged}")
+    job_workers.start()
+
+@app.on_event("startup")
+async def start_file_collector() -> None:
+    """Запуск фонового удаления загруженных файлов"""
+    if assistant.file_dedup:
+        assistant.file_collector.start(float(os.getenv('FILE_GC_INTERVAL', 300)))
+
+@app.on_event("shutdown")
+async def close_client() -> None:
+    """Остановка фоновых задач и закрытие общего пула HTTP соединений клиентов OpenAI"""
+    await job_workers.stop()
+    await assistant.file_collector.stop()
+    await shared_transport().aclose()
+
+@app.get("/stats/pool")
+async def connection_pool_stats() -> dict:
+    """Использование пула соединений и квот OpenAI API"""
+    return pool_stats()
+
+@app.get("/stats/files")
+async def uploaded_files_stats() -> dict:
+    """Файлы, загруженные в OpenAI и учтенные в реестре"""
+    return await run_in_threadpool(assistant.file_registry.stats)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics() -> PlainTextResponse:
+    """Метрики этапов, запусков, токенов и кэшей в текстовом формате Prometheus"""
+    content = await run_in_threadpool(shared_metrics().render)
+    return PlainTextResponse(content, media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.post("/analyze", response_model=DocumentResponse)
 async def analyze_document(
     file: UploadFile = File(...),
@@ -298,9 +524,58 @@ async def analyze_document(
         query = "Проанализируй документ и создай DSL шаблон для извлечения всех ключевых элементов"
         
     try:
-        return await assistant.process_document(file, query)
+        # Интерактивные запросы получают квоту API раньше пакетной обработки
+        with request_priority(INTERACTIVE), metrics_operation("analyze"):
+            return await assistant.process_document(file, query)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/jobs", response_model=JobStatus, status_code=202)
+async def submit_job(
+    file: UploadFile = File(...),
+    query: str = None
+) -> JobStatus:
+    """
+    Постановка документа в очередь на анализ.
+
+    Возвращает задачу сразу; состояние - `GET /jobs/{id}`, результат -
+    `GET /jobs/{id}/result` после завершения.
+    """
+    if not query:
+        query = "Проанализируй документ и создай DSL шаблон для извлечения всех ключевых элементов"
+
+    jobs_dir.mkdir(parents=True, exist_ok=True)
+    file_path, digest = await assistant.save_upload(file, jobs_dir)
+    try:
+        job = await run_in_threadpool(job_store.create, query, file.filename, file_path, digest)
     except Exception as e:
+        os.unlink(file_path)
+        logger.error(f"Ошибка при создании задачи: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    job_workers.notify()
+    return JobStatus(**JobStore.public(job))
+
+@app.get("/jobs/{job_id}", response_model=JobStatus)
+async def get_job(job_id: str) -> JobStatus:
+    """Состояние задачи"""
+    job = await run_in_threadpool(job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    return JobStatus(**JobStore.public(job))
+
+@app.get("/jobs/{job_id}/result", response_model=DocumentResponse)
+async def get_job_result(job_id: str) -> DocumentResponse:
+    """Результат выполненной задачи; 409, пока задача не завершена успешно"""
+    job = await run_in_threadpool(job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    if job["status"] == FAILED:
+        raise HTTPException(status_code=409, detail=f"Задача завершилась с ошибкой: {job['error']}")
+    if job["status"] != COMPLETED:
+        raise HTTPException(status_code=409, detail=f"Задача еще не выполнена: {job['status']}")
+    return DocumentResponse.parse_raw(job["result"])
 
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
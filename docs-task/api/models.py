@@ -53,3 +53,20 @@ class DocumentRequest(BaseModel):
 class DocumentResponse(BaseModel):
     analysis: DocumentAnalysis = Field(..., description="Результат анализа документа")
     dsl_template: DSLTemplate = Field(..., description="Сгенерированный DSL шаблон")
+
+class JobState(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+class JobStatus(BaseModel):
+    id: str = Field(..., description="Идентификатор задачи")
+    status: JobState = Field(..., description="Состояние задачи")
+    query: str = Field(..., description="Запрос пользователя")
+    filename: Optional[str] = Field(default=None, description="Имя загруженного файла")
+    error: Optional[str] = Field(default=None, description="Ошибка обработки")
+    attempts: int = Field(default=0, description="Число попыток обработки")
+    created_at: Optional[str] = Field(default=None, description="Время постановки в очередь")
+    started_at: Optional[str] = Field(default=None, description="Время начала обработки")
+    finished_at: Optional[str] = Field(default=None, description="Время завершения")
@@ -0,0 +1,119 @@
+import asyncio
+import time
+
+from api.jobs import COMPLETED, FAILED, QUEUED, RUNNING, JobStore, JobWorkers
+
+
+def make_store(tmp_path):
+    return JobStore(tmp_path / 'jobs.sqlite3')
+
+
+def make_job(store, tmp_path, name='doc.png'):
+    path = tmp_path / name
+    path.write_bytes(b'image')
+    return store.create('запрос', name, str(path))
+
+
+def test_claim_issues_lease_token(tmp_path):
+    store = make_store(tmp_path)
+    job = make_job(store, tmp_path)
+    claimed = store.claim(lease=60)
+    assert claimed["id"] == job["id"]
+    assert claimed["status"] == RUNNING
+    assert claimed["attempts"] == 1
+    assert claimed["lease_token"]
+    assert store.claim(lease=60) is None
+
+
+def test_stale_worker_cannot_overwrite_result(tmp_path):
+    store = make_store(tmp_path)
+    job = make_job(store, tmp_path)
+    first = store.claim(lease=0)
+    time.sleep(0.01)
+    # Аренда истекла, задачу захватил другой воркер
+    second = store.claim(lease=60)
+    assert second["id"] == job["id"] and second["attempts"] == 2
+
+    assert not store.complete(job["id"], first["lease_token"], '{"stale": true}')
+    assert not store.fail(job["id"], first["lease_token"], 'ошибка')
+    assert not store.renew(job["id"], first["lease_token"], 60)
+    assert not store.release(job["id"], first["lease_token"])
+    assert store.complete(job["id"], second["lease_token"], '{"ok": true}')
+    assert store.get(job["id"])["result"] == '{"ok": true}'
+
+
+def test_renew_extends_lease(tmp_path):
+    store = make_store(tmp_path)
+    make_job(store, tmp_path)
+    claimed = store.claim(lease=0)
+    assert store.renew(claimed["id"], claimed["lease_token"], 60)
+    time.sleep(0.01)
+    assert store.claim(lease=60) is None
+
+
+def test_claim_fails_job_after_max_attempts(tmp_path):
+    store = make_store(tmp_path)
+    job = make_job(store, tmp_path)
+    for _ in range(2):
+        assert store.claim(lease=0, max_attempts=2)["status"] == RUNNING
+        time.sleep(0.01)
+    exhausted = store.claim(lease=0, max_attempts=2)
+    assert exhausted["id"] == job["id"]
+    assert exhausted["status"] == FAILED
+    assert "попыток" in exhausted["error"]
+    assert store.claim(lease=0, max_attempts=2) is None
+
+
+def test_release_returns_job_to_queue(tmp_path):
+    store = make_store(tmp_path)
+    make_job(store, tmp_path)
+    claimed = store.claim(lease=60)
+    assert store.release(claimed["id"], claimed["lease_token"])
+    assert store.get(claimed["id"])["status"] == QUEUED
+
+
+def test_worker_renews_lease_and_removes_document(tmp_path):
+    store = make_store(tmp_path)
+    job = make_job(store, tmp_path)
+
+    async def handler(job):
+        # Обработка дольше аренды: без продления задачу захватил бы другой воркер
+        await asyncio.sleep(0.3)
+        assert store.claim(lease=0.1) is None
+        return '{"ok": true}'
+
+    async def scenario():
+        workers = JobWorkers(store, handler, workers=1, lease=0.15, poll_interval=0.05)
+        workers.start()
+        for _ in range(100):
+            if store.get(job["id"])["status"] == COMPLETED:
+                break
+            await asyncio.sleep(0.02)
+        await workers.stop()
+
+    asyncio.run(scenario())
+    finished = store.get(job["id"])
+    assert finished["status"] == COMPLETED
+    assert finished["attempts"] == 1
+    assert not (tmp_path / 'doc.png').exists()
+
+
+def test_worker_keeps_document_when_lease_lost(tmp_path):
+    store = make_store(tmp_path)
+    job = make_job(store, tmp_path)
+    stolen = {}
+
+    async def handler(job):
+        # Другой воркер забирает задачу, пока эта обработка еще идет
+        store.release(job["id"], job["lease_token"])
+        stolen.update(store.claim(lease=60))
+        return '{"stale": true}'
+
+    async def scenario():
+        workers = JobWorkers(store, handler, workers=1, lease=60)
+        await workers.run(store.claim(lease=60))
+
+    asyncio.run(scenario())
+    assert store.get(job["id"])["status"] == RUNNING
+    assert store.get(job["id"])["lease_token"] == stolen["lease_token"]
+    assert (tmp_path / 'doc.png').exists()
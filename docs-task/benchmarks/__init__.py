@@ -0,0 +1,18 @@
+"""
+Benchmarks
+----------
+Бенчмарки производительности с локальной заменой OpenAI API.
+
+- mock_openai: Локальный сервер, имитирующий Assistants и Files API
+- bench_api: Пропускная способность эндпоинта /analyze
+- synthetic: Синтетическая разметка страниц и фиксированный набор УПД для оценки шаблонов
+- bench_dsl: Скорость метрик пересечения и применения DSL шаблонов
+- bench_polling: Ожидание запусков: фиксированный опрос, адаптивный, поток событий
+- bench_rate_limit: Планировщик квот против повторов по 429
+- bench_preprocess: Экономия байтов и времени загрузки при подготовке изображений
+- bench_markup: Память и скорость компактной разметки против словарей
+- bench_layout: Переиспользование шаблонов для документов одного макета
+- bench_query_index: Канонические ключи перефразированных запросов и число запусков ассистента
+- suite: Набор сценариев (документ, кэш, пакет, /analyze) со сравнением коммитов
+- eval_prompt_encoding: Качество шаблонов и токены при сжатой и отобранной разметке в промпте
+"""
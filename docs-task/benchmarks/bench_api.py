@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import asyncio
+import statistics
+from pathlib import Path
+from typing import Dict, Any, List
+
+from .mock_openai import MockConfig, MockServer
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Перцентиль q (0-100) с линейной интерполяцией"""
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+async def run_load(app, requests: int, concurrency: int, payload: bytes) -> Dict[str, Any]:
+    """Отправка requests запросов к /analyze не более чем по concurrency одновременно"""
+    import httpx
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors = 0
+
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app),
+        base_url="http://bench",
+        timeout=None
+    ) as client:
+        async def one() -> None:
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post(
+                    "/analyze",
+                    params={"query": "найди ИНН продавца"},
+                    files={"file": ("20.jpg", payload, "image/jpeg")}
+                )
+                latencies.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(requests)))
+        wall = time.perf_counter() - started
+
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "wall_time_s": round(wall, 3),
+        "throughput_rps": round(requests / wall, 2),
+        "latency_mean_s": round(statistics.mean(latencies), 3),
+        "latency_p50_s": round(percentile(latencies, 50), 3),
+        "latency_p95_s": round(percentile(latencies, 95), 3),
+        "latency_max_s": round(max(latencies), 3),
+    }
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Бенчмарк пропускной способности /analyze')
+    parser.add_argument('--requests', type=int, default=200, help='Количество запросов')
+    parser.add_argument('--concurrency', type=int, default=200, help='Число одновременных запросов')
+    parser.add_argument('--run-duration', type=float, default=1.0, help='Длительность запуска, сек')
+
+    args = parser.parse_args()
+    config = MockConfig(run_duration=args.run_duration)
+
+    with MockServer(config) as server:
+        os.environ["OPENAI_BASE_URL"] = server.base_url
+        os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+        sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+        from api.main import app
+
+        payload = b"\xff\xd8\xff" + os.urandom(64 * 1024)
+
+        async def scenario():
+            # Базовая линия: один запрос за раз, как при блокирующем event loop
+            baseline = await run_load(app, min(args.requests, 5), 1, payload)
+            loaded = await run_load(app, args.requests, args.concurrency, payload)
+            return baseline, loaded
+
+        baseline, loaded = asyncio.run(scenario())
+
+    report = {
+        "baseline": baseline,
+        "concurrent": loaded,
+        "speedup": round(loaded["throughput_rps"] / baseline["throughput_rps"], 1),
+        "mock_requests": server.state.request_count,
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+import json
+import time
+from typing import Callable, Dict, Any, List
+
+from document_processor_v2.src.dsl_engine import DocumentIndex, TemplateEngine, extraction_box
+from document_processor_v2.src.intersection import as_boxes, get_metric
+
+from .synthetic import synthetic_markup, field_template
+
+
+def measure(fn: Callable[[], Any], repeat: int) -> float:
+    """Среднее время вызова в микросекундах"""
+    fn()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat * 1e6
+
+
+def apply_all(engines: List[TemplateEngine], document: DocumentIndex) -> List[Dict[str, Any]]:
+    return [engine.apply(document) for engine in engines]
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Бенчмарк локального применения DSL шаблонов')
+    parser.add_argument('--tokens', type=int, default=5000, help='Число элементов разметки')
+    parser.add_argument('--fields', type=int, default=20, help='Число атрибутов (полей)')
+    parser.add_argument('--repeat', type=int, default=200, help='Число повторов')
+
+    args = parser.parse_args()
+    markup = synthetic_markup(args.tokens, args.fields)
+
+    started = time.perf_counter()
+    document = DocumentIndex(markup)
+    build_ms = (time.perf_counter() - started) * 1e3
+
+    engines = [TemplateEngine(field_template(field)) for field in range(args.fields)]
+    metric = get_metric("Overlap")
+    area_config = field_template(0)["extraction_area"]
+    anchors = [
+        document.find_anchor(f"Поле {field + 1:02d}:", 0.9)[0][2]
+        for field in range(args.fields)
+    ]
+    areas = [extraction_box(anchor, "right", area_config) for anchor in anchors]
+
+    report: Dict[str, Any] = {
+        "tokens": len(markup["text_items"]),
+        "fields": args.fields,
+        "index_build_ms": round(build_ms, 2),
+        # Все области по всем элементам страницы одной матрицей
+        "overlap_all_items_us": round(measure(
+            lambda: metric(document.box_array, as_boxes(areas)) >= 0.6, args.repeat), 1),
+        # Отдельный расчет по кандидатам индекса для каждой области
+        "overlap_per_area_us": round(measure(
+            lambda: [document.items_in_area(area, metric, 0.6) for area in areas], args.repeat), 1),
+        # Одна матрица по объединению кандидатов всех областей
+        "overlap_batched_us": round(measure(
+            lambda: document.items_in_areas(areas, metric, 0.6), args.repeat), 1),
+        # Первое применение к документу: строится индекс текста для якорей
+        "first_apply_templates_ms": round(measure(
+            lambda: apply_all(engines, DocumentIndex(markup, document.spatial)),
+            max(1, args.repeat // 20)) / 1e3, 2),
+        # Повторное применение: поиск якорей берется из индекса документа
+        "apply_templates_us": round(measure(
+            lambda: apply_all(engines, document), args.repeat), 1),
+    }
+    values = [engine.apply(document)["value"] for engine in engines]
+    report["found"] = sum(value is not None for value in values)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
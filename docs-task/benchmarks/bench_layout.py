@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import tempfile
+from typing import Dict, Any
+
+from .eval_prompt_encoding import mock_template
+from .mock_openai import MockConfig, MockServer
+from .synthetic import upd_markup
+
+QUERY = "ИНН продавца"
+
+
+def run(documents: int, layouts: int, layout_index: bool, run_duration: float) -> Dict[str, Any]:
+    """Генерация шаблонов для потока документов нескольких макетов"""
+    config = MockConfig(
+        queue_time=0.01, run_duration=run_duration,
+        responses={"DSL Template Generator": mock_template()}
+    )
+    with MockServer(config) as server, tempfile.TemporaryDirectory(prefix='bench-layout-') as workdir:
+        os.environ.update(
+            OPENAI_BASE_URL=server.base_url, OPENAI_API_KEY="mock", CACHE_DIR=workdir,
+            ASSISTANT_REGISTRY_PATH=os.path.join(workdir, 'assistants.json'),
+            FILE_REGISTRY_PATH=os.path.join(workdir, 'files.json'),
+            LAYOUT_INDEX_PATH=os.path.join(workdir, 'layouts.json'),
+            LAYOUT_INDEX='true' if layout_index else 'false',
+        )
+        from document_processor_v2.src.document_processor import DocumentProcessor
+
+        processor = DocumentProcessor()
+        correct = 0
+        started = time.perf_counter()
+        for seed in range(documents):
+            case = upd_markup(seed, layout=seed % layouts)
+            template = processor.generate_template(case["markup"], QUERY)
+            value = processor.extract_data(case["markup"], {QUERY: template})[QUERY]["value"]
+            correct += value == case["expected"][QUERY]
+        elapsed = time.perf_counter() - started
+
+        return {
+            "layout_index": layout_index,
+            "template_runs": len(server.state.runs),
+            "seconds": round(elapsed, 2),
+            "accuracy": round(correct / documents, 3),
+            **({"index": processor.assistant_manager.layout_index.stats()} if layout_index else {}),
+        }
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Переиспользование шаблонов для документов одного макета')
+    parser.add_argument('--documents', type=int, default=40, help='Число документов')
+    parser.add_argument('--layouts', type=int, default=4, help='Число макетов поставщиков')
+    parser.add_argument('--run-duration', type=float, default=0.2, help='Длительность запуска ассистента, с')
+
+    args = parser.parse_args()
+    report = {
+        "documents": args.documents,
+        "layouts": args.layouts,
+        "baseline": run(args.documents, args.layouts, False, args.run_duration),
+        "layout_index": run(args.documents, args.layouts, True, args.run_duration),
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+import gc
+import json
+import time
+import tracemalloc
+from typing import Callable, Dict, Any, List
+
+from document_processor_v2.src.cache import markup_hash
+from document_processor_v2.src.markup import Markup
+
+from .synthetic import synthetic_markup
+
+
+def traced(build: Callable[[], List[Any]]) -> float:
+    """Память, занятая результатом build, в байтах на элемент разметки"""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    items = sum(len(markup["text_items"]) if isinstance(markup, dict) else len(markup) for markup in result)
+    return size / items
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Память и скорость компактной разметки')
+    parser.add_argument('--tokens', type=int, default=2000, help='Элементов на страницу')
+    parser.add_argument('--documents', type=int, default=50, help='Число разметок в памяти')
+
+    args = parser.parse_args()
+    payloads = [
+        json.dumps(synthetic_markup(args.tokens, seed=seed), ensure_ascii=False).encode('utf-8')
+        for seed in range(args.documents)
+    ]
+
+    report: Dict[str, Any] = {
+        "tokens": args.tokens,
+        "documents": args.documents,
+        "dict_bytes_per_item": round(traced(lambda: [json.loads(data) for data in payloads]), 1),
+        "markup_bytes_per_item": round(traced(lambda: [Markup.from_json(data) for data in payloads]), 1),
+    }
+
+    started = time.perf_counter()
+    dicts = [json.loads(data) for data in payloads]
+    report["json_loads_ms"] = round((time.perf_counter() - started) * 1e3 / args.documents, 2)
+
+    started = time.perf_counter()
+    compact = [Markup.from_dict(markup) for markup in dicts]
+    report["from_dict_ms"] = round((time.perf_counter() - started) * 1e3 / args.documents, 2)
+
+    started = time.perf_counter()
+    restored = [markup.to_dict() for markup in compact]
+    report["to_dict_ms"] = round((time.perf_counter() - started) * 1e3 / args.documents, 2)
+
+    report["lossless"] = all(
+        original == back and markup_hash(original) == markup_hash(back)
+        for original, back in zip(dicts, restored)
+    )
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
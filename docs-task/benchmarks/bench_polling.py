@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+import json
+import time
+import asyncio
+from typing import Dict, Any, List
+
+from openai import OpenAI, AsyncOpenAI
+
+from document_processor_v2.src.run_poller import (
+    PollPolicy, RunDurations, RunFailedError, RunTimeoutError, poll_run, apoll_run, stream_run, astream_run
+)
+
+from .mock_openai import MockConfig, MockServer
+
+
+def fixed_poll(client: OpenAI, thread_id: str, run_id: str) -> None:
+    """Прежняя схема: опрос раз в секунду"""
+    while True:
+        run = client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run_id)
+        if run.status == "completed":
+            return
+        if run.status in ("failed", "cancelled", "expired"):
+            raise RuntimeError(f"Выполнение завершилось с ошибкой: {run.status}")
+        time.sleep(1)
+
+
+def measure_sync(client: OpenAI, server: MockServer, mode: str, expected: float,
+                 durations: RunDurations) -> Dict[str, Any]:
+    """Задержка обнаружения завершения и число запросов для одного запуска"""
+    thread_id = client.beta.threads.create().id
+    before = server.state.request_count
+    started = time.monotonic()
+    if mode == "stream":
+        with client.beta.threads.runs.create(thread_id=thread_id, assistant_id="asst_mock", stream=True) as events:
+            stream_run(events, lambda run_id: client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run_id))
+    else:
+        run_id = client.beta.threads.runs.create(thread_id=thread_id, assistant_id="asst_mock").id
+        if mode == "fixed":
+            fixed_poll(client, thread_id, run_id)
+        else:
+            # adaptive-history использует длительность предыдущих запусков
+            hint = durations.expected("mock") if mode == "adaptive-history" else None
+            durations.record("mock", poll_run(
+                lambda: client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run_id), run_id, expected=hint
+            ))
+    elapsed = time.monotonic() - started
+    return {
+        "mode": mode,
+        "elapsed_s": round(elapsed, 3),
+        "overshoot_s": round(elapsed - expected, 3),
+        "requests": server.state.request_count - before - 1,
+    }
+
+
+async def measure_async(server: MockServer, mode: str, expected: float) -> Dict[str, Any]:
+    client = AsyncOpenAI(base_url=server.base_url, api_key="mock")
+    try:
+        thread_id = (await client.beta.threads.create()).id
+        before = server.state.request_count
+        started = time.monotonic()
+        if mode == "async-stream":
+            async with await client.beta.threads.runs.create(
+                thread_id=thread_id, assistant_id="asst_mock", stream=True
+            ) as events:
+                await astream_run(
+                    events, lambda run_id: client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run_id)
+                )
+        else:
+            run_id = (await client.beta.threads.runs.create(thread_id=thread_id, assistant_id="asst_mock")).id
+            await apoll_run(lambda: client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run_id), run_id)
+        elapsed = time.monotonic() - started
+    finally:
+        await client.close()
+    return {
+        "mode": mode,
+        "elapsed_s": round(elapsed, 3),
+        "overshoot_s": round(elapsed - expected, 3),
+        "requests": server.state.request_count - before - 1,
+    }
+
+
+def check_failures(config: MockConfig) -> Dict[str, str]:
+    """Неуспешный запуск и превышение срока должны завершать ожидание ошибкой"""
+    outcomes = {}
+    failing = MockConfig(queue_time=config.queue_time, run_duration=config.run_duration, final_status="failed")
+    with MockServer(failing) as server:
+        client = OpenAI(base_url=server.base_url, api_key="mock")
+        thread_id = client.beta.threads.create().id
+        for mode in ("adaptive", "stream"):
+            try:
+                if mode == "stream":
+                    with client.beta.threads.runs.create(
+                        thread_id=thread_id, assistant_id="asst_mock", stream=True
+                    ) as events:
+                        stream_run(events, lambda run_id: client.beta.threads.runs.retrieve(
+                            thread_id=thread_id, run_id=run_id))
+                else:
+                    run_id = client.beta.threads.runs.create(thread_id=thread_id, assistant_id="asst_mock").id
+                    poll_run(lambda: client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run_id), run_id)
+                outcomes[f"failed_{mode}"] = "not raised"
+            except RunFailedError as e:
+                outcomes[f"failed_{mode}"] = e.status
+
+        run_id = client.beta.threads.runs.create(thread_id=thread_id, assistant_id="asst_mock").id
+        try:
+            poll_run(lambda: client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run_id), run_id,
+                     PollPolicy(deadline=config.queue_time / 2))
+            outcomes["deadline"] = "not raised"
+        except RunTimeoutError:
+            outcomes["deadline"] = "timeout"
+    return outcomes
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Сравнение ожидания запусков: фиксированный опрос, адаптивный, поток событий')
+    parser.add_argument('--queue-time', type=float, default=0.5, help='Время в очереди, сек')
+    parser.add_argument('--run-duration', type=float, default=3.3, help='Время выполнения, сек')
+
+    args = parser.parse_args()
+    config = MockConfig(queue_time=args.queue_time, run_duration=args.run_duration)
+    expected = args.queue_time + args.run_duration
+
+    results: List[Dict[str, Any]] = []
+    with MockServer(config) as server:
+        client = OpenAI(base_url=server.base_url, api_key="mock")
+        durations = RunDurations()
+        for mode in ("fixed", "adaptive", "adaptive-history", "stream"):
+            results.append(measure_sync(client, server, mode, expected, durations))
+        for mode in ("async-adaptive", "async-stream"):
+            results.append(asyncio.run(measure_async(server, mode, expected)))
+
+    print(json.dumps({"runs": results, "failures": check_failures(config)}, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import math
+import random
+import tempfile
+from pathlib import Path
+from typing import Dict, Any, List, Tuple
+
+from PIL import Image, ImageDraw, ImageFilter
+
+from document_processor_v2.src.preprocess import EXIF_ORIENTATION, ImagePreprocessor, PreprocessConfig
+
+# A4 при 300 dpi
+PAGE_SIZE = (2480, 3508)
+
+
+def synthetic_scan(path: str, seed: int = 0, orientation: int = 1, quality: int = 95) -> None:
+    """Скан страницы: строки текста на неоднородном фоне с шумом"""
+    rng = random.Random(seed)
+    image = Image.new('RGB', PAGE_SIZE, (246, 244, 236))
+    draw = ImageDraw.Draw(image)
+    for y in range(180, PAGE_SIZE[1] - 180, 56):
+        x = 160
+        while x < PAGE_SIZE[0] - 300:
+            width = rng.randint(60, 320)
+            draw.rectangle((x, y, x + width, y + 26), fill=(rng.randint(10, 60),) * 3)
+            x += width + rng.randint(20, 50)
+    noise = Image.effect_noise(PAGE_SIZE, 24).convert('RGB')
+    image = Image.blend(image, noise, 0.12).filter(ImageFilter.GaussianBlur(0.6))
+    exif = Image.Exif()
+    if orientation != 1:
+        exif[EXIF_ORIENTATION] = orientation
+    image.save(path, format='JPEG', quality=quality, exif=exif)
+
+
+def vision_tokens(size: Tuple[int, int]) -> int:
+    """Оценка токенов изображения в режиме high detail: 170 на тайл 512x512 и 85 базовых"""
+    width, height = size
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 170 * math.ceil(width / 512) * math.ceil(height / 512) + 85
+
+
+def check_restore(prepared) -> float:
+    """Наибольшая ошибка пересчета bbox в исходные координаты, пикселей"""
+    scale_x, scale_y = prepared.scale
+    original = {"x1": 400.0, "y1": 1200.0, "x2": 900.0, "y2": 1260.0}
+    markup = {"text_items": [{"bbox": {
+        "x1": original["x1"] * scale_x, "y1": original["y1"] * scale_y,
+        "x2": original["x2"] * scale_x, "y2": original["y2"] * scale_y,
+    }}]}
+    restored = prepared.restore(markup)["text_items"][0]["bbox"]
+    return max(abs(restored[key] - original[key]) for key in original)
+
+
+def measure(preprocessor: ImagePreprocessor, path: str, bandwidth_mbps: float) -> Dict[str, Any]:
+    prepared = preprocessor.prepare(path)
+    try:
+        bytes_per_second = bandwidth_mbps * 1e6 / 8
+        upload_before = prepared.original_bytes / bytes_per_second
+        upload_after = prepared.bytes / bytes_per_second
+        return {
+            "document": Path(path).name,
+            **prepared.stats(),
+            "bytes_saved": prepared.original_bytes - prepared.bytes,
+            "upload_ms_before": round(upload_before * 1000, 1),
+            "upload_ms_after": round(upload_after * 1000, 1),
+            "latency_saved_ms": round((upload_before - upload_after - prepared.duration) * 1000, 1),
+            "vision_tokens_before": vision_tokens(prepared.original_size),
+            "vision_tokens_after": vision_tokens(prepared.size),
+            "bbox_restore_error_px": round(check_restore(prepared), 2),
+        }
+    finally:
+        prepared.cleanup()
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Экономия байтов и времени загрузки при подготовке изображений')
+    parser.add_argument('images', nargs='*', help='Сканы (по умолчанию синтетические страницы A4 300 dpi)')
+    parser.add_argument('--max-edge', type=int, default=PreprocessConfig.max_long_edge, help='Длинная сторона, пикселей')
+    parser.add_argument('--max-bytes', type=int, default=PreprocessConfig.max_bytes, help='Бюджет размера файла')
+    parser.add_argument('--color', action='store_true', help='Не переводить в оттенки серого')
+    parser.add_argument('--bandwidth-mbps', type=float, default=20.0, help='Скорость канала загрузки, Мбит/с')
+
+    args = parser.parse_args()
+    config = PreprocessConfig(max_long_edge=args.max_edge, max_bytes=args.max_bytes, grayscale=not args.color)
+    preprocessor = ImagePreprocessor(config)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        images: List[str] = list(args.images)
+        if not images:
+            for seed, orientation in ((0, 1), (1, 1), (2, 6)):
+                path = os.path.join(tmp, f"scan-{seed}-exif{orientation}.jpg")
+                synthetic_scan(path, seed, orientation)
+                images.append(path)
+        results = [measure(preprocessor, path, args.bandwidth_mbps) for path in images]
+
+    total_before = sum(result["original_bytes"] for result in results)
+    total_after = sum(result["bytes"] for result in results)
+    print(json.dumps({
+        "documents": results,
+        "bytes_ratio": round(total_after / total_before, 3),
+        "mean_latency_saved_ms": round(sum(r["latency_saved_ms"] for r in results) / len(results), 1),
+    }, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import random
+import tempfile
+from collections import defaultdict
+from typing import Dict, Any, List, Tuple
+
+from .eval_prompt_encoding import mock_template
+from .mock_openai import MockConfig, MockServer
+from .synthetic import QUERY_PARAPHRASES, upd_markup
+
+
+def query_stream(size: int, seed: int = 0) -> List[Tuple[str, str]]:
+    """Поток запросов пользователей: (поле, формулировка)"""
+    rng = random.Random(seed)
+    pairs = [(field, query) for field, queries in QUERY_PARAPHRASES.items() for query in queries]
+    return [rng.choice(pairs) for _ in range(size)]
+
+
+def grouping(stream: List[Tuple[str, str]], threshold: float) -> Dict[str, Any]:
+    """Качество отнесения формулировок к ключам и время поиска ключа"""
+    from document_processor_v2.src.query_index import QueryIndex
+
+    with tempfile.TemporaryDirectory(prefix='bench-queries-') as workdir:
+        index = QueryIndex(os.path.join(workdir, 'queries.json'), threshold=threshold)
+        keys_by_field: Dict[str, set] = defaultdict(set)
+        fields_by_key: Dict[str, set] = defaultdict(set)
+        started = time.perf_counter()
+        for field, query in stream:
+            key = index.key(query)
+            keys_by_field[field].add(key)
+            fields_by_key[key].add(field)
+        elapsed = time.perf_counter() - started
+        return {
+            "threshold": threshold,
+            **index.stats(),
+            # Поле, разбитое на несколько ключей, генерирует шаблон повторно
+            "split_fields": sorted(field for field, keys in keys_by_field.items() if len(keys) > 1),
+            # Ключ нескольких полей отдает шаблон чужого поля
+            "merged_keys": sorted(key for key, fields in fields_by_key.items() if len(fields) > 1),
+            "lookup_ms": round(elapsed * 1e3 / len(stream), 3),
+        }
+
+
+def template_runs(stream: List[Tuple[str, str]], query_index: bool) -> Dict[str, Any]:
+    """Запуски ассистента шаблонов для потока запросов к одному документу"""
+    config = MockConfig(
+        queue_time=0.01, run_duration=0.05,
+        responses={"DSL Template Generator": mock_template()}
+    )
+    with MockServer(config) as server, tempfile.TemporaryDirectory(prefix='bench-queries-') as workdir:
+        os.environ.update(
+            OPENAI_BASE_URL=server.base_url, OPENAI_API_KEY="mock", CACHE_DIR=workdir,
+            ASSISTANT_REGISTRY_PATH=os.path.join(workdir, 'assistants.json'),
+            FILE_REGISTRY_PATH=os.path.join(workdir, 'files.json'),
+            QUERY_INDEX_PATH=os.path.join(workdir, 'queries.json'),
+            QUERY_INDEX='true' if query_index else 'false',
+            LAYOUT_INDEX='false',
+        )
+        from document_processor_v2.src.document_processor import DocumentProcessor
+
+        processor = DocumentProcessor()
+        markup = upd_markup(0)["markup"]
+        for _, query in stream:
+            processor.generate_template(markup, query)
+        return {
+            "query_index": query_index,
+            "template_runs": len(server.state.runs),
+            "distinct_phrasings": len({query for _, query in stream}),
+        }
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Канонические ключи перефразированных запросов')
+    parser.add_argument('--queries', type=int, default=200, help='Длина потока запросов')
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0.5, 0.75, 0.9],
+                        help='Проверяемые пороги сходства')
+    parser.add_argument('--mock', action='store_true', help='Посчитать запуски ассистента шаблонов через локальную замену API')
+
+    args = parser.parse_args()
+    stream = query_stream(args.queries)
+    report: Dict[str, Any] = {
+        "queries": len(stream),
+        "fields": len({field for field, _ in stream}),
+        "grouping": [grouping(stream, threshold) for threshold in args.thresholds],
+    }
+    if args.mock:
+        report["baseline"] = template_runs(stream, False)
+        report["query_index"] = template_runs(stream, True)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
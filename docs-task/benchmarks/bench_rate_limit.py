@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+import json
+import time
+import logging
+import statistics
+import threading
+from typing import Dict, Any, List, Optional
+
+import httpx
+from openai import OpenAI
+
+from document_processor_v2.src.http_pool import MeteredTransport, PoolMetrics
+from document_processor_v2.src.rate_limiter import BULK, INTERACTIVE, RateLimiter, request_priority
+
+from .mock_openai import MockConfig, MockServer
+
+
+def make_client(server: MockServer, limiter: Optional[RateLimiter]) -> OpenAI:
+    transport = MeteredTransport(PoolMetrics(), limiter)
+    return OpenAI(base_url=server.base_url, api_key="mock", max_retries=10,
+                  http_client=httpx.Client(transport=transport))
+
+
+def worker(client: OpenAI, priority: int, stop: float, pause: float,
+           completed: List[float], latencies: List[float]) -> None:
+    """Запросы в цикле до момента stop; фиксируются время завершения и задержка"""
+    with request_priority(priority):
+        while time.monotonic() < stop:
+            started = time.monotonic()
+            client.beta.threads.create()
+            finished = time.monotonic()
+            completed.append(finished)
+            latencies.append(finished - started)
+            if pause:
+                time.sleep(pause)
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_scenario(name: str, config: MockConfig, limited: bool, bulk_workers: int,
+                 interactive_workers: int, duration: float) -> Dict[str, Any]:
+    """Нагрузка на квотированный сервер: пропускная способность по секундам и 429"""
+    limiter = RateLimiter(config.rpm_limit, burst_seconds=config.rate_burst) if limited else None
+    with MockServer(config) as server:
+        client = make_client(server, limiter)
+        started = time.monotonic()
+        stop = started + duration
+        completed: List[float] = []
+        latencies: Dict[int, List[float]] = {BULK: [], INTERACTIVE: []}
+        threads = [
+            threading.Thread(target=worker, args=(client, BULK, stop, 0.0, completed, latencies[BULK]))
+            for _ in range(bulk_workers)
+        ] + [
+            # Интерактивные запросы редкие: пользователь ждет ответ
+            threading.Thread(target=worker, args=(client, INTERACTIVE, stop, 0.2, completed, latencies[INTERACTIVE]))
+            for _ in range(interactive_workers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+        throttled = server.state.throttled
+
+    # Первую секунду (всплеск) и хвост после stop не учитываем
+    per_second = [0] * int(duration)
+    for moment in completed:
+        second = int(moment - started)
+        if second < len(per_second):
+            per_second[second] += 1
+    steady = per_second[1:]
+    result = {
+        "scenario": name,
+        "quota_rps": round(config.rpm_limit / 60, 2),
+        "achieved_rps": round(len(completed) / elapsed, 2),
+        "steady_rps_mean": round(statistics.mean(steady), 2),
+        "steady_rps_stdev": round(statistics.pstdev(steady), 2),
+        "responses_429": throttled,
+    }
+    for priority, name in ((BULK, "bulk"), (INTERACTIVE, "interactive")):
+        if latencies[priority]:
+            result[f"{name}_p50_ms"] = round(percentile(latencies[priority], 0.5) * 1000, 1)
+            result[f"{name}_p95_ms"] = round(percentile(latencies[priority], 0.95) * 1000, 1)
+    return result
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Клиентский планировщик квот против повторов по 429')
+    parser.add_argument('--rpm', type=float, default=1200, help='Квота сервера, запросов в минуту')
+    parser.add_argument('--burst', type=float, default=1.0, help='Допустимый всплеск, секунд квоты')
+    parser.add_argument('--workers', type=int, default=8, help='Число потоков пакетной нагрузки')
+    parser.add_argument('--duration', type=float, default=6.0, help='Длительность сценария, сек')
+
+    args = parser.parse_args()
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    config = MockConfig(request_latency=0.005, rpm_limit=args.rpm, rate_burst=args.burst)
+    results = [
+        run_scenario("retry-on-429", config, False, args.workers, 1, args.duration),
+        run_scenario("rate-limiter", config, True, args.workers, 1, args.duration),
+    ]
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Проверка качества шаблонов при сжатой разметке в промпте.
+
+Для каждой страницы фиксированного набора (synthetic.evaluation_set) и
+каждого запроса шаблон генерируется дважды: с разметкой в JSON с
+отступами (как раньше) и в проверяемом формате, с --prune - еще и только
+по окрестности якорей запроса (query_pruning). Шаблоны применяются к
+разметке локально; отчет показывает, совпали ли YAML и найденные значения
+с ожидаемыми, а также число токенов разметки в обоих вариантах.
+
+Запуск против OpenAI API требует OPENAI_API_KEY. С --mock используется
+локальная замена API: она возвращает один и тот же шаблон, поэтому
+осмыслены только токены и работа конвейера. С --tokens-only ассистенты
+не вызываются.
+"""
+
+import os
+import json
+import tempfile
+import contextlib
+from typing import Dict, Any, List, Optional, Tuple
+
+import yaml
+
+from .synthetic import evaluation_set
+
+
+def mock_template() -> str:
+    """Ответ локальной замены API: шаблон ИНН продавца"""
+    template = {
+        "intersection_metric": {"name": "Overlap", "threshold": 0.5},
+        "extraction_area": {"delta_x1": 0, "delta_y1": -0.3, "delta_x2": 20, "delta_y2": 0.3},
+        "type": "AnchorsBasedAttribute",
+        "params": {
+            "anchors": [{
+                "text": "ИНН/КПП продавца:",
+                "text_threshold": 0.8,
+                "relation": "right",
+                "intersection_metric": "${intersection_metric}",
+                "extraction_area": "${extraction_area}",
+            }],
+            "postprocessing_pipe": [
+                {"instance_name": "RegExpPostprocessor", "params": {"regexp_value": "[0-9]{10}(?=[^0-9])"}}
+            ],
+        },
+    }
+    return "```yaml\n" + yaml.safe_dump(template, allow_unicode=True, sort_keys=False) + "```"
+
+
+def evaluate(processor: Any, cases: List[Dict[str, Any]], baseline: Tuple[Any, Any], candidate: Tuple[Any, Any],
+             queries: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Сравнение шаблонов, сгенерированных по разметке в двух вариантах (формат, отбор)"""
+    rows = []
+    for case in cases:
+        for query, expected in case["expected"].items():
+            if queries and query not in queries:
+                continue
+            row: Dict[str, Any] = {"case": case["name"], "query": query, "expected": expected}
+            templates = {}
+            for name, (encoder, pruner) in (("baseline", baseline), ("candidate", candidate)):
+                processor.encoder, processor.pruner = encoder, pruner
+                template = processor.generate_template(case["markup"], query)
+                templates[name] = yaml.safe_load(template)
+                value = processor.extract_data(case["markup"], {query: template})[query]["value"]
+                row[f"{name}_value"] = value
+                row[f"{name}_correct"] = value == expected
+            row["same_yaml"] = templates["baseline"] == templates["candidate"]
+            rows.append(row)
+
+    total = len(rows) or 1
+    return {
+        "pairs": len(rows),
+        "same_yaml": round(sum(row["same_yaml"] for row in rows) / total, 3),
+        "same_value": round(sum(row["baseline_value"] == row["candidate_value"] for row in rows) / total, 3),
+        "baseline_accuracy": round(sum(row["baseline_correct"] for row in rows) / total, 3),
+        "candidate_accuracy": round(sum(row["candidate_correct"] for row in rows) / total, 3),
+        "mismatches": [row for row in rows if not row["same_yaml"] or not row["candidate_correct"]],
+    }
+
+
+def main():
+    import argparse
+
+    from document_processor_v2.src.prompt_encoding import JSON, TABLE, MarkupEncoder, count_tokens
+    from document_processor_v2.src.query_pruning import MarkupPruner
+
+    parser = argparse.ArgumentParser(description='Качество шаблонов при сжатой разметке в промпте')
+    parser.add_argument('--cases', type=int, default=8, help='Число страниц фиксированного набора')
+    parser.add_argument('--format', default=TABLE, help='Проверяемый формат разметки')
+    parser.add_argument('--min-confidence', type=float, default=0.0, help='Порог confidence элементов')
+    parser.add_argument('--prune', action='store_true', help='Передавать только окрестность якорей запроса')
+    parser.add_argument('--queries', nargs='+', help='Только эти запросы набора')
+    parser.add_argument('--tokens-only', action='store_true', help='Только подсчет токенов, без ассистентов')
+    parser.add_argument('--mock', action='store_true', help='Локальная замена OpenAI API')
+
+    args = parser.parse_args()
+    cases = evaluation_set(args.cases)
+    baseline = (MarkupEncoder(JSON), MarkupPruner(enabled=False))
+    candidate = (MarkupEncoder(args.format, args.min_confidence), MarkupPruner(enabled=args.prune))
+    encoder, pruner = candidate
+
+    json_tokens, tokens = 0, 0
+    for case in cases:
+        for query in case["expected"]:
+            if args.queries and query not in args.queries:
+                continue
+            json_tokens += count_tokens(baseline[0].encode(case["markup"]))
+            tokens += count_tokens(encoder.encode(pruner.prune(case["markup"], [query]).markup))
+    report: Dict[str, Any] = {
+        "format": encoder.format,
+        "min_confidence": encoder.min_confidence,
+        "prune": pruner.enabled,
+        "json_tokens": json_tokens,
+        "tokens": tokens,
+        "ratio": round(tokens / json_tokens, 3) if json_tokens else 1.0,
+        "exact_token_count": encoder.report({"text_items": []})["exact"],
+    }
+
+    if not args.tokens_only:
+        with contextlib.ExitStack() as stack:
+            if args.mock:
+                from .mock_openai import MockConfig, MockServer
+
+                server = stack.enter_context(MockServer(MockConfig(
+                    queue_time=0.01, run_duration=0.02,
+                    responses={"DSL Template Generator": mock_template()}
+                )))
+                workdir = stack.enter_context(tempfile.TemporaryDirectory(prefix='eval-'))
+                os.environ.update(
+                    OPENAI_BASE_URL=server.base_url, OPENAI_API_KEY="mock", CACHE_DIR=workdir,
+                    ASSISTANT_REGISTRY_PATH=os.path.join(workdir, 'assistants.json'),
+                    FILE_REGISTRY_PATH=os.path.join(workdir, 'files.json'),
+                )
+            from document_processor_v2.src.document_processor import DocumentProcessor
+
+            processor = DocumentProcessor()
+            # Каждый шаблон генерируется заново, без кэша
+            processor.assistant_manager.cache_enabled = False
+            report.update(evaluate(processor, cases, baseline, candidate, args.queries))
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
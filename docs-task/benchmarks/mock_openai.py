@@ -0,0 +1,444 @@
+#!/usr/bin/env python3
+
+import json
+import math
+import time
+import uuid
+import random
+import socket
+import asyncio
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Optional, Union
+
+import uvicorn
+from fastapi import FastAPI, Request, UploadFile, File, Form, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Ответ ассистента по умолчанию: валидный DocumentResponse для /analyze
+DEFAULT_RESPONSE = json.dumps({
+    "analysis": {
+        "document_type": "invoice",
+        "sections": [],
+        "key_elements": [
+            {
+                "name": "ИНН продавца",
+                "value": "7707083893",
+                "bbox": {"x1": 380, "y1": 558, "x2": 520, "y2": 581}
+            }
+        ]
+    },
+    "dsl_template": {
+        "intersection_metric": {"name": "Overlap", "threshold": 0.6},
+        "extraction_area": {"delta_x1": 10, "delta_y1": -0.6, "delta_x2": 57, "delta_y2": 0.6},
+        "type": "ChainAttribute",
+        "params": {"attributes": []}
+    }
+}, ensure_ascii=False)
+
+
+DISTRIBUTIONS = ("fixed", "uniform", "normal", "lognormal", "exponential")
+
+
+@dataclass
+class Distribution:
+    """Распределение задержки, сек
+
+    - fixed: всегда a
+    - uniform: равномерно от a до b
+    - normal: среднее a, отклонение b (отрицательные значения - 0)
+    - lognormal: медиана a, sigma b (длинный хвост, как у запусков ассистентов)
+    - exponential: среднее a
+    """
+    kind: str = "fixed"
+    a: float = 0.0
+    b: float = 0.0
+
+    def __post_init__(self):
+        if self.kind not in DISTRIBUTIONS:
+            raise ValueError(f"Неизвестное распределение: {self.kind}")
+
+    @classmethod
+    def parse(cls, text: str) -> "Distribution":
+        """Распределение из строки "0.5" или "lognormal:1.0,0.6" (для аргументов командной строки)"""
+        kind, _, params = text.partition(':')
+        if not params:
+            return cls("fixed", float(kind))
+        values = [float(value) for value in params.split(',')]
+        return cls(kind, *values)
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "fixed":
+            return self.a
+        if self.kind == "uniform":
+            return rng.uniform(self.a, self.b)
+        if self.kind == "normal":
+            return max(rng.gauss(self.a, self.b), 0.0)
+        if self.kind == "lognormal":
+            return self.a * math.exp(rng.gauss(0.0, self.b))
+        return rng.expovariate(1.0 / self.a) if self.a > 0 else 0.0
+
+
+Delay = Union[float, Distribution]
+
+
+def sample_delay(delay: Delay, rng: random.Random) -> float:
+    """Задержка: число или значение распределения"""
+    return delay.sample(rng) if isinstance(delay, Distribution) else delay
+
+
+@dataclass
+class MockConfig:
+    """Параметры локальной замены OpenAI API"""
+    request_latency: Delay = 0.005  # задержка ответа на любой запрос, сек
+    queue_time: Delay = 0.2         # время в статусе queued, сек
+    run_duration: Delay = 1.0       # время в статусе in_progress, сек
+    final_status: str = "completed"  # итоговый статус запуска (failed, expired для проверки ошибок)
+    response_text: str = DEFAULT_RESPONSE
+    rpm_limit: float = 0.0          # квота запросов в минуту (0 - без ограничения)
+    rate_burst: float = 1.0         # сколько секунд квоты можно израсходовать разом
+    # Ответы по имени ассистента (разметка, шаблоны и т.д.)
+    responses: Dict[str, str] = field(default_factory=dict)
+    error_rate: float = 0.0         # доля запросов с ответом 500
+    throttle_rate: float = 0.0      # доля запросов с ответом 429 независимо от квоты
+    run_failure_rate: float = 0.0   # доля запусков, завершающихся статусом failed
+    seed: Optional[int] = None      # зерно случайных задержек и ошибок для воспроизводимости
+
+
+@dataclass
+class MockState:
+    """Состояние объектов, созданных через локальный API"""
+    assistants: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    threads: Dict[str, List[Dict[str, Any]]] = field(default_factory=dict)
+    runs: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    files: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    request_count: int = 0
+    throttled: int = 0
+    errors: int = 0
+    failed_runs: int = 0
+
+
+class RequestQuota:
+    """Квота запросов с непрерывным пополнением, как у OpenAI API"""
+
+    def __init__(self, per_minute: float, burst_seconds: float):
+        self.rate = per_minute / 60.0
+        self.capacity = max(self.rate * burst_seconds, 1.0)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """0, если запрос принят, иначе время до появления квоты"""
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.level < 1:
+            return (1 - self.level) / self.rate
+        self.level -= 1
+        return 0.0
+
+
+def _new_id(prefix: str) -> str:
+    return f"{prefix}_{uuid.uuid4().hex[:24]}"
+
+
+def _message(thread_id: str, role: str, text: str, file_ids: Optional[List[str]] = None) -> Dict[str, Any]:
+    return {
+        "id": _new_id("msg"),
+        "object": "thread.message",
+        "created_at": int(time.time()),
+        "thread_id": thread_id,
+        "role": role,
+        "content": [{"type": "text", "text": {"value": text, "annotations": []}}],
+        "file_ids": file_ids or [],
+        "assistant_id": None,
+        "run_id": None,
+        "metadata": {},
+    }
+
+
+def create_mock_app(config: Optional[MockConfig] = None) -> FastAPI:
+    """Создание приложения, имитирующего эндпоинты OpenAI"""
+    config = config or MockConfig()
+    state = MockState()
+    app = FastAPI(title="OpenAI stand-in")
+    app.state.config = config
+    app.state.mock = state
+    quota = RequestQuota(config.rpm_limit, config.rate_burst) if config.rpm_limit else None
+    rng = random.Random(config.seed)
+
+    def throttled(wait: float) -> JSONResponse:
+        state.throttled += 1
+        return JSONResponse(
+            status_code=429,
+            content={"error": {"message": "Rate limit reached for requests", "type": "requests",
+                               "param": None, "code": "rate_limit_exceeded"}},
+            headers={"retry-after-ms": str(int(wait * 1000) + 1)},
+        )
+
+    @app.middleware("http")
+    async def simulate_latency(request: Request, call_next):
+        state.request_count += 1
+        latency = sample_delay(config.request_latency, rng)
+        if latency > 0:
+            await asyncio.sleep(latency)
+        if config.error_rate and rng.random() < config.error_rate:
+            state.errors += 1
+            return JSONResponse(
+                status_code=500,
+                content={"error": {"message": "Simulated server error", "type": "server_error",
+                                   "param": None, "code": None}},
+            )
+        if config.throttle_rate and rng.random() < config.throttle_rate:
+            return throttled(0.05)
+        if quota is None:
+            return await call_next(request)
+        wait = quota.take()
+        if wait > 0:
+            return throttled(wait)
+        response = await call_next(request)
+        response.headers["x-ratelimit-remaining-requests"] = str(int(quota.level))
+        return response
+
+    def run_status(run: Dict[str, Any]) -> str:
+        """Статус запуска вычисляется по времени, прошедшему с его создания"""
+        elapsed = time.monotonic() - run["_started"]
+        if elapsed < run["_queue_time"]:
+            return "queued"
+        if run.get("started_at") is None:
+            run["started_at"] = int(time.time())
+        if elapsed < run["_queue_time"] + run["_duration"]:
+            return "in_progress"
+        if run["_final_status"] != "completed":
+            if run["status"] != run["_final_status"]:
+                run["last_error"] = {"code": "server_error", "message": "Simulated failure"}
+                run["failed_at"] = int(time.time())
+                state.failed_runs += 1
+            return run["_final_status"]
+        if run["status"] != "completed":
+            name = state.assistants.get(run["assistant_id"], {}).get("name")
+            text = config.responses.get(name, config.response_text)
+            # Токены оцениваются как у планировщика квот: около 3 символов на токен
+            prompt = sum(len(m["content"][0]["text"]["value"]) for m in state.threads[run["thread_id"]]) // 3
+            completion = len(text) // 3
+            state.threads[run["thread_id"]].append(_message(run["thread_id"], "assistant", text))
+            run["completed_at"] = int(time.time())
+            run["usage"] = {
+                "prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion
+            }
+        return "completed"
+
+    def public(run: Dict[str, Any]) -> Dict[str, Any]:
+        return {k: v for k, v in run.items() if not k.startswith("_")}
+
+    def sse(event: str, data: Any) -> str:
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    async def run_events(run: Dict[str, Any]):
+        """События запуска в формате Assistants streaming: по одному на смену статуса"""
+        yield sse("thread.run.created", public(run))
+        status = run["status"]
+        while status not in ("completed", "failed", "cancelled", "expired"):
+            await asyncio.sleep(0.01)
+            run["status"] = run_status(run)
+            if run["status"] != status:
+                status = run["status"]
+                yield sse(f"thread.run.{status}", public(run))
+        yield "event: done\ndata: [DONE]\n\n"
+
+    @app.post("/v1/assistants")
+    async def create_assistant(request: Request):
+        body = await request.json()
+        assistant = {
+            "id": _new_id("asst"),
+            "object": "assistant",
+            "created_at": int(time.time()),
+            "name": body.get("name"),
+            "description": body.get("description"),
+            "model": body.get("model"),
+            "instructions": body.get("instructions"),
+            "tools": body.get("tools", []),
+            "file_ids": [],
+            "metadata": {},
+        }
+        state.assistants[assistant["id"]] = assistant
+        return assistant
+
+    @app.get("/v1/assistants/{assistant_id}")
+    async def retrieve_assistant(assistant_id: str):
+        if assistant_id not in state.assistants:
+            raise HTTPException(status_code=404, detail="No assistant found")
+        return state.assistants[assistant_id]
+
+    @app.post("/v1/threads")
+    async def create_thread():
+        thread_id = _new_id("thread")
+        state.threads[thread_id] = []
+        return {"id": thread_id, "object": "thread", "created_at": int(time.time()), "metadata": {}}
+
+    @app.post("/v1/files")
+    async def upload_file(file: UploadFile = File(...), purpose: str = Form(...)):
+        content = await file.read()
+        uploaded = {
+            "id": _new_id("file"),
+            "object": "file",
+            "bytes": len(content),
+            "created_at": int(time.time()),
+            "filename": file.filename,
+            "purpose": purpose,
+            "status": "processed",
+        }
+        state.files[uploaded["id"]] = uploaded
+        return uploaded
+
+    @app.get("/v1/files")
+    async def list_files(purpose: Optional[str] = None):
+        data = [file for file in state.files.values() if purpose is None or file["purpose"] == purpose]
+        return {"object": "list", "data": data, "has_more": False}
+
+    @app.delete("/v1/files/{file_id}")
+    async def delete_file(file_id: str):
+        state.files.pop(file_id, None)
+        return {"id": file_id, "object": "file", "deleted": True}
+
+    @app.post("/v1/threads/{thread_id}/messages")
+    async def create_message(thread_id: str, request: Request):
+        if thread_id not in state.threads:
+            raise HTTPException(status_code=404, detail="No thread found")
+        body = await request.json()
+        message = _message(thread_id, body.get("role", "user"), body.get("content", ""), body.get("file_ids"))
+        state.threads[thread_id].append(message)
+        return message
+
+    @app.get("/v1/threads/{thread_id}/messages")
+    async def list_messages(thread_id: str, order: str = "desc", limit: int = 20):
+        if thread_id not in state.threads:
+            raise HTTPException(status_code=404, detail="No thread found")
+        messages = list(state.threads[thread_id])
+        if order == "desc":
+            messages.reverse()
+        data = messages[:limit]
+        return {
+            "object": "list",
+            "data": data,
+            "first_id": data[0]["id"] if data else None,
+            "last_id": data[-1]["id"] if data else None,
+            "has_more": len(messages) > limit,
+        }
+
+    @app.post("/v1/threads/{thread_id}/runs")
+    async def create_run(thread_id: str, request: Request):
+        if thread_id not in state.threads:
+            raise HTTPException(status_code=404, detail="No thread found")
+        body = await request.json()
+        run = {
+            "id": _new_id("run"),
+            "object": "thread.run",
+            "created_at": int(time.time()),
+            "thread_id": thread_id,
+            "assistant_id": body.get("assistant_id"),
+            "status": "queued",
+            "started_at": None,
+            "completed_at": None,
+            "usage": None,
+            "model": "mock",
+            "instructions": "",
+            "tools": [],
+            "file_ids": [],
+            "metadata": {},
+            "_started": time.monotonic(),
+            # Длительности и исход запуска определяются при создании
+            "_queue_time": sample_delay(config.queue_time, rng),
+            "_duration": sample_delay(config.run_duration, rng),
+            "_final_status": (
+                "failed" if config.run_failure_rate and rng.random() < config.run_failure_rate
+                else config.final_status
+            ),
+        }
+        state.runs[run["id"]] = run
+        if body.get("stream"):
+            return StreamingResponse(run_events(run), media_type="text/event-stream")
+        return public(run)
+
+    @app.get("/v1/threads/{thread_id}/runs/{run_id}")
+    async def retrieve_run(thread_id: str, run_id: str):
+        run = state.runs.get(run_id)
+        if run is None or run["thread_id"] != thread_id:
+            raise HTTPException(status_code=404, detail="No run found")
+        run["status"] = run_status(run)
+        return public(run)
+
+    return app
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class MockServer:
+    """Запуск локальной замены OpenAI API в фоновом потоке"""
+
+    def __init__(self, config: Optional[MockConfig] = None, port: Optional[int] = None):
+        self.app = create_mock_app(config)
+        self.port = port or _free_port()
+        self.server = uvicorn.Server(uvicorn.Config(
+            self.app, host="127.0.0.1", port=self.port, log_level="warning"
+        ))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    @property
+    def state(self) -> MockState:
+        return self.app.state.mock
+
+    def __enter__(self) -> "MockServer":
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.server.should_exit = True
+        self.thread.join()
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Локальная замена OpenAI Assistants API')
+    parser.add_argument('--port', type=int, default=8001, help='Порт сервера')
+    parser.add_argument('--run-duration', type=Distribution.parse, default=Distribution("fixed", 1.0),
+                        help='Длительность запуска, сек: число или распределение, например lognormal:1.0,0.6')
+    parser.add_argument('--queue-time', type=Distribution.parse, default=Distribution("fixed", 0.2),
+                        help='Время ожидания в очереди, сек (число или распределение)')
+    parser.add_argument('--latency', type=Distribution.parse, default=Distribution("fixed", 0.005),
+                        help='Задержка ответа, сек (число или распределение)')
+    parser.add_argument('--final-status', default='completed', help='Итоговый статус запусков')
+    parser.add_argument('--rpm-limit', type=float, default=0.0, help='Квота запросов в минуту (0 - без ограничения)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Доля запросов с ответом 500')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Доля запросов с ответом 429')
+    parser.add_argument('--run-failure-rate', type=float, default=0.0, help='Доля неуспешных запусков')
+    parser.add_argument('--seed', type=int, default=None, help='Зерно случайных задержек и ошибок')
+
+    args = parser.parse_args()
+    config = MockConfig(
+        request_latency=args.latency,
+        queue_time=args.queue_time,
+        run_duration=args.run_duration,
+        final_status=args.final_status,
+        rpm_limit=args.rpm_limit,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        run_failure_rate=args.run_failure_rate,
+        seed=args.seed,
+    )
+    uvicorn.run(create_mock_app(config), host="127.0.0.1", port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Набор сценариев производительности против локальной замены OpenAI API.
+
+Сценарии:
+
+- single_document: задержка обработки одного документа (разметка и шаблон)
+  без кэша, по одному документу за раз
+- cache_hit: повторная обработка тех же документов с прогретым кэшем
+- bulk: пропускная способность BulkProcessor на каталоге документов
+- api_sweep: пропускная способность и задержки /analyze при разной
+  конкурентности
+
+Задержки, длительности запусков и доля ошибок/429 замены API задаются
+аргументами (см. mock_openai.Distribution). Результат - JSON с коммитом и
+параметрами запуска; --compare сравнивает его с сохраненным результатом
+другого коммита и завершается с кодом 1 при регрессиях.
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import platform
+import statistics
+import subprocess
+import tempfile
+from dataclasses import asdict
+from pathlib import Path
+from typing import Dict, Any, List, Callable, Optional
+
+from .bench_api import percentile, run_load
+from .eval_prompt_encoding import mock_template
+from .mock_openai import Distribution, MockConfig, MockServer
+from .synthetic import upd_markup
+
+QUERY = "ИНН продавца"
+
+# Метрики, для которых больше - лучше; для остальных числовых - меньше
+HIGHER_IS_BETTER = ("throughput", "hit_rate")
+# Метрики, не сравниваемые между запусками: параметры сценария и события,
+# внесенные заменой API по ее настройкам
+NOT_COMPARED = (
+    "documents", "requests", "concurrency", "repeats",
+    "throttled", "injected_errors", "failed_runs",
+)
+
+
+def write_documents(directory: Path, count: int) -> List[Path]:
+    """Файлы документов с различным содержимым: у каждого своя запись в кэше разметки"""
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for index in range(count):
+        path = directory / f"scan-{index:04d}.png"
+        path.write_bytes(b"\x89PNG bench " + os.urandom(32 * 1024))
+        paths.append(path)
+    return paths
+
+
+def latency_stats(latencies: List[float]) -> Dict[str, float]:
+    return {
+        "latency_mean_s": round(statistics.mean(latencies), 4),
+        "latency_p50_s": round(percentile(latencies, 50), 4),
+        "latency_p95_s": round(percentile(latencies, 95), 4),
+        "latency_max_s": round(max(latencies), 4),
+    }
+
+
+class Suite:
+    """Сценарии, выполняемые против одного экземпляра замены API"""
+
+    def __init__(self, server: MockServer, workdir: Path):
+        self.server = server
+        self.workdir = workdir
+
+    def processor(self, name: str, cache: bool):
+        """Новый DocumentProcessor со своим каталогом кэша"""
+        cache_dir = self.workdir / name
+        os.environ.update(
+            CACHE_DIR=str(cache_dir),
+            CACHE_ENABLED='true' if cache else 'false',
+            ASSISTANT_REGISTRY_PATH=str(cache_dir / 'assistants.json'),
+            FILE_REGISTRY_PATH=str(cache_dir / 'files.json'),
+        )
+        from document_processor_v2.src.document_processor import DocumentProcessor
+
+        return DocumentProcessor()
+
+    def counters(self) -> Dict[str, int]:
+        state = self.server.state
+        return {
+            "mock_requests": state.request_count,
+            "runs": len(state.runs),
+            "throttled": state.throttled,
+            "injected_errors": state.errors,
+            "failed_runs": state.failed_runs,
+        }
+
+    def measure(self, scenario: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        """Результат сценария и обращения к замене API за время его выполнения"""
+        before = self.counters()
+        result = scenario()
+        after = self.counters()
+        result.update({name: after[name] - before[name] for name in after})
+        return result
+
+    def single_document(self, repeats: int) -> Dict[str, Any]:
+        processor = self.processor('single', cache=False)
+        documents = write_documents(self.workdir / 'single-docs', repeats)
+        latencies, errors = [], 0
+        for path in documents:
+            started = time.perf_counter()
+            try:
+                processor.process_document(str(path), QUERY, str(self.workdir / 'single-out'))
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+        return {"repeats": repeats, "errors": errors, **latency_stats(latencies)}
+
+    def cache_hit(self, repeats: int) -> Dict[str, Any]:
+        processor = self.processor('cached', cache=True)
+        documents = write_documents(self.workdir / 'cached-docs', repeats)
+        output_dir = str(self.workdir / 'cached-out')
+        for path in documents:
+            processor.process_document(str(path), QUERY, output_dir)
+
+        before = self.counters()
+        latencies = []
+        for path in documents:
+            started = time.perf_counter()
+            processor.process_document(str(path), QUERY, output_dir)
+            latencies.append(time.perf_counter() - started)
+        after = self.counters()
+        return {
+            "repeats": repeats,
+            **latency_stats(latencies),
+            # Прогретый кэш не должен обращаться к ассистентам
+            "warm_runs": after["runs"] - before["runs"],
+        }
+
+    def bulk(self, documents: int, concurrency: int) -> Dict[str, Any]:
+        from document_processor_v2.src.bulk import BulkProcessor
+
+        processor = self.processor('bulk', cache=False)
+        paths = write_documents(self.workdir / 'bulk-docs', documents)
+        bulk = BulkProcessor(processor, self.workdir / 'bulk-out', concurrency=concurrency)
+        started = time.perf_counter()
+        summary = bulk.run(paths, [QUERY])
+        wall = time.perf_counter() - started
+        return {
+            "documents": documents,
+            "concurrency": concurrency,
+            "errors": summary["error"],
+            "wall_time_s": round(wall, 3),
+            "throughput_docs_per_s": round(documents / wall, 3),
+        }
+
+    def api_sweep(self, requests: int, concurrencies: List[int]) -> Dict[str, Any]:
+        sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+        from api.main import app
+
+        payload = b"\xff\xd8\xff" + os.urandom(64 * 1024)
+        return {
+            f"c{concurrency}": asyncio.run(run_load(app, requests, concurrency, payload))
+            for concurrency in concurrencies
+        }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=Path(__file__).resolve().parent
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(metrics: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    """Числовые метрики вложенного результата с путями через точку"""
+    flat: Dict[str, float] = {}
+    for name, value in metrics.items():
+        path = f"{prefix}{name}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, path + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], tolerance: float) -> List[Dict[str, Any]]:
+    """Метрики, ухудшившиеся больше чем на tolerance (доля) относительно baseline"""
+    before = flatten(baseline["scenarios"])
+    after = flatten(current["scenarios"])
+    regressions = []
+    for path, old in sorted(before.items()):
+        name = path.rsplit('.', 1)[-1]
+        if path not in after or name in NOT_COMPARED:
+            continue
+        new = after[path]
+        higher = any(marker in name for marker in HIGHER_IS_BETTER)
+        if old == 0:
+            # Относительное изменение не определено: регрессия - любое ухудшение
+            change = None
+            worse = new < 0 if higher else new > 0
+        else:
+            change = round((old - new) / abs(old) if higher else (new - old) / abs(old), 3)
+            worse = change > tolerance
+        if worse:
+            regressions.append({"metric": path, "baseline": old, "current": new, "change": change})
+    return regressions
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Сценарии производительности с локальной заменой OpenAI API')
+    parser.add_argument('--scenarios', nargs='+', default=['single_document', 'cache_hit', 'bulk', 'api_sweep'],
+                        choices=['single_document', 'cache_hit', 'bulk', 'api_sweep'], help='Выполняемые сценарии')
+    parser.add_argument('--repeats', type=int, default=10, help='Документов в сценариях задержки')
+    parser.add_argument('--documents', type=int, default=40, help='Документов в сценарии bulk')
+    parser.add_argument('--bulk-concurrency', type=int, default=8, help='Параллельность сценария bulk')
+    parser.add_argument('--requests', type=int, default=100, help='Запросов на уровень конкурентности /analyze')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32, 128],
+                        help='Уровни конкурентности /analyze')
+    parser.add_argument('--latency', type=Distribution.parse, default=Distribution("fixed", 0.005),
+                        help='Задержка ответа API, сек: число или распределение (lognormal:0.02,0.5)')
+    parser.add_argument('--queue-time', type=Distribution.parse, default=Distribution("fixed", 0.05),
+                        help='Время запуска в очереди, сек (число или распределение)')
+    parser.add_argument('--run-duration', type=Distribution.parse, default=Distribution("lognormal", 0.3, 0.4),
+                        help='Длительность запуска, сек (число или распределение)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Доля запросов с ответом 500')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Доля запросов с ответом 429')
+    parser.add_argument('--run-failure-rate', type=float, default=0.0, help='Доля неуспешных запусков')
+    parser.add_argument('--seed', type=int, default=0, help='Зерно случайных задержек и ошибок')
+    parser.add_argument('--output', help='Файл для JSON результата (по умолчанию stdout)')
+    parser.add_argument('--compare', help='JSON результат другого коммита для сравнения')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='Допустимое ухудшение метрики, доля')
+
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    config = MockConfig(
+        request_latency=args.latency,
+        queue_time=args.queue_time,
+        run_duration=args.run_duration,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        run_failure_rate=args.run_failure_rate,
+        seed=args.seed,
+        responses={
+            "Document Markup Generator": json.dumps(upd_markup(0)["markup"], ensure_ascii=False),
+            "DSL Template Generator": mock_template(),
+        },
+    )
+
+    with MockServer(config) as server, tempfile.TemporaryDirectory(prefix='bench-suite-') as workdir:
+        os.environ.update(OPENAI_BASE_URL=server.base_url, OPENAI_API_KEY="mock")
+        suite = Suite(server, Path(workdir))
+        runs = {
+            'single_document': lambda: suite.single_document(args.repeats),
+            'cache_hit': lambda: suite.cache_hit(args.repeats),
+            'bulk': lambda: suite.bulk(args.documents, args.bulk_concurrency),
+            'api_sweep': lambda: suite.api_sweep(args.requests, args.concurrency),
+        }
+        scenarios = {name: suite.measure(runs[name]) for name in args.scenarios}
+
+    mock = asdict(config)
+    mock.pop("responses")
+    mock.pop("response_text")
+    report: Dict[str, Any] = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "mock": mock,
+        },
+        "scenarios": scenarios,
+    }
+
+    regressions: List[Dict[str, Any]] = []
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report, args.tolerance)
+        report["comparison"] = {
+            "baseline_commit": baseline.get("meta", {}).get("commit"),
+            "tolerance": args.tolerance,
+            "regressions": regressions,
+        }
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+import random
+from typing import Dict, Any, List
+
+WORDS = [
+    "товар", "количество", "цена", "сумма", "НДС", "ед.", "шт", "руб.",
+    "поставка", "договор", "основание", "склад", "адрес", "г.", "ул.", "д.",
+]
+
+
+def synthetic_markup(tokens: int = 5000, fields: int = 20, seed: int = 0) -> Dict[str, Any]:
+    """Разметка плотной страницы: строки OCR токенов и fields пар "метка: значение" """
+    rng = random.Random(seed)
+    items: List[Dict[str, Any]] = []
+    row, x = 0, 40.0
+    while len(items) < tokens - fields * 2:
+        text = rng.choice(WORDS) if rng.random() < 0.7 else str(rng.randint(1, 99999))
+        width = 12.0 * len(text) + rng.uniform(0, 10)
+        if x + width > 2400:
+            row, x = row + 1, 40.0
+        y = 40.0 + row * 28
+        items.append({
+            "bbox": {"x1": round(x, 1), "y1": y, "x2": round(x + width, 1), "y2": y + 20},
+            "text": text,
+            "confidence": round(rng.uniform(50, 99), 1),
+        })
+        x += width + rng.uniform(6, 20)
+
+    # Метки полей размещаются в отдельных строках под основным текстом
+    for field in range(fields):
+        y = 40.0 + (row + 2 + field) * 28
+        items.append({
+            "bbox": {"x1": 40.0, "y1": y, "x2": 200.0, "y2": y + 20},
+            "text": f"Поле {field + 1:02d}:",
+            "confidence": 90.0,
+        })
+        items.append({
+            "bbox": {"x1": 220.0, "y1": y, "x2": 400.0, "y2": y + 20},
+            "text": f"{7700000000 + field}/770101001",
+            "confidence": 85.0,
+        })
+    rng.shuffle(items)
+    return {"text_items": items}
+
+
+def field_template(field: int) -> Dict[str, Any]:
+    """Шаблон для поля synthetic_markup"""
+    return {
+        "intersection_metric": {"name": "Overlap", "threshold": 0.6},
+        "extraction_area": {"delta_x1": 0, "delta_y1": -0.3, "delta_x2": 12, "delta_y2": 0.3},
+        "type": "ChainAttribute",
+        "params": {
+            "attributes": [
+                {
+                    "type": "AnchorsBasedAttribute",
+                    "priority": 1,
+                    "params": {
+                        "anchors": [
+                            {
+                                "text": f"Поле {field + 1:02d}:",
+                                "text_threshold": 0.9,
+                                "repetition_index": 0,
+                                "multiline": False,
+                                "relation": "right",
+                                "intersection_metric": "${intersection_metric}",
+                                "extraction_area": "${extraction_area}",
+                            }
+                        ]
+                    },
+                }
+            ],
+            "postprocessing_pipe": [
+                {"instance_name": "RegExpPostprocessor", "params": {"regexp_value": "[0-9]{10}(?=[^0-9])"}}
+            ],
+        },
+    }
+
+
+# Поля страницы УПД: метка, значение и запрос, которым это значение ищется
+UPD_FIELDS = [
+    ("Счет-фактура №", "{number}", "номер счет-фактуры"),
+    ("от", "{date}", "дата счет-фактуры"),
+    ("ИНН/КПП продавца:", "{seller_inn}/{seller_kpp}", "ИНН продавца"),
+    ("ИНН/КПП покупателя:", "{buyer_inn}/{buyer_kpp}", "ИНН покупателя"),
+    ("Всего к оплате", "{total}", "сумма к оплате"),
+]
+
+
+def upd_markup(seed: int, layout: int = 0) -> Dict[str, Any]:
+    """Разметка страницы УПД с шумом OCR и ожидаемые значения полей
+
+    Возвращает {"markup": ..., "expected": {запрос: значение}}; значения
+    приведены к виду, который дают постобработки шаблонов (ИНН без КПП).
+    layout задает макет поставщика: положение строк с метками.
+    """
+    rng = random.Random(seed)
+    values = {
+        "number": str(rng.randint(100, 9999)),
+        "date": f"{rng.randint(1, 28):02d}.{rng.randint(1, 12):02d}.20{rng.randint(20, 25)}",
+        "seller_inn": str(rng.randint(10 ** 9, 10 ** 10 - 1)),
+        "seller_kpp": str(rng.randint(10 ** 8, 10 ** 9 - 1)),
+        "buyer_inn": str(rng.randint(10 ** 9, 10 ** 10 - 1)),
+        "buyer_kpp": str(rng.randint(10 ** 8, 10 ** 9 - 1)),
+        "total": f"{rng.randint(1000, 999999)},{rng.randint(0, 99):02d}",
+    }
+    dx, dy = rng.uniform(-30, 30), rng.uniform(-30, 30)
+    items: List[Dict[str, Any]] = []
+
+    def add(x1: float, y1: float, text: str, confidence: float) -> float:
+        x2 = x1 + 13.5 * len(text) + rng.uniform(0, 8)
+        items.append({
+            "bbox": {"x1": round(x1 + dx, 2), "y1": round(y1 + dy, 2),
+                     "x2": round(x2 + dx, 2), "y2": round(y1 + dy + 22.4, 2)},
+            "text": text,
+            "confidence": round(confidence, 1),
+        })
+        return x2
+
+    label_rows = {0: 60.0, 1: 60.0, 2: 160.0, 3: 220.0, 4: 1500.0}
+    left = 80.0
+    if layout:
+        layout_rng = random.Random(f"layout-{layout}")
+        top = layout_rng.uniform(40, 300)
+        seller = top + layout_rng.uniform(80, 400)
+        label_rows = {0: top, 1: top, 2: seller, 3: seller + layout_rng.uniform(40, 160),
+                      4: layout_rng.uniform(1200, 2000)}
+        left = layout_rng.uniform(60, 600)
+    x = left
+    for index, (label, value, _) in enumerate(UPD_FIELDS):
+        y = label_rows[index]
+        if index != 1:
+            x = left
+        x = add(x, y, label, rng.uniform(85, 99)) + 12
+        x = add(x, y, value.format(**values), rng.uniform(80, 98)) + 24
+
+    # Табличная часть и подписи: шум для поиска якорей
+    for row in range(rng.randint(8, 14)):
+        x, y = 80.0, 400.0 + row * 34
+        for _ in range(rng.randint(4, 7)):
+            text = rng.choice(WORDS) if rng.random() < 0.6 else str(rng.randint(1, 99999))
+            x = add(x, y, text, rng.uniform(40, 99)) + rng.uniform(10, 40)
+    for _ in range(rng.randint(3, 8)):
+        add(rng.uniform(80, 2000), rng.uniform(1600, 2300), rng.choice(["~", "|", "..", "ш"]), rng.uniform(5, 35))
+
+    return {
+        "markup": {"text_items": items},
+        "expected": {
+            "номер счет-фактуры": values["number"],
+            "дата счет-фактуры": values["date"],
+            "ИНН продавца": values["seller_inn"],
+            "ИНН покупателя": values["buyer_inn"],
+            "сумма к оплате": values["total"],
+        },
+    }
+
+
+# Формулировки запросов к полям УПД: поле и равнозначные запросы пользователей
+QUERY_PARAPHRASES = {
+    "seller_inn": ["ИНН продавца", "найди ИНН продавца", "нужен инн поставщика", "ИНН поставщика?",
+                   "извлеки ИНН продавца", "инн продавца"],
+    "buyer_inn": ["ИНН покупателя", "найди инн покупателя", "ИНН плательщика", "нужен ИНН покупателя"],
+    "seller_kpp": ["КПП продавца", "найди КПП поставщика", "кпп продавца"],
+    "number": ["номер счет-фактуры", "найди номер счёт-фактуры", "номер счета-фактуры", "№ счет фактуры"],
+    "date": ["дата счет-фактуры", "дата счета-фактуры", "найди дату счёт-фактуры", "дата счет фактуры"],
+    "total": ["сумма к оплате", "всего к оплате", "итого к оплате", "найди сумму к оплате"],
+    "vat": ["сумма НДС", "итого НДС", "найди сумму НДС"],
+    # Поля, отличающиеся от соседних коротким словом или реквизитом
+    "total_with_vat": ["сумма с НДС", "всего с НДС", "итого с НДС", "сумма с учетом НДС"],
+    "total_without_vat": ["сумма без НДС", "всего без НДС", "итого без НДС"],
+    "seller_bank": ["банк продавца", "банк поставщика", "найди банк продавца"],
+    "seller_bik": ["БИК банка продавца", "найди БИК банка поставщика", "бик банка продавца"],
+    "seller_account": ["р/с продавца", "расчетный счет продавца", "найди расчетный счет поставщика",
+                       "расч. счет продавца"],
+    "seller_corr_account": ["к/с продавца", "корреспондентский счет продавца", "корр. счет поставщика"],
+    "contract_date": ["дата договора", "найди дату договора"],
+    "attorney_date": ["дата доверенности", "найди дату доверенности"],
+    "shipment_date": ["дата отгрузки", "дата отгрузки товара"],
+}
+
+
+def evaluation_set(size: int = 8) -> List[Dict[str, Any]]:
+    """Фиксированный набор страниц УПД для проверки качества шаблонов"""
+    return [dict(upd_markup(seed), name=f"upd-{seed}") for seed in range(size)]
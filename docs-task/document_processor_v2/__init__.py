@@ -5,10 +5,52 @@ Document Processor V2
 
 Основные компоненты:
 - AssistantManager: Управление ассистентами OpenAI
+- AssistantRegistry: Персистентный реестр ассистентов
+- FileRegistry: Реестр загруженных файлов с дедупликацией по содержимому
+- ImagePreprocessor: Уменьшение и перекодирование сканов перед загрузкой
+- MarkupCache: Кэш разметки по содержимому изображений
+- TemplateCache: Кэш шаблонов по хэшу разметки и запросу
+- Markup: Компактная разметка со столбцовым хранением элементов
+- LayoutIndex: Индекс макетов документов с проверенными шаблонами
+- QueryIndex: Канонические ключи перефразированных запросов
+- MetricsRegistry: Метрики этапов, запусков и кэшей в формате Prometheus и JSON
 - DocumentProcessor: Обработка документов и генерация шаблонов
+- BulkProcessor: Пакетная обработка каталогов с возобновляемым манифестом
+- TemplateEngine: Локальное применение DSL шаблонов к разметке
 """
 
 from .src.assistant_manager import AssistantManager
+from .src.assistant_registry import AssistantRegistry
+from .src.file_registry import FileRegistry
+from .src.preprocess import ImagePreprocessor
+from .src.cache import DiskCache, MarkupCache, TemplateCache
+from .src.markup import Markup
+from .src.layout import LayoutIndex
+from .src.query_index import QueryIndex
+from .src.metrics import MetricsRegistry
 from .src.document_processor import DocumentProcessor
+from .src.bulk import BulkProcessor
+from .src.dsl_engine import DocumentIndex, TemplateEngine, apply_template
+from .src.spatial_index import SpatialIndex
+from .src.text_index import AnchorIndex
 
-__all__ = ['AssistantManager', 'DocumentProcessor']
+__all__ = [
+    'AssistantManager',
+    'AssistantRegistry',
+    'FileRegistry',
+    'ImagePreprocessor',
+    'DiskCache',
+    'MarkupCache',
+    'TemplateCache',
+    'Markup',
+    'LayoutIndex',
+    'QueryIndex',
+    'MetricsRegistry',
+    'DocumentProcessor',
+    'BulkProcessor',
+    'DocumentIndex',
+    'TemplateEngine',
+    'apply_template',
+    'SpatialIndex',
+    'AnchorIndex',
+]
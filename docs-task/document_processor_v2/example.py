@@ -27,19 +27,17 @@ def main():
             "найди номер документа"
         ]
 
-        # Обрабатываем каждый запрос
-        for query in queries:
-            print(f"\nОбработка запроса: {query}")
-            
-            result = processor.process_document(
-                image_path=image_path,
-                query=query,
-                output_dir="results"
-            )
-            
-            print(f"Результаты:")
-            print(f"  Разметка: {result['markup_path']}")
-            print(f"  Шаблон: {result['template_path']}")
+        # Обрабатываем все запросы одним запуском ассистента шаблонов
+        result = processor.process_documents(
+            image_path=image_path,
+            queries=queries,
+            output_dir="results"
+        )
+
+        print(f"Результаты:")
+        print(f"  Разметка: {result['markup_path']}")
+        for query, template_path in result['template_paths'].items():
+            print(f"  Шаблон ({query}): {template_path}")
 
     except Exception as e:
         print(f"Ошибка при обработке: {e}")
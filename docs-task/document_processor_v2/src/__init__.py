@@ -5,6 +5,37 @@ Document Processor V2 Source
 """
 
 from .assistant_manager import AssistantManager
+from .assistant_registry import AssistantRegistry
+from .file_registry import FileRegistry
+from .preprocess import ImagePreprocessor
+from .cache import DiskCache, MarkupCache, TemplateCache
+from .markup import Markup
+from .layout import LayoutIndex
+from .query_index import QueryIndex
+from .metrics import MetricsRegistry
 from .document_processor import DocumentProcessor
+from .bulk import BulkProcessor
+from .dsl_engine import DocumentIndex, TemplateEngine, apply_template
+from .spatial_index import SpatialIndex
+from .text_index import AnchorIndex
 
-__all__ = ['AssistantManager', 'DocumentProcessor']
+__all__ = [
+    'AssistantManager',
+    'AssistantRegistry',
+    'FileRegistry',
+    'ImagePreprocessor',
+    'DiskCache',
+    'MarkupCache',
+    'TemplateCache',
+    'Markup',
+    'LayoutIndex',
+    'QueryIndex',
+    'MetricsRegistry',
+    'DocumentProcessor',
+    'BulkProcessor',
+    'DocumentIndex',
+    'TemplateEngine',
+    'apply_template',
+    'SpatialIndex',
+    'AnchorIndex',
+]
@@ -2,11 +2,27 @@
 
 import os
 import json
+import time
 import logging
 from pathlib import Path
-from typing import Optional, Dict, Any, List
+from dataclasses import replace
+from typing import Optional, Dict, Any, List, Union
 import openai
-from openai import OpenAI
+from .assistant_registry import AssistantRegistry
+from .cache import MarkupCache, TemplateCache
+from .file_registry import DEFAULT_FILE_TTL, FileCollector, FileRegistry, file_digest, upload_name
+from .http_pool import openai_client, timeout_for
+from .layout import LayoutIndex
+from .markup import Markup
+from .metrics import Sample, cache_samples, file_samples, shared_metrics, timed_stage
+from .query_index import QueryIndex
+from .rate_limiter import request_budget
+from .run_poller import PollPolicy, RunDurations, poll_run, stream_run, streaming_enabled
+
+# Бюджет кэша разметки по умолчанию: 1 ГиБ
+DEFAULT_MARKUP_CACHE_MAX_BYTES = 1024 ** 3
+# Бюджет дискового кэша шаблонов по умолчанию: 256 МиБ
+DEFAULT_TEMPLATE_CACHE_MAX_BYTES = 256 * 1024 ** 2
 
 # Настройка логирования
 logging.basicConfig(
@@ -24,11 +40,68 @@ class AssistantManager:
         if not self.api_key:
             raise ValueError("Не установлена переменная окружения OPENAI_API_KEY")
         
-        self.client = OpenAI()
+        self.client = openai_client()
         self.script_dir = Path(__file__).parent.parent
         self.assistants: Dict[str, str] = {}
-        self.cache_dir = self.script_dir / 'cache'
-        self.cache_dir.mkdir(exist_ok=True)
+        self.cache_dir = Path(os.getenv('CACHE_DIR') or self.script_dir / 'cache')
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.cache_enabled = os.getenv('CACHE_ENABLED', 'true').lower() != 'false'
+        self.markup_cache = MarkupCache(
+            self.cache_dir / 'markup',
+            max_bytes=int(os.getenv('MARKUP_CACHE_MAX_BYTES', DEFAULT_MARKUP_CACHE_MAX_BYTES))
+        )
+        self.template_cache = TemplateCache(
+            self.cache_dir / 'templates',
+            max_entries=int(os.getenv('TEMPLATE_CACHE_MEMORY_ENTRIES', 1024)),
+            max_bytes=int(os.getenv('TEMPLATE_CACHE_MAX_BYTES', DEFAULT_TEMPLATE_CACHE_MAX_BYTES))
+        )
+        # Проверенные шаблоны переиспользуются документами того же макета
+        self.layout_index = LayoutIndex.from_env(self.cache_dir)
+        # Перефразированные запросы получают один ключ в кэшах шаблонов
+        self.query_index = QueryIndex.from_env(self.cache_dir)
+        self.registry = AssistantRegistry(
+            os.getenv('ASSISTANT_REGISTRY_PATH') or self.cache_dir / 'assistants.json'
+        )
+        self.poll_policy = PollPolicy.from_env()
+        self.run_durations = RunDurations()
+        self.streaming = streaming_enabled()
+
+        # Загруженные файлы переиспользуются по хэшу и удаляются фоновым сборщиком
+        self.file_dedup = os.getenv('FILE_DEDUP', 'true').lower() != 'false'
+        self.file_registry = FileRegistry(
+            os.getenv('FILE_REGISTRY_PATH') or self.cache_dir / 'files.json',
+            ttl=float(os.getenv('FILE_TTL', DEFAULT_FILE_TTL))
+        )
+        self.file_collector = FileCollector(self.file_registry, self.client)
+        if self.file_dedup:
+            self.file_collector.start(float(os.getenv('FILE_GC_INTERVAL', 300)))
+
+        # Счетчики кэшей и реестра файлов снимаются при чтении метрик
+        shared_metrics().collector("caches", self.metric_samples)
+        shared_metrics().collector("file_registry", lambda: file_samples(self.file_registry.stats()))
+
+    def metric_samples(self) -> List[Sample]:
+        """Счетчики кэшей и индексов для метрик"""
+        template = self.template_cache.stats()
+        layout = self.layout_index.stats()
+        queries = self.query_index.stats()
+        return (
+            cache_samples("markup", self.markup_cache.stats())
+            + cache_samples("template_memory", {
+                "hits": template["memory_hits"], "entries": template["memory_entries"]
+            })
+            + cache_samples("template_disk", {
+                name[len("disk_"):]: value for name, value in template.items() if name.startswith("disk_")
+            })
+            + cache_samples("layout", {
+                "hits": layout["hits"], "misses": layout["misses"], "entries": layout["layouts"]
+            })
+            + cache_samples("query", {
+                "hits": queries["exact_hits"] + queries["semantic_hits"],
+                "misses": queries["misses"],
+                "entries": queries["keys"],
+            })
+        )
 
     def load_prompt(self, prompt_path: str) -> str:
         """Загрузка промпта из файла"""
@@ -39,25 +112,59 @@ class AssistantManager:
             logger.error(f"Не удалось загрузить промпт {prompt_path}: {e}")
             raise
 
-    def get_or_create_assistant(self, name: str, model: str, prompt_path: str, tools: List[Dict[str, Any]]) -> str:
-        """Получение или создание ассистента с заданными параметрами"""
-        if name in self.assistants:
-            return self.assistants[name]
-
+    def assistant_exists(self, assistant_id: str) -> bool:
+        """Проверка, что ассистент из реестра существует в OpenAI"""
         try:
-            instructions = self.load_prompt(prompt_path)
+            self.client.beta.assistants.retrieve(assistant_id)
+            return True
+        except openai.NotFoundError:
+            logger.warning(f"Ассистент {assistant_id} не найден, будет создан заново")
+            return False
+
+    @timed_stage("assistant")
+    def get_or_create_assistant(
+        self,
+        name: str,
+        model: str,
+        prompt_path: str,
+        tools: List[Dict[str, Any]],
+        description: Optional[str] = None
+    ) -> str:
+        """Получение или создание ассистента с заданными параметрами
+
+        ID ассистента берется из персистентного реестра, новый ассистент
+        создается только при изменении имени, модели, инструментов или промпта.
+        """
+        instructions = self.load_prompt(prompt_path)
+        key = AssistantRegistry.make_key(name, model, instructions, tools)
+        if key in self.assistants:
+            return self.assistants[key]
+
+        def create() -> str:
+            logger.info(f"Создание ассистента {name}...")
+            params = {"description": description} if description else {}
             assistant = self.client.beta.assistants.create(
                 name=name,
                 model=model,
                 instructions=instructions,
-                tools=tools
+                tools=tools,
+                **params
             )
-            self.assistants[name] = assistant.id
             return assistant.id
+
+        try:
+            assistant_id = self.registry.get_or_create(
+                name, model, instructions, tools,
+                create=create,
+                exists=self.assistant_exists
+            )
+            self.assistants[key] = assistant_id
+            return assistant_id
         except Exception as e:
             logger.error(f"Ошибка при создании ассистента {name}: {e}")
             raise
 
+    @timed_stage("thread")
     def create_thread(self) -> str:
         """Создание нового треда"""
         try:
@@ -67,19 +174,35 @@ class AssistantManager:
             logger.error(f"Ошибка при создании треда: {e}")
             raise
 
+    @timed_stage("upload")
     def upload_file(self, file_path: str) -> str:
-        """Загрузка файла для использования ассистентом"""
+        """Загрузка файла для использования ассистентом
+
+        Если файл с тем же содержимым уже загружен, возвращается его ID.
+        """
         try:
+            if not self.file_dedup:
+                with open(file_path, 'rb') as f:
+                    file = self.client.files.create(file=f, purpose='assistants', timeout=timeout_for("upload"))
+                return file.id
+
+            digest = file_digest(file_path)
+            file_id = self.file_registry.acquire(digest)
+            if file_id:
+                logger.info(f"Файл {file_path} уже загружен: {file_id}")
+                return file_id
             with open(file_path, 'rb') as f:
                 file = self.client.files.create(
-                    file=f,
-                    purpose='assistants'
+                    file=(upload_name(digest, file_path, self.file_registry.prefix), f),
+                    purpose='assistants',
+                    timeout=timeout_for("upload")
                 )
-            return file.id
+            return self.file_registry.register(digest, file.id, file.bytes)
         except Exception as e:
             logger.error(f"Ошибка при загрузке файла {file_path}: {e}")
             raise
 
+    @timed_stage("message")
     def add_message(self, thread_id: str, content: str, file_id: Optional[str] = None) -> str:
         """Добавление сообщения в тред"""
         try:
@@ -111,66 +234,115 @@ class AssistantManager:
             logger.error(f"Ошибка при запуске ассистента: {e}")
             raise
 
-    def wait_for_completion(self, thread_id: str, run_id: str, max_retries: int = 3) -> None:
-        """Ожидание завершения выполнения с механизмом повторных попыток"""
-        import time
-        retries = 0
-        
-        while retries < max_retries:
-            try:
-                while True:
-                    run = self.client.beta.threads.runs.retrieve(
-                        thread_id=thread_id,
-                        run_id=run_id
-                    )
-                    if run.status == "completed":
-                        return
-                    elif run.status in ["failed", "cancelled", "expired"]:
-                        raise RuntimeError(f"Выполнение завершилось с ошибкой: {run.status}")
-                    time.sleep(1)
-            except Exception as e:
-                retries += 1
-                if retries >= max_retries:
-                    raise
-                logger.warning(f"Попытка {retries} из {max_retries} не удалась: {e}")
-                time.sleep(2 ** retries)  # Экспоненциальная задержка
+    def wait_for_completion(
+        self,
+        thread_id: str,
+        run_id: str,
+        max_retries: int = 3,
+        assistant_id: Optional[str] = None
+    ) -> None:
+        """Ожидание завершения выполнения с адаптивным опросом
+
+        Временные ошибки API повторяются внутри опроса (не больше max_retries подряд).
+        По assistant_id учитывается типичная длительность его запусков.
+        """
+        try:
+            elapsed = poll_run(
+                lambda: self.client.beta.threads.runs.retrieve(
+                    thread_id=thread_id, run_id=run_id, timeout=timeout_for("poll")
+                ),
+                run_id,
+                replace(self.poll_policy, max_errors=max_retries),
+                self.run_durations.expected(assistant_id) if assistant_id else None
+            )
+            if assistant_id:
+                self.run_durations.record(assistant_id, elapsed)
+        except Exception as e:
+            logger.error(f"Ошибка при ожидании выполнения {run_id}: {e}")
+            raise
+
+    @timed_stage("run")
+    def run_and_wait(self, thread_id: str, assistant_id: str, tokens: int = 0) -> str:
+        """Запуск ассистента и ожидание завершения; возвращает ID запуска
+
+        При RUN_STREAMING=true завершение отслеживается по потоку событий запуска.
+        tokens - оценка расхода токенов запуском для планировщика квот.
+        """
+        with request_budget(tokens):
+            return self._run_and_wait(thread_id, assistant_id)
+
+    def _run_and_wait(self, thread_id: str, assistant_id: str) -> str:
+        if not self.streaming:
+            run_id = self.run_assistant(thread_id, assistant_id)
+            self.wait_for_completion(thread_id, run_id, assistant_id=assistant_id)
+            return run_id
+
+        try:
+            started = time.monotonic()
+            with self.client.beta.threads.runs.create(
+                thread_id=thread_id,
+                assistant_id=assistant_id,
+                stream=True,
+                timeout=timeout_for("stream")
+            ) as events:
+                run_id = stream_run(
+                    events,
+                    lambda run_id: self.client.beta.threads.runs.retrieve(
+                        thread_id=thread_id, run_id=run_id, timeout=timeout_for("poll")
+                    ),
+                    self.poll_policy,
+                    self.run_durations.expected(assistant_id)
+                )
+            self.run_durations.record(assistant_id, time.monotonic() - started)
+            return run_id
+        except Exception as e:
+            logger.error(f"Ошибка при выполнении ассистента: {e}")
+            raise
 
+    @timed_stage("result")
     def get_result(self, thread_id: str) -> str:
         """Получение результата выполнения"""
         try:
             messages = self.client.beta.threads.messages.list(
                 thread_id=thread_id,
                 order="desc",
-                limit=1
+                limit=1,
+                timeout=timeout_for("list")
             )
             return messages.data[0].content[0].text.value
         except Exception as e:
             logger.error(f"Ошибка при получении результата: {e}")
             raise
 
+    @timed_stage("cleanup")
     def cleanup(self, file_id: str) -> None:
-        """Очистка временных файлов"""
+        """Очистка временных файлов
+
+        При дедупликации ссылка только освобождается, файл удалит сборщик.
+        """
+        if self.file_dedup:
+            self.file_registry.release(file_id)
+            return
         try:
             self.client.files.delete(file_id)
         except Exception as e:
             logger.warning(f"Ошибка при удалении файла {file_id}: {e}")
 
-    def get_cached_markup(self, image_path: str) -> Optional[Dict[str, Any]]:
-        """Получение кэшированной разметки для изображения"""
-        cache_file = self.cache_dir / f"{Path(image_path).stem}_markup.json"
-        if cache_file.exists():
-            try:
-                with open(cache_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except Exception as e:
-                logger.warning(f"Ошибка при чтении кэша {cache_file}: {e}")
+    def get_cached_markup(self, image_path: str) -> Optional[Markup]:
+        """Получение кэшированной разметки для изображения по его содержимому"""
+        if not self.cache_enabled:
+            return None
+        try:
+            return self.markup_cache.get(self.markup_cache.key_for_file(image_path))
+        except Exception as e:
+            logger.warning(f"Ошибка при чтении кэша разметки для {image_path}: {e}")
         return None
 
-    def cache_markup(self, image_path: str, markup: Dict[str, Any]) -> None:
+    def cache_markup(self, image_path: str, markup: Union[Dict[str, Any], Markup]) -> None:
         """Сохранение разметки в кэш"""
-        cache_file = self.cache_dir / f"{Path(image_path).stem}_markup.json"
+        if not self.cache_enabled:
+            return
         try:
-            with open(cache_file, 'w', encoding='utf-8') as f:
-                json.dump(markup, f, ensure_ascii=False, indent=2)
+            self.markup_cache.put(self.markup_cache.key_for_file(image_path), markup)
         except Exception as e:
-            logger.warning(f"Ошибка при сохранении в кэш {cache_file}: {e}")
+            logger.warning(f"Ошибка при сохранении разметки {image_path} в кэш: {e}")
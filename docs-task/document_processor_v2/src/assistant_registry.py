@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import asyncio
+import time
+import hashlib
+import logging
+import tempfile
+from contextlib import asynccontextmanager, contextmanager
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Callable, Awaitable, Iterator, AsyncIterator
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка между процессами недоступна
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+def prompt_hash(instructions: str) -> str:
+    """Хэш текста промпта, используемый как его версия"""
+    return hashlib.sha256(instructions.encode('utf-8')).hexdigest()
+
+
+class AssistantRegistry:
+    """Персистентный реестр ассистентов, общий для нескольких процессов
+
+    Ассистент идентифицируется набором (name, model, tools, хэш промпта).
+    Если промпт не менялся, повторно используется уже созданный ассистент,
+    иначе создается новый и записывается под новым ключом.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock_path = self.path.with_suffix(self.path.suffix + '.lock')
+
+    @staticmethod
+    def make_key(name: str, model: str, instructions: str, tools: List[Dict[str, Any]]) -> str:
+        """Ключ ассистента в реестре"""
+        payload = json.dumps(
+            [name, model, tools, prompt_hash(instructions)],
+            ensure_ascii=False, sort_keys=True
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """Эксклюзивная блокировка реестра между процессами"""
+        if fcntl is None:
+            yield
+            return
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @asynccontextmanager
+    async def _alocked(self) -> AsyncIterator[None]:
+        """Блокировка реестра, которая ожидается в потоке и не останавливает цикл событий
+
+        Другой процесс может держать блокировку на время сетевых вызовов
+        aget_or_create, поэтому flock(LOCK_EX) на цикле событий остановил бы
+        все запросы воркера.
+        """
+        if fcntl is None:
+            yield
+            return
+        lock_file = open(self.lock_path, 'a')
+        acquire = asyncio.ensure_future(asyncio.to_thread(fcntl.flock, lock_file, fcntl.LOCK_EX))
+        try:
+            await asyncio.shield(acquire)
+        except BaseException:
+            # Поток может получить блокировку уже после отмены: закрытие файла ее снимает
+            acquire.add_done_callback(lambda _: lock_file.close())
+            raise
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+
+    def _read(self) -> Dict[str, Dict[str, Any]]:
+        if not self.path.exists():
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Не удалось прочитать реестр ассистентов {self.path}: {e}")
+            return {}
+
+    def _write(self, entries: Dict[str, Dict[str, Any]]) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, prefix='.assistants-')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(entries, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def get(self, key: str) -> Optional[str]:
+        """ID ассистента по ключу или None"""
+        entry = self._read().get(key)
+        return entry["assistant_id"] if entry else None
+
+    def remove(self, key: str) -> None:
+        """Удаление записи (например, если ассистент удален в OpenAI)"""
+        with self._locked():
+            entries = self._read()
+            if entries.pop(key, None) is not None:
+                self._write(entries)
+
+    def _entry(self, assistant_id: str, name: str, model: str, instructions: str) -> Dict[str, Any]:
+        return {
+            "assistant_id": assistant_id,
+            "name": name,
+            "model": model,
+            "prompt_hash": prompt_hash(instructions),
+            "created_at": int(time.time()),
+        }
+
+    def get_or_create(
+        self,
+        name: str,
+        model: str,
+        instructions: str,
+        tools: List[Dict[str, Any]],
+        create: Callable[[], str],
+        exists: Optional[Callable[[str], bool]] = None
+    ) -> str:
+        """Получение ID ассистента из реестра или создание нового через create()
+
+        exists позволяет проверить, что сохраненный ассистент еще существует в OpenAI.
+        """
+        key = self.make_key(name, model, instructions, tools)
+        with self._locked():
+            entries = self._read()
+            entry = entries.get(key)
+            if entry and (exists is None or exists(entry["assistant_id"])):
+                return entry["assistant_id"]
+
+            assistant_id = create()
+            entries[key] = self._entry(assistant_id, name, model, instructions)
+            self._write(entries)
+            logger.info(f"Ассистент {name} ({assistant_id}) добавлен в реестр")
+            return assistant_id
+
+    async def aget_or_create(
+        self,
+        name: str,
+        model: str,
+        instructions: str,
+        tools: List[Dict[str, Any]],
+        create: Callable[[], Awaitable[str]],
+        exists: Optional[Callable[[str], Awaitable[bool]]] = None
+    ) -> str:
+        """Асинхронный вариант get_or_create для AsyncOpenAI
+
+        Блокировка ожидается в потоке: пока другой процесс создает ассистента,
+        цикл событий продолжает обслуживать остальные запросы.
+        """
+        key = self.make_key(name, model, instructions, tools)
+        async with self._alocked():
+            entries = self._read()
+            entry = entries.get(key)
+            if entry and (exists is None or await exists(entry["assistant_id"])):
+                return entry["assistant_id"]
+
+            assistant_id = await create()
+            entries[key] = self._entry(assistant_id, name, model, instructions)
+            self._write(entries)
+            logger.info(f"Ассистент {name} ({assistant_id}) добавлен в реестр")
+            return assistant_id
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Пакетная обработка каталогов сканов.
+
+Входы задаются каталогами, glob шаблонами или текстовыми списками файлов
+(по пути на строку). Документы обрабатываются параллельно с ограничением
+числа одновременных запросов, результат каждого документа дописывается
+строкой в JSONL манифест. Повторный запуск с тем же манифестом пропускает
+документы, уже успешно обработанные с теми же запросами.
+"""
+
+import os
+import sys
+import json
+import glob
+import time
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Any, List, Optional, Iterable, Union
+
+from .document_processor import DocumentProcessor
+from .http_pool import pool_stats
+from .metrics import shared_metrics
+from .pdf_pages import PDF_EXTENSIONS
+from .rate_limiter import BULK, request_priority
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.tif', '.tiff', '.bmp', '.webp', '.gif'}
+DOCUMENT_EXTENSIONS = IMAGE_EXTENSIONS | PDF_EXTENSIONS
+
+# Расширения файлов со списком путей
+LIST_EXTENSIONS = {'.txt', '.lst'}
+
+
+def collect_inputs(sources: Iterable[str]) -> List[Path]:
+    """Изображения и PDF из каталогов, glob шаблонов и списков файлов без повторов"""
+    found: Dict[str, Path] = {}
+
+    def add(path: Path) -> None:
+        found.setdefault(str(path.resolve()), path)
+
+    for source in sources:
+        path = Path(source)
+        if path.is_dir():
+            for child in sorted(path.rglob('*')):
+                if child.is_file() and child.suffix.lower() in DOCUMENT_EXTENSIONS:
+                    add(child)
+        elif path.is_file() and path.suffix.lower() in LIST_EXTENSIONS:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if line and not line.startswith('#'):
+                        # Относительные пути считаются от каталога списка
+                        add(path.parent / line)
+        elif path.is_file():
+            add(path)
+        elif glob.has_magic(source):
+            for match in sorted(glob.glob(source, recursive=True)):
+                if Path(match).is_file():
+                    add(Path(match))
+        else:
+            raise FileNotFoundError(f"Не найден вход пакетной обработки: {source}")
+    return list(found.values())
+
+
+def queries_key(queries: List[str]) -> str:
+    """Ключ набора запросов (их канонических ключей) для проверки актуальности записи манифеста"""
+    return hashlib.sha256('\0'.join(queries).encode('utf-8')).hexdigest()[:16]
+
+
+def document_dir_name(image_path: Path) -> str:
+    """Каталог результатов документа: имя файла и хэш полного пути"""
+    digest = hashlib.sha256(str(image_path.resolve()).encode('utf-8')).hexdigest()[:8]
+    return f"{image_path.stem}-{digest}"
+
+
+class Manifest:
+    """JSONL манифест пакетного запуска
+
+    Каждая строка - результат одного документа. Строки только дописываются
+    и сбрасываются на диск сразу, поэтому после падения процесса теряется
+    не больше одной (недописанной) строки, которая пропускается при чтении.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def load(self) -> Dict[str, Dict[str, Any]]:
+        """Последняя запись для каждого документа"""
+        records: Dict[str, Dict[str, Any]] = {}
+        if not self.path.exists():
+            return records
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logger.warning(f"Пропущена поврежденная строка манифеста {self.path}:{line_number}")
+                    continue
+                records[record["key"]] = record
+        return records
+
+    def completed(self, queries: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Документы, успешно обработанные с этим набором запросов"""
+        key = queries_key(queries)
+        return {
+            document: record for document, record in self.load().items()
+            if record.get("status") == "ok" and record.get("queries_key") == key
+        }
+
+    def append(self, record: Dict[str, Any]) -> None:
+        """Дописывание записи с немедленным сбросом на диск"""
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+
+class BulkProcessor:
+    """Параллельная обработка множества документов с манифестом"""
+
+    def __init__(
+        self,
+        processor: DocumentProcessor,
+        output_dir: Union[str, Path],
+        manifest_path: Optional[Union[str, Path]] = None,
+        concurrency: int = 4
+    ):
+        if concurrency < 1:
+            raise ValueError("Число параллельных обработок должно быть положительным")
+        self.processor = processor
+        self.output_dir = Path(output_dir)
+        self.manifest = Manifest(manifest_path or self.output_dir / 'manifest.jsonl')
+        self.concurrency = concurrency
+
+    def query_keys(self, queries: List[str]) -> List[str]:
+        """Канонические ключи запросов"""
+        return [self.processor.query_key(query, count=False) for query in queries]
+
+    def process_one(self, image_path: Path, queries: List[str]) -> Dict[str, Any]:
+        """Обработка одного документа; ошибки возвращаются записью манифеста"""
+        started = time.monotonic()
+        record: Dict[str, Any] = {
+            "key": str(image_path.resolve()),
+            "image_path": str(image_path),
+            "queries": queries,
+            "queries_key": queries_key(self.query_keys(queries)),
+        }
+        output_dir = self.output_dir / document_dir_name(image_path)
+        try:
+            # Пакетные документы получают квоту API после интерактивных запросов
+            with request_priority(BULK):
+                if len(queries) == 1:
+                    result = self.processor.process_document(str(image_path), queries[0], str(output_dir))
+                    template_paths = {queries[0]: result["template_path"]}
+                else:
+                    result = self.processor.process_documents(str(image_path), queries, str(output_dir))
+                    template_paths = result["template_paths"]
+            record.update(status="ok", markup_path=result["markup_path"], template_paths=template_paths)
+        except Exception as e:
+            logger.error(f"Ошибка при обработке {image_path}: {e}")
+            record.update(status="error", error=f"{type(e).__name__}: {e}")
+        record["duration"] = round(time.monotonic() - started, 3)
+        record["finished_at"] = time.strftime('%Y-%m-%dT%H:%M:%S')
+        return record
+
+    def run(self, images: List[Path], queries: List[str]) -> Dict[str, int]:
+        """Обработка документов, еще не завершенных в манифесте"""
+        # Перефразированные запросы не требуют повторной обработки документов
+        completed = self.manifest.completed(self.query_keys(queries))
+        pending = [image for image in images if str(image.resolve()) not in completed]
+        summary = {"total": len(images), "skipped": len(images) - len(pending), "ok": 0, "error": 0}
+        logger.info(
+            f"Пакетная обработка: документов {summary['total']}, "
+            f"уже обработано {summary['skipped']}, в очереди {len(pending)}"
+        )
+
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        futures = [executor.submit(self.process_one, image, queries) for image in pending]
+        recorded = set()
+        try:
+            for done, future in enumerate(as_completed(futures), 1):
+                record = future.result()
+                self.manifest.append(record)
+                recorded.add(future)
+                summary[record["status"]] += 1
+                logger.info(f"[{done}/{len(pending)}] {record['image_path']}: {record['status']}")
+        except KeyboardInterrupt:
+            logger.warning(
+                "Обработка прервана: выполняющиеся документы будут дописаны в манифест, "
+                "остальные обработаны при следующем запуске"
+            )
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=True)
+            # Уже оплаченные результаты сохраняются, чтобы не повторять их при возобновлении
+            for future in futures:
+                if future in recorded or future.cancelled() or future.exception() is not None:
+                    continue
+                self.manifest.append(future.result())
+            raise
+        finally:
+            executor.shutdown(wait=True)
+        stats = pool_stats()
+        logger.info(f"Пул соединений OpenAI: {stats.get('sync')}, квоты: {stats.get('rate_limit')}")
+        return summary
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Пакетная обработка каталогов сканов')
+    parser.add_argument('inputs', nargs='+', help='Каталоги, glob шаблоны или файлы со списком путей')
+    parser.add_argument('--queries', nargs='+', required=True, help='Запросы для каждого документа')
+    parser.add_argument('--output-dir', required=True, help='Директория для сохранения результатов')
+    parser.add_argument('--manifest', default=None,
+                        help='JSONL манифест (по умолчанию <output-dir>/manifest.jsonl)')
+    parser.add_argument('--concurrency', type=int, default=4, help='Число документов, обрабатываемых параллельно')
+    parser.add_argument('--metrics-json', default=None,
+                        help='Сохранить метрики этапов, запусков и кэшей в JSON файл')
+
+    args = parser.parse_args()
+    try:
+        images = collect_inputs(args.inputs)
+        bulk = BulkProcessor(DocumentProcessor(), args.output_dir, args.manifest, args.concurrency)
+        summary = bulk.run(images, args.queries)
+    except KeyboardInterrupt:
+        sys.exit(130)
+    except Exception as e:
+        logger.error(f"Ошибка: {e}")
+        sys.exit(1)
+    finally:
+        if args.metrics_json:
+            shared_metrics().write_json(args.metrics_json)
+
+    print(json.dumps(summary, ensure_ascii=False))
+    if summary["error"]:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
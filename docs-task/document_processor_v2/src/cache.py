@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import json
+import hashlib
+import logging
+import tempfile
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Union, BinaryIO
+
+from .markup import Markup
+
+logger = logging.getLogger(__name__)
+
+# Размер блока при потоковом хэшировании файлов
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def markup_hash(markup: Union[Dict[str, Any], Markup]) -> str:
+    """Хэш содержимого разметки, не зависящий от форматирования JSON"""
+    if isinstance(markup, Markup):
+        markup = markup.to_dict()
+    payload = json.dumps(markup, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def normalize_query(query: str) -> str:
+    """Нормализация запроса: регистр, ё, кавычки, пунктуация и пробелы"""
+    query = query.lower().replace('ё', 'е')
+    query = re.sub(r'[^\w\s/№-]', ' ', query)
+    return ' '.join(query.split())
+
+
+class DiskCache:
+    """Шардированный дисковый кэш с атомарной записью и LRU вытеснением
+
+    Записи раскладываются по каталогам root/ab/cd/<key><suffix>, запись идет
+    через временный файл и os.replace, поэтому параллельные процессы никогда
+    не видят частично записанные данные. Время последнего обращения хранится
+    в mtime файла; при превышении max_bytes удаляются самые старые записи.
+    """
+
+    def __init__(self, root: Union[str, Path], max_bytes: Optional[int] = None, suffix: str = '.json'):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._size: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def path_for(self, key: str, suffix: Optional[str] = None) -> Path:
+        """Путь к файлу записи"""
+        return self.root / key[:2] / key[2:4] / f"{key}{suffix or self.suffix}"
+
+    def get_bytes(self, key: str, suffix: Optional[str] = None, count: bool = True) -> Optional[bytes]:
+        """Чтение записи; обращение обновляет ее позицию в LRU
+
+        count=False - служебное чтение (индекс рядом с разметкой), не
+        учитываемое в счетчиках попаданий и промахов.
+        """
+        path = self.path_for(key, suffix)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += count
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += count
+        return data
+
+    def put_bytes(self, key: str, data: bytes, suffix: Optional[str] = None) -> None:
+        """Атомарная запись; при превышении бюджета запускается вытеснение"""
+        path = self.path_for(key, suffix)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            previous = path.stat().st_size
+        except FileNotFoundError:
+            previous = 0
+
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+        with self._lock:
+            self.writes += 1
+            if self._size is not None:
+                self._size += len(data) - previous
+        if self.max_bytes is not None and self.size() > self.max_bytes:
+            self.evict()
+
+    def delete(self, key: str, suffix: Optional[str] = None) -> None:
+        """Удаление записи"""
+        path = self.path_for(key, suffix)
+        try:
+            size = path.stat().st_size
+            path.unlink()
+        except FileNotFoundError:
+            return
+        with self._lock:
+            if self._size is not None:
+                self._size -= size
+
+    def _entries(self):
+        for path in self.root.glob('??/??/*'):
+            if path.name.startswith('.tmp-'):
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            yield path, stat
+
+    def size(self) -> int:
+        """Текущий объем кэша в байтах (считается по диску при первом обращении)"""
+        with self._lock:
+            if self._size is None:
+                self._size = sum(stat.st_size for _, stat in self._entries())
+            return self._size
+
+    def evict(self) -> None:
+        """Удаление давно не использованных записей до 90% бюджета
+
+        Файлы одного ключа с разными суффиксами (разметка и ее индекс)
+        вытесняются вместе, по времени последнего обращения к любому из них.
+        """
+        if self.max_bytes is None:
+            return
+        target = int(self.max_bytes * 0.9)
+        groups: Dict[str, list] = {}
+        for path, stat in self._entries():
+            groups.setdefault(path.name.split('.', 1)[0], []).append((path, stat))
+        entries = sorted(groups.values(), key=lambda group: max(stat.st_mtime for _, stat in group))
+        total = sum(stat.st_size for group in entries for _, stat in group)
+        removed = 0
+        for group in entries:
+            if total <= target:
+                break
+            for path, stat in group:
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+                total -= stat.st_size
+            removed += 1
+        with self._lock:
+            self._size = total
+            self.evictions += removed
+        if removed:
+            logger.info(f"Из кэша {self.root} вытеснено записей: {removed}")
+
+    def stats(self) -> Dict[str, int]:
+        """Счетчики попаданий, промахов и вытеснений"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "writes": self.writes,
+                "evictions": self.evictions,
+                "bytes": self._size if self._size is not None else -1,
+            }
+
+
+class MarkupCache(DiskCache):
+    """Кэш разметки, адресуемый по содержимому изображения и версии промпта"""
+
+    def __init__(self, root: Union[str, Path], prompt_version: str = "", max_bytes: Optional[int] = None):
+        super().__init__(root, max_bytes=max_bytes, suffix='.json')
+        self.prompt_version = prompt_version
+
+    def key_for_bytes(self, data: bytes) -> str:
+        """Ключ разметки для содержимого изображения"""
+        digest = hashlib.sha256(self.prompt_version.encode('utf-8') + b'\0')
+        digest.update(data)
+        return digest.hexdigest()
+
+    def key_for_stream(self, stream: BinaryIO) -> str:
+        """Ключ разметки для потока с содержимым изображения"""
+        digest = hashlib.sha256(self.prompt_version.encode('utf-8') + b'\0')
+        for chunk in iter(lambda: stream.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+        return digest.hexdigest()
+
+    def key_for_file(self, path: Union[str, Path]) -> str:
+        """Ключ разметки для файла изображения"""
+        with open(path, 'rb') as f:
+            return self.key_for_stream(f)
+
+    def get(self, key: str) -> Optional[Markup]:
+        """Компактная разметка по ключу или None"""
+        data = self.get_bytes(key)
+        if data is None:
+            return None
+        try:
+            return Markup.from_json(data)
+        except (ValueError, AttributeError) as e:
+            logger.warning(f"Поврежденная запись кэша {self.path_for(key)}: {e}")
+            self.delete(key)
+            self.delete(key, suffix='.index.json')
+            return None
+
+    def put(self, key: str, markup: Union[Dict[str, Any], Markup]) -> None:
+        """Сохранение разметки"""
+        if isinstance(markup, Markup):
+            markup = markup.to_dict()
+        self.put_bytes(key, json.dumps(markup, ensure_ascii=False).encode('utf-8'))
+        # Индекс прежней разметки с тем же ключом к новой не относится
+        self.delete(key, suffix='.index.json')
+
+    def get_index(self, key: str) -> Optional[Dict[str, Any]]:
+        """Пространственный индекс, сохраненный рядом с разметкой"""
+        data = self.get_bytes(key, suffix='.index.json', count=False)
+        if data is None:
+            return None
+        try:
+            return json.loads(data)
+        except ValueError:
+            self.delete(key, suffix='.index.json')
+            return None
+
+    def put_index(self, key: str, index: Dict[str, Any]) -> None:
+        """Сохранение пространственного индекса рядом с разметкой"""
+        self.put_bytes(key, json.dumps(index, separators=(',', ':')).encode('utf-8'), suffix='.index.json')
+
+
+class TemplateCache:
+    """Двухуровневый кэш YAML шаблонов: LRU в памяти и DiskCache на диске
+
+    Ключ: хэш разметки, нормализованный запрос и версия промпта шаблонов.
+    """
+
+    def __init__(
+        self,
+        root: Union[str, Path],
+        prompt_version: str = "",
+        max_entries: int = 1024,
+        max_bytes: Optional[int] = None
+    ):
+        self.disk = DiskCache(root, max_bytes=max_bytes, suffix='.yml')
+        self.prompt_version = prompt_version
+        self.max_entries = max_entries
+        self.memory: "OrderedDict[str, str]" = OrderedDict()
+        self.memory_hits = 0
+        self._lock = threading.Lock()
+
+    def key(self, markup_digest: str, query: str) -> str:
+        """Ключ шаблона для разметки и запроса"""
+        payload = '\0'.join([markup_digest, normalize_query(query), self.prompt_version])
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Шаблон из памяти или с диска"""
+        with self._lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.memory_hits += 1
+                return self.memory[key]
+        data = self.disk.get_bytes(key)
+        if data is None:
+            return None
+        template = data.decode('utf-8')
+        self._remember(key, template)
+        return template
+
+    def put(self, key: str, template: str) -> None:
+        """Сохранение провалидированного шаблона в оба уровня"""
+        self._remember(key, template)
+        self.disk.put_bytes(key, template.encode('utf-8'))
+
+    def _remember(self, key: str, template: str) -> None:
+        with self._lock:
+            self.memory[key] = template
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_entries:
+                self.memory.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        """Счетчики попаданий по уровням"""
+        stats = {f"disk_{name}": value for name, value in self.disk.stats().items()}
+        with self._lock:
+            stats["memory_hits"] = self.memory_hits
+            stats["memory_entries"] = len(self.memory)
+        return stats
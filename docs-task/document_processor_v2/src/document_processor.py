@@ -4,9 +4,24 @@ import os
 import json
 import yaml
 import logging
+import tempfile
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List, Tuple, Union
 from .assistant_manager import AssistantManager
+from .assistant_registry import prompt_hash
+from .cache import markup_hash
+from .dsl_engine import DocumentIndex, TemplateEngine
+from .layout import LayoutFingerprint, layout_fingerprint
+from .markup import Markup
+from .metrics import measure_stage, metrics_operation, shared_metrics, timed_stage
+from .pdf_pages import DEFAULT_DPI, is_pdf, merge_pages, render_pages
+from .preprocess import ImagePreprocessor
+from .prompt_encoding import MarkupEncoder
+from .query_pruning import MarkupPruner, value_matches
+from .rate_limiter import IMAGE_TOKENS, MARKUP_OUTPUT_TOKENS, TEMPLATE_OUTPUT_TOKENS, estimate_tokens
+from .spatial_index import SpatialIndex
 
 logging.basicConfig(
     format='[%(asctime)s] %(levelname)s: %(message)s',
@@ -20,6 +35,11 @@ class DocumentProcessor:
 
     def __init__(self):
         self.assistant_manager = AssistantManager()
+        self.preprocessor = ImagePreprocessor()
+        self.encoder = MarkupEncoder.from_env()
+        self.pruner = MarkupPruner.from_env()
+        self.pdf_dpi = int(os.getenv('PDF_DPI', DEFAULT_DPI))
+        self.page_workers = max(int(os.getenv('PDF_PAGE_WORKERS', 4)), 1)
         self.markup_assistant_id = None
         self.template_assistant_id = None
         self.initialize_assistants()
@@ -27,38 +47,67 @@ class DocumentProcessor:
     def initialize_assistants(self) -> None:
         """Инициализация ассистентов при первом использовании"""
         try:
+            # Версия промпта разметки входит в ключ кэша: новый промпт не отдает старую разметку
+            self.assistant_manager.markup_cache.prompt_version = prompt_hash(
+                self.assistant_manager.load_prompt("prompts/markup_generator.prompt")
+            )
+            # Формат и отбор разметки в сообщении тоже влияют на шаблон
+            self.assistant_manager.template_cache.prompt_version = prompt_hash(
+                self.assistant_manager.load_prompt("prompts/template_generator.prompt")
+            ) + self.encoder.signature + self.pruner.signature
+            self.assistant_manager.layout_index.prompt_version = self.assistant_manager.template_cache.prompt_version
+
             # Ассистент для разметки с GPT-4 Vision
             self.markup_assistant_id = self.assistant_manager.get_or_create_assistant(
                 name="Document Markup Generator",
                 model="gpt-4-vision-preview",
-                prompt_path="instructions/markup_generator.prompt",
-                tools=[{"type": "code_interpreter"}]
+                prompt_path="prompts/markup_generator.prompt",
+                tools=[{"type": "code_interpreter"}],
+                description="Создает JSON разметку документов с координатами элементов"
             )
 
             # Ассистент для генерации шаблонов
             self.template_assistant_id = self.assistant_manager.get_or_create_assistant(
                 name="DSL Template Generator",
                 model="gpt-4-turbo-preview",
-                prompt_path="instructions/template_generator.prompt",
-                tools=[{"type": "code_interpreter"}]
+                prompt_path="prompts/template_generator.prompt",
+                tools=[{"type": "code_interpreter"}],
+                description="Создает YAML шаблоны на основе разметки"
             )
         except Exception as e:
             logger.error(f"Ошибка при инициализации ассистентов: {e}")
             raise
 
-    def generate_markup(self, image_path: str) -> Dict[str, Any]:
-        """Генерация JSON разметки для изображения с использованием кэша"""
+    def generate_markup(self, image_path: str) -> Markup:
+        """Генерация разметки для изображения с использованием кэша"""
+        return self.markup_with_key(image_path)[1]
+
+    @metrics_operation("markup")
+    def markup_with_key(self, image_path: str) -> Tuple[str, Markup]:
+        """Компактная разметка изображения или PDF документа вместе с ее ключом в кэше"""
+        if is_pdf(image_path):
+            return self.pdf_markup_with_key(image_path)
         logger.info(f"Генерация разметки для {image_path}")
 
-        # Проверяем кэш
-        cached_markup = self.assistant_manager.get_cached_markup(image_path)
-        if cached_markup:
-            logger.info(f"Найдена кэшированная разметка для {image_path}")
-            return cached_markup
+        # Проверяем кэш по содержимому изображения
+        markup_cache = self.assistant_manager.markup_cache
+        cache_key = markup_cache.key_for_file(image_path)
+        if self.assistant_manager.cache_enabled:
+            cached_markup = markup_cache.get(cache_key)
+            # Пустая разметка (без text_items) - тоже попадание в кэш
+            if cached_markup is not None:
+                logger.info(f"Найдена кэшированная разметка для {image_path}")
+                return cache_key, cached_markup
 
-        # Если нет в кэше, генерируем новую разметку
+        # Если нет в кэше, генерируем новую разметку по уменьшенному изображению
         thread_id = self.assistant_manager.create_thread()
-        file_id = self.assistant_manager.upload_file(image_path)
+        with measure_stage("preprocess"):
+            prepared = self.preprocessor.prepare(image_path)
+        try:
+            file_id = self.assistant_manager.upload_file(prepared.path)
+        except Exception:
+            prepared.cleanup()
+            raise
 
         try:
             # Отправляем изображение на анализ
@@ -69,85 +118,386 @@ class DocumentProcessor:
             )
 
             # Запускаем обработку
-            run_id = self.assistant_manager.run_assistant(thread_id, self.markup_assistant_id)
-            self.assistant_manager.wait_for_completion(thread_id, run_id)
+            self.assistant_manager.run_and_wait(
+                thread_id, self.markup_assistant_id, IMAGE_TOKENS + MARKUP_OUTPUT_TOKENS
+            )
 
-            # Получаем и парсим результат
+            # Получаем и парсим результат; координаты возвращаются к исходному изображению
             result = self.assistant_manager.get_result(thread_id)
-            markup = json.loads(result)
+            markup = prepared.restore(json.loads(result))
 
-            # Сохраняем в кэш
-            self.assistant_manager.cache_markup(image_path, markup)
-            return markup
+            # Сохраняем в кэш; дальше разметка используется в компактном виде
+            if self.assistant_manager.cache_enabled:
+                markup_cache.put(cache_key, markup)
+            return cache_key, Markup.from_dict(markup)
 
         finally:
             self.assistant_manager.cleanup(file_id)
+            prepared.cleanup()
+
+    def pdf_markup_with_key(self, pdf_path: str) -> Tuple[str, Markup]:
+        """Разметка многостраничного PDF
+
+        Страницы рендерятся локально и размечаются параллельно, каждая со
+        своей записью в кэше по содержимому; объединенная разметка кэшируется
+        по содержимому PDF. Если в документе изменилась одна страница,
+        ассистент запускается только для нее.
+        """
+        logger.info(f"Генерация разметки для PDF {pdf_path}")
+
+        markup_cache = self.assistant_manager.markup_cache
+        cache_key = markup_cache.key_for_file(pdf_path)
+        if self.assistant_manager.cache_enabled:
+            cached_markup = markup_cache.get(cache_key)
+            # Пустая разметка (без text_items) - тоже попадание в кэш
+            if cached_markup is not None:
+                logger.info(f"Найдена кэшированная разметка для {pdf_path}")
+                return cache_key, cached_markup
+
+        with tempfile.TemporaryDirectory(prefix='pdf-pages-') as pages_dir:
+            with measure_stage("render"):
+                page_paths = render_pages(pdf_path, pages_dir, self.pdf_dpi)
+            workers = max(min(self.page_workers, len(page_paths)), 1)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                # Каждая страница выполняется в копии контекста: сохраняется приоритет запросов
+                futures = [
+                    executor.submit(contextvars.copy_context().run, self.generate_markup, path)
+                    for path in page_paths
+                ]
+                pages = [future.result() for future in futures]
 
-    def generate_template(self, markup: Dict[str, Any], query: str) -> str:
-        """Генерация YAML шаблона на основе разметки и запроса пользователя"""
+        markup = merge_pages([page.to_dict() for page in pages])
+        if self.assistant_manager.cache_enabled:
+            markup_cache.put(cache_key, markup)
+        return cache_key, Markup.from_dict(markup)
+
+    def load_document(self, image_path: str) -> DocumentIndex:
+        """Разметка документа с пространственным индексом из кэша
+
+        Индекс строится один раз и хранится в кэше рядом с разметкой.
+        """
+        cache_key, markup = self.markup_with_key(image_path)
+        if not self.assistant_manager.cache_enabled:
+            return DocumentIndex(markup)
+
+        markup_cache = self.assistant_manager.markup_cache
+        spatial = None
+        data = markup_cache.get_index(cache_key)
+        if data is not None:
+            spatial = SpatialIndex.from_dict(data, DocumentIndex.markup_boxes(markup))
+        document = DocumentIndex(markup, spatial)
+        if spatial is None:
+            markup_cache.put_index(cache_key, document.spatial.to_dict())
+        return document
+
+    def generate_template(self, markup: Union[Dict[str, Any], Markup, DocumentIndex], query: str) -> str:
+        """Генерация YAML шаблона на основе разметки и запроса пользователя
+
+        Вместо разметки можно передать ее DocumentIndex (load_document), чтобы
+        не строить индекс заново.
+        """
         logger.info(f"Генерация шаблона для запроса: {query}")
-        
-        thread_id = self.assistant_manager.create_thread()
+        document = markup if isinstance(markup, DocumentIndex) else None
+        markup = document.markup if document is not None else Markup.coerce(markup)
+
+        # Проверяем кэш шаблонов по хэшу разметки и каноническому ключу запроса
+        template_cache = self.assistant_manager.template_cache
+        key = self.query_key(query)
+        cache_key = template_cache.key(markup_hash(markup), key)
+        if self.assistant_manager.cache_enabled:
+            cached_template = template_cache.get(cache_key)
+            if cached_template is not None:
+                logger.info(f"Найден кэшированный шаблон для запроса: {query}")
+                return cached_template
+
+        # Документ того же макета уже встречался: шаблон берется из индекса макетов
+        if document is None:
+            document = DocumentIndex(markup)
+        fingerprint = self.document_layout(document)
+        reused_template = self.reuse_template(document, fingerprint, key, query)
+        if reused_template is not None:
+            template_cache.put(cache_key, reused_template)
+            return reused_template
+
+        return self.create_template(markup, query, key, cache_key, document, fingerprint)
+
+    def create_template(
+        self,
+        markup: Union[Dict[str, Any], Markup],
+        query: str,
+        key: str,
+        cache_key: str,
+        document: Optional[DocumentIndex] = None,
+        fingerprint: Optional[LayoutFingerprint] = None
+    ) -> str:
+        """Генерация шаблона ассистентом, когда кэш и индекс макетов уже проверены
 
+        Результат сохраняется в кэш шаблонов под cache_key и в индекс макетов.
+        """
         try:
-            # Отправляем разметку и запрос пользователя
-            message = (
-                f"На основе запроса пользователя '{query}' и следующей разметки создай YAML шаблон "
-                f"для извлечения нужных данных:\n\n{json.dumps(markup, indent=2, ensure_ascii=False)}"
-            )
-            self.assistant_manager.add_message(thread_id, message)
+            # Отправляем окрестность якорей запроса; если шаблон не подтвердился на всей разметке - ее целиком
+            prompt = self.pruner.prune(markup, [query], document)
+            yaml_content = self.request_template(prompt.markup, query)
+            if prompt.pruned and not self.pruner.consistent(yaml_content, prompt):
+                logger.warning(
+                    f"Шаблон для запроса '{query}' по части разметки не подтвердился, генерация по всей разметке"
+                )
+                yaml_content = self.request_template(markup, query)
 
-            # Запускаем обработку
-            run_id = self.assistant_manager.run_assistant(thread_id, self.template_assistant_id)
-            self.assistant_manager.wait_for_completion(thread_id, run_id)
+            # В кэш попадает только валидный YAML
+            if self.assistant_manager.cache_enabled:
+                self.assistant_manager.template_cache.put(cache_key, yaml_content)
+            self.remember_template(document, fingerprint, key, yaml_content)
+            return yaml_content
 
-            # Получаем результат
-            result = self.assistant_manager.get_result(thread_id)
-            
-            # Извлекаем YAML из результата
-            yaml_start = result.find('```yaml')
-            yaml_end = result.find('```', yaml_start + 7)
-            if yaml_start != -1 and yaml_end != -1:
-                yaml_content = result[yaml_start + 7:yaml_end].strip()
+        except Exception as e:
+            logger.error(f"Ошибка при генерации шаблона: {e}")
+            raise
+
+    def request_template(self, markup: Union[Dict[str, Any], Markup], query: str) -> str:
+        """Запуск ассистента шаблонов для запроса и разметки, YAML из ответа"""
+        message = (
+            f"На основе запроса пользователя '{query}' и следующей разметки создай YAML шаблон "
+            f"для извлечения нужных данных:\n\n{self.encoder.encode(markup)}"
+        )
+        return self.extract_yaml(self.run_template_assistant(message))
+
+    def generate_templates(
+        self, markup: Union[Dict[str, Any], Markup, DocumentIndex], queries: List[str]
+    ) -> Dict[str, str]:
+        """Генерация YAML шаблонов для нескольких запросов за один запуск ассистента
+
+        Разметка отправляется один раз, ассистент возвращает YAML документ,
+        где каждому запросу соответствует свой ключ. Ответ проверяется и
+        разбивается на отдельные шаблоны; запросы, для которых ассистент
+        не вернул валидный шаблон, обрабатываются по одному.
+        """
+        logger.info(f"Пакетная генерация шаблонов для запросов: {queries}")
+
+        template_cache = self.assistant_manager.template_cache
+        document = markup if isinstance(markup, DocumentIndex) else DocumentIndex(markup)
+        markup = document.markup
+        digest = markup_hash(markup)
+        keys = {query: self.query_key(query) for query in dict.fromkeys(queries)}
+        # Запросы с одним каноническим ключом генерируются один раз, по первой формулировке
+        unique: Dict[str, str] = {}
+        for query, key in keys.items():
+            unique.setdefault(key, query)
+
+        templates: Dict[str, str] = {}
+        pending: Dict[str, str] = {}
+        fingerprint = self.document_layout(document)
+        for index, (key, query) in enumerate(unique.items(), start=1):
+            cached_template = None
+            if self.assistant_manager.cache_enabled:
+                cached_template = template_cache.get(template_cache.key(digest, key))
+            if cached_template is not None:
+                logger.info(f"Найден кэшированный шаблон для запроса: {query}")
+                templates[key] = cached_template
+                continue
+            reused_template = self.reuse_template(document, fingerprint, key, query)
+            if reused_template is not None:
+                template_cache.put(template_cache.key(digest, key), reused_template)
+                templates[key] = reused_template
             else:
-                yaml_content = result
+                pending[f"field_{index}"] = query
+
+        def regenerate(query: str) -> str:
+            # Кэш и индекс макетов для запроса уже проверены выше
+            key = keys[query]
+            return self.create_template(markup, query, key, template_cache.key(digest, key), document, fingerprint)
+
+        if len(pending) == 1:
+            query = next(iter(pending.values()))
+            templates[keys[query]] = regenerate(query)
+            pending = {}
 
-            # Проверяем валидность YAML
+        if pending:
+            prompt = self.pruner.prune(markup, list(pending.values()), document)
+            fields = "\n".join(f"- {key}: '{query}'" for key, query in pending.items())
+            message = (
+                f"Создай отдельный YAML шаблон для каждого из запросов пользователя:\n{fields}\n\n"
+                f"Верни один YAML документ, где ключ верхнего уровня - идентификатор запроса "
+                f"(например, {next(iter(pending))}), а значение - полный самостоятельный шаблон "
+                f"со своими intersection_metric и extraction_area. "
+                f"Разметка документа:\n\n{self.encoder.encode(prompt.markup)}"
+            )
             try:
-                yaml.safe_load(yaml_content)
-            except yaml.YAMLError as e:
-                logger.error(f"Сгенерированный YAML невалиден: {e}")
+                reply = self.run_template_assistant(message, len(pending))
+            except Exception as e:
+                logger.error(f"Ошибка при пакетной генерации шаблонов: {e}")
                 raise
+            try:
+                result = yaml.safe_load(self.extract_yaml(reply))
+            except yaml.YAMLError:
+                # Невалидный общий ответ: каждый запрос генерируется отдельно
+                logger.warning("Пакетный ответ ассистента не разобран, шаблоны генерируются по одному")
+                result = {}
+            if not isinstance(result, dict):
+                result = {}
 
-            return yaml_content
+            for field, query in pending.items():
+                key = keys[query]
+                template = result.get(field)
+                if not isinstance(template, dict):
+                    logger.warning(f"Ассистент не вернул шаблон для запроса '{query}', повторная генерация")
+                    templates[key] = regenerate(query)
+                    continue
+                yaml_content = yaml.safe_dump(template, allow_unicode=True, sort_keys=False)
+                if prompt.pruned and not self.pruner.consistent(yaml_content, prompt):
+                    logger.warning(f"Шаблон для запроса '{query}' по части разметки не подтвердился, повторная генерация")
+                    templates[key] = regenerate(query)
+                    continue
+                if self.assistant_manager.cache_enabled:
+                    template_cache.put(template_cache.key(digest, key), yaml_content)
+                self.remember_template(document, fingerprint, key, yaml_content)
+                templates[key] = yaml_content
 
+        return {query: templates[key] for query, key in keys.items()}
+
+    def query_key(self, query: str, count: bool = True) -> str:
+        """Канонический ключ запроса в кэшах шаблонов; без кэша или индекса запросов - сам запрос"""
+        query_index = self.assistant_manager.query_index
+        if not (self.assistant_manager.cache_enabled and query_index.enabled):
+            return query
+        return query_index.key(query, count)
+
+    def document_layout(self, document: DocumentIndex) -> Optional[LayoutFingerprint]:
+        """Отпечаток макета документа, если индекс макетов включен"""
+        layout_index = self.assistant_manager.layout_index
+        if not (self.assistant_manager.cache_enabled and layout_index.enabled):
+            return None
+        return layout_fingerprint(document)
+
+    def reuse_template(
+        self, document: DocumentIndex, fingerprint: Optional[LayoutFingerprint], key: str, query: str
+    ) -> Optional[str]:
+        """Шаблон документа того же макета, если он находит в этом документе значение того же вида"""
+        if fingerprint is None:
+            return None
+        layout_index = self.assistant_manager.layout_index
+        found = layout_index.lookup(fingerprint, key)
+        if found is None:
+            return None
+        layout_id, template = found
+        try:
+            value = TemplateEngine(template).apply(document)["value"]
         except Exception as e:
-            logger.error(f"Ошибка при генерации шаблона: {e}")
+            logger.warning(f"Не удалось применить шаблон макета {layout_id}: {e}")
+            value = None
+        if value is None or not value_matches(query, value):
+            layout_index.reject(layout_id, key)
+            return None
+        return template
+
+    def remember_template(
+        self, document: Optional[DocumentIndex], fingerprint: Optional[LayoutFingerprint], key: str, template: str
+    ) -> None:
+        """Сохранение шаблона в индекс макетов, если он нашел значение в документе"""
+        if fingerprint is None:
+            return
+        try:
+            value = TemplateEngine(template).apply(document)["value"]
+        except Exception as e:
+            logger.warning(f"Шаблон для запроса {key} не сохранен в индекс макетов: {e}")
+            return
+        if value is not None:
+            self.assistant_manager.layout_index.add(fingerprint, key, template)
+
+    @metrics_operation("template")
+    def run_template_assistant(self, message: str, queries: int = 1) -> str:
+        """Запуск ассистента шаблонов в новом треде и получение ответа"""
+        thread_id = self.assistant_manager.create_thread()
+        self.assistant_manager.add_message(thread_id, message)
+
+        # Запускаем обработку; расход токенов оценивается по размеру разметки в сообщении
+        tokens = estimate_tokens(message) + TEMPLATE_OUTPUT_TOKENS * queries
+        self.assistant_manager.run_and_wait(thread_id, self.template_assistant_id, tokens)
+
+        # Получаем результат
+        return self.assistant_manager.get_result(thread_id)
+
+    @staticmethod
+    def extract_yaml(result: str) -> str:
+        """Извлечение YAML из ответа ассистента с проверкой валидности"""
+        yaml_start = result.find('```yaml')
+        yaml_end = result.find('```', yaml_start + 7)
+        if yaml_start != -1 and yaml_end != -1:
+            yaml_content = result[yaml_start + 7:yaml_end].strip()
+        else:
+            yaml_content = result
+
+        try:
+            yaml.safe_load(yaml_content)
+        except yaml.YAMLError as e:
+            logger.error(f"Сгенерированный YAML невалиден: {e}")
             raise
 
-    def process_document(self, image_path: str, query: str, output_dir: Optional[str] = None) -> Dict[str, str]:
-        """Полный процесс обработки документа"""
+        return yaml_content
+
+    def extract_data(
+        self,
+        markup: Union[Dict[str, Any], Markup, DocumentIndex],
+        templates: Dict[str, str]
+    ) -> Dict[str, Dict[str, Any]]:
+        """Локальное применение шаблонов к разметке без обращения к API"""
+        document = markup if isinstance(markup, DocumentIndex) else DocumentIndex(markup)
+        return {
+            query: TemplateEngine(template).apply(document)
+            for query, template in templates.items()
+        }
+
+    @staticmethod
+    def template_file_name(query: str) -> str:
+        """Имя файла шаблона на основе запроса или его канонического ключа"""
+        return query.lower().replace(" ", "_").replace('"', '').replace("'", "")
+
+    def save_markup(self, image_path: str, markup: Union[Dict[str, Any], Markup], output_dir: Path) -> Path:
+        """Сохранение разметки в директорию результатов"""
+        markup_path = output_dir / f"{Path(image_path).stem}.json"
+        if isinstance(markup, Markup):
+            markup = markup.to_dict()
+        with open(markup_path, 'w', encoding='utf-8') as f:
+            json.dump(markup, f, ensure_ascii=False, indent=2)
+        logger.info(f"Разметка сохранена в {markup_path}")
+        return markup_path
+
+    def save_template(self, query: str, template: str, output_dir: Path) -> Path:
+        """Сохранение шаблона в директорию результатов"""
+        # Перефразированные запросы сохраняются в один файл по каноническому ключу
+        template_path = output_dir / f"{self.template_file_name(self.query_key(query, count=False))}.yml"
+        with open(template_path, 'w', encoding='utf-8') as f:
+            f.write(template)
+        logger.info(f"Шаблон сохранен в {template_path}")
+        return template_path
+
+    @metrics_operation("process")
+    @timed_stage("total")
+    def process_document(
+        self,
+        image_path: str,
+        query: str,
+        output_dir: Optional[str] = None,
+        document: Optional[DocumentIndex] = None
+    ) -> Dict[str, str]:
+        """Полный процесс обработки документа
+
+        document - уже загруженный DocumentIndex этого документа (load_document),
+        чтобы вызывающий код мог применить к нему шаблоны без повторной разметки.
+        """
         try:
             # Определяем директорию для сохранения результатов
             output_dir = Path(output_dir) if output_dir else Path(image_path).parent
             output_dir.mkdir(parents=True, exist_ok=True)
 
-            # Генерация разметки
-            markup = self.generate_markup(image_path)
-            markup_path = output_dir / f"{Path(image_path).stem}.json"
-            with open(markup_path, 'w', encoding='utf-8') as f:
-                json.dump(markup, f, ensure_ascii=False, indent=2)
-            logger.info(f"Разметка сохранена в {markup_path}")
+            # Генерация разметки; индекс документа строится один раз и нужен шаблонам
+            if document is None:
+                document = self.load_document(image_path)
+            markup_path = self.save_markup(image_path, document.markup, output_dir)
 
             # Генерация шаблона
-            template = self.generate_template(markup, query)
-            
-            # Формируем имя файла на основе запроса
-            template_name = query.lower().replace(" ", "_").replace('"', '').replace("'", "")
-            template_path = output_dir / f"{template_name}.yml"
-            with open(template_path, 'w', encoding='utf-8') as f:
-                f.write(template)
-            logger.info(f"Шаблон сохранен в {template_path}")
+            template = self.generate_template(document, query)
+            template_path = self.save_template(query, template, output_dir)
 
             return {
                 "markup_path": str(markup_path),
@@ -158,26 +508,90 @@ class DocumentProcessor:
             logger.error(f"Ошибка при обработке документа: {e}")
             raise
 
+    @metrics_operation("process")
+    @timed_stage("total")
+    def process_documents(
+        self,
+        image_path: str,
+        queries: List[str],
+        output_dir: Optional[str] = None,
+        document: Optional[DocumentIndex] = None
+    ) -> Dict[str, Any]:
+        """Обработка документа для нескольких запросов за один запуск генерации шаблонов
+
+        document - как в process_document.
+        """
+        try:
+            output_dir = Path(output_dir) if output_dir else Path(image_path).parent
+            output_dir.mkdir(parents=True, exist_ok=True)
+
+            if document is None:
+                document = self.load_document(image_path)
+            markup_path = self.save_markup(image_path, document.markup, output_dir)
+
+            templates = self.generate_templates(document, queries)
+            template_paths = {
+                query: str(self.save_template(query, template, output_dir))
+                for query, template in templates.items()
+            }
+
+            return {
+                "markup_path": str(markup_path),
+                "template_paths": template_paths
+            }
+
+        except Exception as e:
+            logger.error(f"Ошибка при обработке документа: {e}")
+            raise
+
 def main():
     import argparse
     
     parser = argparse.ArgumentParser(description='Обработка документов и генерация DSL шаблонов')
-    parser.add_argument('image_path', help='Путь к изображению документа')
-    parser.add_argument('query', help='Запрос пользователя (например, "найди ИНН")')
+    parser.add_argument('image_path', help='Путь к изображению или PDF документу')
+    parser.add_argument('query', nargs='?', help='Запрос пользователя (например, "найди ИНН")')
+    parser.add_argument('--queries', nargs='+', default=[],
+                        help='Несколько запросов, обрабатываемых одним запуском ассистента шаблонов')
     parser.add_argument('--output-dir', help='Директория для сохранения результатов', default=None)
+    parser.add_argument('--extract', action='store_true',
+                        help='Применить шаблоны к разметке локально и вывести найденные значения')
+    parser.add_argument('--metrics-json', default=None,
+                        help='Сохранить метрики этапов, запусков и кэшей в JSON файл')
     
     args = parser.parse_args()
+    queries = ([args.query] if args.query else []) + args.queries
+    if not queries:
+        parser.error('Укажите запрос или --queries')
 
     try:
         processor = DocumentProcessor()
-        result = processor.process_document(args.image_path, args.query, args.output_dir)
+        # Документ загружается один раз: без кэша повторная загрузка снова запустила бы разметку
+        document = processor.load_document(args.image_path)
+        if len(queries) == 1:
+            result = processor.process_document(args.image_path, queries[0], args.output_dir, document)
+            template_paths = {queries[0]: result['template_path']}
+        else:
+            result = processor.process_documents(args.image_path, queries, args.output_dir, document)
+            template_paths = result['template_paths']
         print(f"Обработка завершена успешно:")
         print(f"Разметка: {result['markup_path']}")
-        print(f"Шаблон: {result['template_path']}")
+        for query, template_path in template_paths.items():
+            print(f"Шаблон ({query}): {template_path}")
+
+        if args.extract:
+            templates = {}
+            for query, template_path in template_paths.items():
+                with open(template_path, 'r', encoding='utf-8') as f:
+                    templates[query] = f.read()
+            for query, extracted in processor.extract_data(document, templates).items():
+                print(f"Значение ({query}): {extracted['value']}")
     except Exception as e:
         logger.error(f"Ошибка: {e}")
         import sys
         sys.exit(1)
+    finally:
+        if args.metrics_json:
+            shared_metrics().write_json(args.metrics_json)
 
 if __name__ == '__main__':
     main()
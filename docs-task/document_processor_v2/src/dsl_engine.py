@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+Локальное применение YAML DSL шаблонов к разметке документа.
+
+Шаблон применяется к text_items разметки, полученной generate_markup, без
+обращения к API. Поддерживаемые конструкции:
+
+- ChainAttribute: атрибуты перебираются по возрастанию priority,
+  результатом становится первый найденный
+- AnchorsBasedAttribute: якоря перебираются по порядку; якорь находится по
+  тексту с порогом text_threshold (нечеткий поиск, см. text_index),
+  repetition_index выбирает вхождение в порядке чтения, multiline
+  разрешает якорю занимать две строки
+- extraction_area: смещения в высотах якоря от его сторон; relation задает,
+  с какой стороны от якоря находится значение (main - вокруг самого якоря)
+- intersection_metric: Overlap (доля площади элемента внутри области), IoU
+  и метрики, зарегистрированные в intersection.register_metric
+- ${...}: ссылки на узлы шаблона
+- postprocessing_pipe: RegExpPostprocessor
+
+Страницы многостраничного документа (text_items с полем page) в индексе
+располагаются одна под другой, так что области и порядок чтения не
+смешивают страницы; значение ищется на странице якоря, а bbox результата
+возвращается в координатах страницы вместе с ее номером.
+"""
+
+import re
+import sys
+import json
+import logging
+from typing import Dict, Any, List, Optional, Tuple, Union, Callable
+
+import numpy as np
+import yaml
+
+from .intersection import Metric, as_boxes, get_metric
+from .markup import Markup
+from .spatial_index import Box, SpatialIndex
+from .text_index import AnchorIndex
+
+logger = logging.getLogger(__name__)
+
+REFERENCE_PATTERN = re.compile(r'\$\{([^}]+)\}')
+
+
+def resolve_references(node: Any, root: Dict[str, Any], depth: int = 0) -> Any:
+    """Подстановка ссылок ${path.to.node} значениями из корня шаблона"""
+    if depth > 32:
+        raise ValueError("Слишком глубокая вложенность ссылок в шаблоне")
+    if isinstance(node, dict):
+        return {key: resolve_references(value, root, depth) for key, value in node.items()}
+    if isinstance(node, list):
+        return [resolve_references(value, root, depth) for value in node]
+    if isinstance(node, str):
+        match = REFERENCE_PATTERN.fullmatch(node.strip())
+        if match:
+            value: Any = root
+            for part in match.group(1).strip().split('.'):
+                if not isinstance(value, dict) or part not in value:
+                    raise ValueError(f"Не найдена ссылка в шаблоне: {node}")
+                value = value[part]
+            return resolve_references(value, root, depth + 1)
+    return node
+
+
+def union_box(a: Box, b: Box) -> Box:
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+
+def extraction_box(anchor: Box, relation: str, area: Dict[str, float]) -> Box:
+    """Область извлечения относительно якоря; смещения заданы в высотах якоря"""
+    x1, y1, x2, y2 = anchor
+    unit = max(y2 - y1, 1.0)
+    dx1 = float(area.get("delta_x1", 0)) * unit
+    dy1 = float(area.get("delta_y1", 0)) * unit
+    dx2 = float(area.get("delta_x2", 0)) * unit
+    dy2 = float(area.get("delta_y2", 0)) * unit
+
+    if relation == "right":
+        return (x2 + dx1, y1 + dy1, x2 + dx2, y2 + dy2)
+    if relation == "left":
+        return (x1 - dx2, y1 + dy1, x1 - dx1, y2 + dy2)
+    if relation == "bottom":
+        return (x1 + dx1, y2 + dy1, x2 + dx2, y2 + dy2)
+    if relation == "top":
+        return (x1 + dx1, y1 - dy2, x2 + dx2, y1 - dy1)
+    if relation != "main":
+        raise ValueError(f"Неизвестный тип отношения якоря: {relation}")
+    return (x1 + dx1, y1 + dy1, x2 + dx2, y2 + dy2)
+
+
+def regexp_postprocessor(value: str, params: Dict[str, Any]) -> Optional[str]:
+    """Выделение значения регулярным выражением"""
+    # Выражения вида "[0-9]{10}(?=[^0-9])" ожидают разделитель после значения
+    match = re.search(params["regexp_value"], value + "\n")
+    if not match:
+        return None
+    return (match.group(1) if match.groups() else match.group(0)).strip()
+
+
+POSTPROCESSORS: Dict[str, Callable[[str, Dict[str, Any]], Optional[str]]] = {
+    "RegExpPostprocessor": regexp_postprocessor,
+}
+
+
+class DocumentIndex:
+    """Разметка документа, подготовленная для применения шаблонов
+
+    Один индекс переиспользуется для всех шаблонов, применяемых к документу.
+    """
+
+    def __init__(self, markup: Union[Dict[str, Any], Markup], spatial: Optional[SpatialIndex] = None):
+        self.markup = Markup.coerce(markup)
+        self.paged = self.markup.paged
+        self.pages: List[int] = self.markup.pages()
+        self.offsets: Dict[int, float] = self.page_offsets(self.markup)
+        # Координаты в пространстве документа: страницы одна под другой
+        self.boxes: List[Box] = self.markup_boxes(self.markup)
+        self.texts: List[str] = self.markup.texts()
+        self.confidences: List[float] = self.markup.confidence.tolist()
+        # Порядок чтения: сверху вниз, слева направо
+        self.reading_order: List[int] = sorted(
+            range(len(self.boxes)), key=lambda i: (self.boxes[i][1], self.boxes[i][0])
+        )
+        self.rank: List[int] = [0] * len(self.boxes)
+        for position, index in enumerate(self.reading_order):
+            self.rank[index] = position
+        self.box_array = as_boxes(self.boxes)
+        self.spatial = spatial or SpatialIndex(self.boxes)
+        self._anchors: Optional[AnchorIndex] = None
+
+    @staticmethod
+    def page_offsets(markup: Union[Dict[str, Any], Markup]) -> Dict[int, float]:
+        """Вертикальное смещение каждой страницы в пространстве документа
+
+        Высота страницы берется из pages, а если она неизвестна - по
+        нижнему краю ее элементов.
+        """
+        markup = Markup.coerce(markup)
+        heights: Dict[int, float] = {}
+        for page, y2 in zip(markup.pages(), markup.y2):
+            heights[page] = max(heights.get(page, 0.0), y2)
+        for info in markup.meta.get("pages") or []:
+            if info.get("height"):
+                page = int(info["page"])
+                heights[page] = max(heights.get(page, 0.0), float(info["height"]))
+
+        offsets: Dict[int, float] = {}
+        offset = 0.0
+        for page in sorted(heights):
+            offsets[page] = offset
+            offset += heights[page]
+        return offsets
+
+    @staticmethod
+    def markup_boxes(markup: Union[Dict[str, Any], Markup]) -> List[Box]:
+        """Координаты text_items разметки в пространстве документа"""
+        markup = Markup.coerce(markup)
+        offsets = DocumentIndex.page_offsets(markup)
+        if not any(offsets.values()):
+            return markup.boxes()
+        return [
+            (x1, y1 + offsets[page], x2, y2 + offsets[page])
+            for (x1, y1, x2, y2), page in zip(markup.boxes(), markup.pages())
+        ]
+
+    def page_bbox(self, box: Box, page: int) -> Dict[str, Any]:
+        """bbox в координатах страницы; номер страницы - для многостраничных документов"""
+        offset = self.offsets.get(page, 0.0)
+        bbox: Dict[str, Any] = {"x1": box[0], "y1": box[1] - offset, "x2": box[2], "y2": box[3] - offset}
+        if self.paged:
+            bbox["page"] = page
+        return bbox
+
+    def below(self, index: int) -> Optional[int]:
+        """Ближайший элемент под заданным, перекрывающийся с ним по горизонтали"""
+        return self.spatial.nearest(index, "bottom")
+
+    @property
+    def anchors(self) -> AnchorIndex:
+        """Нечеткий индекс текста, строится при первом поиске якоря"""
+        if self._anchors is None:
+            self._anchors = AnchorIndex(self.texts, self.below)
+        return self._anchors
+
+    def find_anchor(self, text: str, threshold: float, multiline: bool = False) -> List[Tuple[List[int], float, Box]]:
+        """Вхождения якоря в порядке чтения: (элементы, сходство, bbox)"""
+        matches = []
+        for indices, score in self.anchors.search(text, threshold, multiline):
+            box = self.boxes[indices[0]]
+            for index in indices[1:]:
+                box = union_box(box, self.boxes[index])
+            matches.append((indices, score, box))
+        return sorted(matches, key=lambda match: self.rank[match[0][0]])
+
+    def items_in_area(self, area: Box, metric: Metric, threshold: float) -> List[int]:
+        """Элементы, пересекающиеся с областью не меньше порога, в порядке чтения
+
+        Метрика считается векторно только для элементов, которые
+        пространственный индекс вернул как пересекающиеся с областью.
+        """
+        candidates = self.spatial.query(area)
+        if not candidates:
+            return []
+        scores = metric(self.box_array[candidates], as_boxes(area))[0]
+        selected = [index for index, score in zip(candidates, scores) if score >= threshold]
+        return sorted(selected, key=lambda i: self.rank[i])
+
+    def items_in_areas(self, areas: List[Box], metric: Metric, threshold: float) -> List[List[int]]:
+        """Элементы для нескольких областей за один векторный расчет
+
+        Кандидаты всех областей объединяются, и метрика считается одной
+        матрицей (области x кандидаты) вместо отдельного вызова на область.
+        """
+        if not areas or not self.boxes:
+            return [[] for _ in areas]
+        candidates = sorted(set().union(*(self.spatial.query(area) for area in areas)))
+        if not candidates:
+            return [[] for _ in areas]
+        columns = np.asarray(candidates)
+        scores = metric(self.box_array[columns], as_boxes(areas))
+        return [
+            sorted(columns[row >= threshold].tolist(), key=lambda i: self.rank[i])
+            for row in scores
+        ]
+
+
+class TemplateEngine:
+    """Применение YAML DSL шаблона к разметке документа"""
+
+    def __init__(self, template: Union[str, Dict[str, Any]]):
+        if isinstance(template, str):
+            template = yaml.safe_load(template)
+        if not isinstance(template, dict):
+            raise ValueError("Шаблон должен быть YAML словарем")
+        self.template = resolve_references(template, template)
+
+    def apply(self, document: Union[Dict[str, Any], DocumentIndex]) -> Dict[str, Any]:
+        """Извлечение значения; формат результата совпадает с data_extractor"""
+        index = document if isinstance(document, DocumentIndex) else DocumentIndex(document)
+        params = self.template.get("params") or {}
+
+        attributes = params.get("attributes")
+        if attributes is None:
+            attributes = [self.template]
+        attributes = sorted(attributes, key=lambda attribute: attribute.get("priority", 0))
+
+        for attribute in attributes:
+            if attribute.get("type", "AnchorsBasedAttribute") != "AnchorsBasedAttribute":
+                logger.warning(f"Неподдерживаемый тип атрибута: {attribute.get('type')}")
+                continue
+            result = self.apply_attribute(index, attribute, params.get("postprocessing_pipe") or [])
+            if result is not None:
+                return result
+
+        return {
+            "value": None,
+            "raw_text": None,
+            "bbox": None,
+            "confidence": 0.0,
+            "anchors_used": [],
+            "processing_steps": [],
+        }
+
+    def apply_attribute(
+        self,
+        index: DocumentIndex,
+        attribute: Dict[str, Any],
+        template_pipe: List[Dict[str, Any]]
+    ) -> Optional[Dict[str, Any]]:
+        """Применение AnchorsBasedAttribute: первый якорь, давший значение"""
+        params = attribute.get("params") or {}
+        pipe = (params.get("postprocessing_pipe") or []) + template_pipe
+
+        for anchor in params.get("anchors") or []:
+            metric_config = anchor.get("intersection_metric") or self.template.get("intersection_metric") or {}
+            area_config = anchor.get("extraction_area") or self.template.get("extraction_area") or {}
+            metric = get_metric(metric_config.get("name", "Overlap"))
+            metric_threshold = float(metric_config.get("threshold", 0.5))
+            relation = anchor.get("relation", "main")
+
+            matches = index.find_anchor(
+                str(anchor["text"]),
+                float(anchor.get("text_threshold", 0.8)),
+                bool(anchor.get("multiline", False))
+            )
+            repetition = int(anchor.get("repetition_index", 0))
+            if repetition >= len(matches):
+                continue
+            anchor_items, anchor_score, anchor_box = matches[repetition]
+
+            area = extraction_box(anchor_box, relation, area_config)
+            page = index.pages[anchor_items[0]]
+            selected = [
+                item for item in index.items_in_area(area, metric, metric_threshold)
+                if item not in anchor_items and index.pages[item] == page
+            ]
+            if not selected and relation == "main":
+                # Значение часто распознается в одном элементе с текстом якоря
+                selected = anchor_items
+
+            if not selected:
+                continue
+
+            raw_text = ' '.join(index.texts[item] for item in selected)
+            value, steps = self.postprocess(raw_text, pipe)
+            if value is None:
+                continue
+
+            box = index.boxes[selected[0]]
+            for item in selected[1:]:
+                box = union_box(box, index.boxes[item])
+            confidence = sum(index.confidences[item] for item in selected) / len(selected) / 100.0
+
+            return {
+                "value": value,
+                "raw_text": raw_text,
+                "bbox": index.page_bbox(box, page),
+                "confidence": round(confidence * anchor_score, 4),
+                "anchors_used": [
+                    {
+                        "text": ' '.join(index.texts[item] for item in anchor_items),
+                        "bbox": index.page_bbox(anchor_box, page)
+                    }
+                ],
+                "processing_steps": steps,
+            }
+        return None
+
+    @staticmethod
+    def postprocess(value: str, pipe: List[Dict[str, Any]]) -> Tuple[Optional[str], List[str]]:
+        """Последовательное применение постобработки"""
+        steps = []
+        for step in pipe:
+            name = step.get("instance_name")
+            postprocessor = POSTPROCESSORS.get(name)
+            if postprocessor is None:
+                logger.warning(f"Неизвестная постобработка: {name}")
+                continue
+            step_params = step.get("params") or {}
+            value = postprocessor(value, step_params)
+            steps.append(f"{name}: {step_params}")
+            if value is None:
+                return None, steps
+        return value, steps
+
+
+def apply_template(template: Union[str, Dict[str, Any]], markup: Union[Dict[str, Any], DocumentIndex]) -> Dict[str, Any]:
+    """Применение шаблона к разметке"""
+    return TemplateEngine(template).apply(markup)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Извлечение данных из разметки по DSL шаблону')
+    parser.add_argument('template_path', help='Путь к YAML шаблону')
+    parser.add_argument('markup_path', help='Путь к JSON разметке документа')
+
+    args = parser.parse_args()
+
+    try:
+        with open(args.template_path, 'r', encoding='utf-8') as f:
+            template = f.read()
+        with open(args.markup_path, 'r', encoding='utf-8') as f:
+            markup = json.load(f)
+        result = apply_template(template, markup)
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        if result["value"] is None:
+            sys.exit(2)
+    except (OSError, ValueError, yaml.YAMLError) as e:
+        logger.error(f"Ошибка: {e}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+"""
+Реестр файлов, загруженных в OpenAI, с дедупликацией по содержимому.
+
+Повторная загрузка тех же байтов (например, анализ скана с другим
+запросом) заменяется поиском file_id по SHA-256. На каждый file_id
+ведется счетчик использований; cleanup только освобождает ссылку, а
+удаляет файлы фоновый сборщик (FileCollector):
+
+- файлы без ссылок, загруженные раньше, чем TTL назад
+- файлы, ссылки на которые не освобождались дольше stale_after
+  (процесс упал, не вызвав cleanup)
+- дубликаты, загруженные параллельно с одинаковым содержимым
+- файлы с префиксом реестра, которых нет в реестре: процесс упал
+  между загрузкой и записью в реестр
+
+Префикс имени загружаемого файла включает идентификатор реестра (хранится
+рядом с ним в файле .id), поэтому сборщик не трогает файлы реестров других
+приложений с тем же ключом API.
+"""
+
+import os
+import json
+import time
+import uuid
+import hashlib
+import asyncio
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Iterable, Iterator, Tuple, Union, BinaryIO
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка между процессами недоступна
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Общий префикс имен загружаемых файлов; за ним следует идентификатор реестра
+FILE_PREFIX = "dp-"
+
+# Срок повторного использования файла по умолчанию: сутки
+DEFAULT_FILE_TTL = 24 * 3600
+# Через сколько секунд неосвобожденная ссылка считается брошенной
+DEFAULT_STALE_AFTER = 3600
+
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class FileTooLargeError(ValueError):
+    """Размер файла превышает допустимый"""
+
+
+def hash_stream(source: BinaryIO, sink: Optional[BinaryIO] = None,
+                max_bytes: Optional[int] = None) -> Tuple[str, int]:
+    """SHA-256 и размер потока за один проход; при sink данные копируются в него"""
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+        size += len(chunk)
+        if max_bytes is not None and size > max_bytes:
+            raise FileTooLargeError(f"Размер файла превышает {max_bytes} байт")
+        digest.update(chunk)
+        if sink is not None:
+            sink.write(chunk)
+    return digest.hexdigest(), size
+
+
+def file_digest(path: Union[str, Path]) -> str:
+    """SHA-256 содержимого файла"""
+    with open(path, 'rb') as f:
+        return hash_stream(f)[0]
+
+
+def upload_name(digest: str, path: Union[str, Path], prefix: str = FILE_PREFIX) -> str:
+    """Имя файла при загрузке: префикс реестра, начало хэша и исходное расширение"""
+    return f"{prefix}{digest[:16]}{Path(path).suffix.lower()}"
+
+
+class FileRegistry:
+    """Персистентный реестр загруженных файлов, общий для нескольких процессов"""
+
+    def __init__(self, path: Union[str, Path], ttl: float = DEFAULT_FILE_TTL,
+                 stale_after: float = DEFAULT_STALE_AFTER):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock_path = self.path.with_suffix(self.path.suffix + '.lock')
+        self.ttl = ttl
+        self.stale_after = stale_after
+        # Сборщик считает брошенными только файлы с префиксом своего реестра
+        self.prefix = f"{FILE_PREFIX}{self._registry_id()}-"
+
+    def _registry_id(self) -> str:
+        """Идентификатор реестра; создается один раз и общий для всех его процессов"""
+        id_path = self.path.with_suffix(self.path.suffix + '.id')
+        if id_path.exists():
+            return id_path.read_text(encoding='utf-8').strip()
+        fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, prefix='.files-id-')
+        try:
+            registry_id = uuid.uuid4().hex[:8]
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(registry_id)
+            # Ссылка создается атомарно: при гонке побеждает первый процесс
+            os.link(tmp_path, id_path)
+            return registry_id
+        except FileExistsError:
+            return id_path.read_text(encoding='utf-8').strip()
+        finally:
+            os.unlink(tmp_path)
+
+    @contextmanager
+    def _locked(self) -> Iterator[Dict[str, Dict[str, Any]]]:
+        """Чтение и запись реестра под эксклюзивной блокировкой между процессами"""
+        if fcntl is None:
+            entries = self._read()
+            yield entries
+            self._write(entries)
+            return
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                entries = self._read()
+                yield entries
+                self._write(entries)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self) -> Dict[str, Dict[str, Any]]:
+        if not self.path.exists():
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Не удалось прочитать реестр файлов {self.path}: {e}")
+            return {}
+
+    def _write(self, entries: Dict[str, Dict[str, Any]]) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, prefix='.files-')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(entries, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def _reusable(self, entry: Dict[str, Any], now: float) -> bool:
+        return not entry.get("deleting") and now - entry["uploaded_at"] < self.ttl
+
+    def acquire(self, digest: str) -> Optional[str]:
+        """file_id ранее загруженного файла с тем же содержимым (ссылка +1) или None"""
+        now = time.time()
+        with self._locked() as entries:
+            for file_id, entry in entries.items():
+                if entry["sha256"] == digest and self._reusable(entry, now):
+                    entry["refs"] += 1
+                    entry["last_used"] = now
+                    return file_id
+        return None
+
+    def register(self, digest: str, file_id: str, size: int) -> str:
+        """Запись загруженного файла; возвращает file_id, который нужно использовать
+
+        Если тот же файл параллельно загрузил другой процесс, используется
+        его file_id, а только что загруженный дубликат передается сборщику.
+        """
+        now = time.time()
+        with self._locked() as entries:
+            for existing_id, entry in entries.items():
+                if existing_id != file_id and entry["sha256"] == digest and self._reusable(entry, now):
+                    entry["refs"] += 1
+                    entry["last_used"] = now
+                    entries[file_id] = {"sha256": digest, "bytes": size, "refs": 0,
+                                        "uploaded_at": now, "last_used": now, "deleting": True}
+                    return existing_id
+            entries[file_id] = {"sha256": digest, "bytes": size, "refs": 1,
+                                "uploaded_at": now, "last_used": now}
+        return file_id
+
+    def release(self, file_id: str) -> None:
+        """Освобождение ссылки на файл"""
+        with self._locked() as entries:
+            entry = entries.get(file_id)
+            if entry is not None:
+                entry["refs"] = max(entry["refs"] - 1, 0)
+                entry["last_used"] = time.time()
+
+    def collect(self) -> List[str]:
+        """Файлы к удалению; помечаются, чтобы больше не выдаваться"""
+        now = time.time()
+        garbage = []
+        with self._locked() as entries:
+            for file_id, entry in entries.items():
+                expired = now - entry["uploaded_at"] >= self.ttl
+                idle = now - entry["last_used"] >= self.stale_after
+                if entry.get("deleting") or (expired and (entry["refs"] == 0 or idle)):
+                    entry["deleting"] = True
+                    garbage.append(file_id)
+        return garbage
+
+    def forget(self, file_ids: Iterable[str]) -> None:
+        """Удаление записей о файлах, удаленных в OpenAI"""
+        file_ids = set(file_ids)
+        if not file_ids:
+            return
+        with self._locked() as entries:
+            for file_id in file_ids:
+                entries.pop(file_id, None)
+
+    def known(self) -> set:
+        return set(self._read())
+
+    def stats(self) -> Dict[str, int]:
+        entries = self._read()
+        return {
+            "files": len(entries),
+            "bytes": sum(entry["bytes"] for entry in entries.values()),
+            "in_use": sum(1 for entry in entries.values() if entry["refs"] > 0),
+            "deleting": sum(1 for entry in entries.values() if entry.get("deleting")),
+        }
+
+
+def _orphans(files: Iterable[Any], known: set, grace: float, prefix: str) -> List[str]:
+    """Файлы реестра в OpenAI, отсутствующие в нем дольше grace секунд"""
+    cutoff = time.time() - grace
+    return [
+        file.id for file in files
+        if (file.filename or '').startswith(prefix) and file.id not in known and file.created_at < cutoff
+    ]
+
+
+def _is_missing(error: Exception) -> bool:
+    return getattr(error, "status_code", None) == 404
+
+
+class FileCollector:
+    """Фоновое удаление файлов реестра через синхронный клиент OpenAI"""
+
+    def __init__(self, registry: FileRegistry, client: Any, batch_workers: int = 8):
+        self.registry = registry
+        self.client = client
+        self.batch_workers = batch_workers
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _delete(self, file_id: str) -> Tuple[str, bool]:
+        try:
+            self.client.files.delete(file_id)
+            return file_id, True
+        except Exception as e:
+            if _is_missing(e):
+                return file_id, True
+            logger.warning(f"Ошибка при удалении файла {file_id}: {e}")
+            return file_id, False
+
+    def sweep(self, orphans: bool = True) -> int:
+        """Один проход сборщика; возвращает число удаленных файлов"""
+        garbage = self.registry.collect()
+        if orphans:
+            try:
+                files = self.client.files.list(purpose='assistants')
+                garbage += _orphans(files, self.registry.known(), self.registry.stale_after, self.registry.prefix)
+            except Exception as e:
+                logger.warning(f"Не удалось получить список файлов для поиска брошенных: {e}")
+        if not garbage:
+            return 0
+        with ThreadPoolExecutor(max_workers=self.batch_workers) as executor:
+            deleted = [file_id for file_id, ok in executor.map(self._delete, garbage) if ok]
+        self.registry.forget(deleted)
+        logger.info(f"Сборщик файлов: удалено {len(deleted)} из {len(garbage)}")
+        return len(deleted)
+
+    def start(self, interval: float) -> None:
+        """Периодический запуск sweep в фоновом потоке"""
+        if self._thread is not None:
+            return
+
+        def loop() -> None:
+            while not self._stop.wait(interval):
+                try:
+                    self.sweep()
+                except Exception as e:
+                    logger.warning(f"Ошибка сборщика файлов: {e}")
+
+        self._thread = threading.Thread(target=loop, name="file-collector", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+class AsyncFileCollector:
+    """Фоновое удаление файлов реестра через AsyncOpenAI"""
+
+    def __init__(self, registry: FileRegistry, client: Any, batch_workers: int = 8):
+        self.registry = registry
+        self.client = client
+        self.batch_workers = batch_workers
+        self._task: Optional[asyncio.Task] = None
+
+    async def _delete(self, semaphore: asyncio.Semaphore, file_id: str) -> Optional[str]:
+        async with semaphore:
+            try:
+                await self.client.files.delete(file_id)
+                return file_id
+            except Exception as e:
+                if _is_missing(e):
+                    return file_id
+                logger.warning(f"Ошибка при удалении файла {file_id}: {e}")
+                return None
+
+    async def sweep(self, orphans: bool = True) -> int:
+        """Один проход сборщика; возвращает число удаленных файлов
+
+        Реестр читается под блокировкой между процессами, поэтому обращения к
+        нему выполняются в пуле потоков, а не в event loop.
+        """
+        garbage = await asyncio.to_thread(self.registry.collect)
+        if orphans:
+            try:
+                # Список файлов читается по всем страницам, как в синхронном сборщике
+                files = [file async for file in self.client.files.list(purpose='assistants')]
+                known = await asyncio.to_thread(self.registry.known)
+                garbage += _orphans(files, known, self.registry.stale_after, self.registry.prefix)
+            except Exception as e:
+                logger.warning(f"Не удалось получить список файлов для поиска брошенных: {e}")
+        if not garbage:
+            return 0
+        semaphore = asyncio.Semaphore(self.batch_workers)
+        results = await asyncio.gather(*(self._delete(semaphore, file_id) for file_id in garbage))
+        deleted = [file_id for file_id in results if file_id]
+        await asyncio.to_thread(self.registry.forget, deleted)
+        logger.info(f"Сборщик файлов: удалено {len(deleted)} из {len(garbage)}")
+        return len(deleted)
+
+    def start(self, interval: float) -> None:
+        """Периодический запуск sweep в задаче event loop"""
+        if self._task is not None:
+            return
+
+        async def loop() -> None:
+            while True:
+                await asyncio.sleep(interval)
+                try:
+                    await self.sweep()
+                except Exception as e:
+                    logger.warning(f"Ошибка сборщика файлов: {e}")
+
+        self._task = asyncio.create_task(loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Общий для процесса HTTP транспорт клиентов OpenAI.
+
+Все клиенты OpenAI/AsyncOpenAI строятся поверх одного httpx.Client
+(и одного httpx.AsyncClient для async кода), поэтому соединения с
+keep-alive переиспользуются всеми компонентами, а TLS рукопожатие
+выполняется один раз на соединение. Лимиты пула, HTTP/2 и таймауты
+задаются переменными окружения:
+
+- OPENAI_MAX_CONNECTIONS, OPENAI_MAX_KEEPALIVE, OPENAI_KEEPALIVE_EXPIRY
+- OPENAI_HTTP2=true (нужен пакет h2)
+- OPENAI_CONNECT_TIMEOUT и OPENAI_<ОПЕРАЦИЯ>_TIMEOUT для операций
+  upload, poll, list, stream и default
+
+Перед отправкой каждый запрос получает квоту у общего планировщика
+(rate_limiter), а ответы сообщают ему о 429 и остатках квот.
+"""
+
+import os
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, Any, Optional
+
+import httpx
+from openai import OpenAI, AsyncOpenAI
+
+from .rate_limiter import RateLimiter, shared_limiter, current_priority, current_tokens, consumes_tokens
+
+logger = logging.getLogger(__name__)
+
+# Таймауты чтения по типу операции, сек
+DEFAULT_TIMEOUTS: Dict[str, float] = {
+    "default": 60.0,
+    "upload": 300.0,  # загрузка изображений
+    "poll": 15.0,     # runs.retrieve
+    "list": 30.0,     # messages.list
+    "stream": 600.0,  # ожидание событий потокового запуска
+}
+
+
+def _env_bool(name: str, default: bool = False) -> bool:
+    return os.getenv(name, str(default)).lower() == 'true'
+
+
+@dataclass
+class PoolConfig:
+    """Параметры пула соединений"""
+    max_connections: int = 100
+    max_keepalive: int = 20
+    keepalive_expiry: float = 30.0
+    http2: bool = False
+    connect_timeout: float = 10.0
+    timeouts: Dict[str, float] = field(default_factory=lambda: dict(DEFAULT_TIMEOUTS))
+
+    @classmethod
+    def from_env(cls) -> "PoolConfig":
+        """Параметры из переменных окружения"""
+        return cls(
+            max_connections=int(os.getenv('OPENAI_MAX_CONNECTIONS', 100)),
+            max_keepalive=int(os.getenv('OPENAI_MAX_KEEPALIVE', 20)),
+            keepalive_expiry=float(os.getenv('OPENAI_KEEPALIVE_EXPIRY', 30.0)),
+            http2=_env_bool('OPENAI_HTTP2'),
+            connect_timeout=float(os.getenv('OPENAI_CONNECT_TIMEOUT', 10.0)),
+            timeouts={
+                operation: float(os.getenv(f'OPENAI_{operation.upper()}_TIMEOUT', value))
+                for operation, value in DEFAULT_TIMEOUTS.items()
+            },
+        )
+
+    def limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    def timeout(self, operation: str = "default") -> httpx.Timeout:
+        """Таймаут для типа операции: upload, poll, list, stream или default"""
+        read = self.timeouts.get(operation, self.timeouts["default"])
+        return httpx.Timeout(read, connect=self.connect_timeout)
+
+
+def http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class PoolMetrics:
+    """Счетчики запросов и использования соединений пула"""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._connections: Dict[int, None] = {}
+        self._lock = threading.Lock()
+
+    def started(self) -> None:
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def finished(self, failed: bool = False) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            if failed:
+                self.errors += 1
+
+    def seen(self, connections) -> None:
+        with self._lock:
+            for connection in connections:
+                self._connections.setdefault(id(connection))
+
+    def snapshot(self, pool: Any, config: PoolConfig) -> Dict[str, Any]:
+        connections = list(getattr(pool, "connections", []) or [])
+        self.seen(connections)
+        idle = sum(1 for connection in connections if connection.is_idle())
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                "connections_open": len(connections),
+                "connections_idle": idle,
+                "connections_active": len(connections) - idle,
+                "connections_opened": len(self._connections),
+                "max_connections": config.max_connections,
+                "utilization": round((len(connections) - idle) / config.max_connections, 4),
+            }
+
+
+def request_cost(request: httpx.Request) -> int:
+    """Оценка токенов запроса: списывается только при создании запуска"""
+    return current_tokens() if consumes_tokens(request.method, request.url.path) else 0
+
+
+class MeteredTransport(httpx.HTTPTransport):
+    """HTTP транспорт с учетом запросов, соединений и квот"""
+
+    def __init__(self, metrics: PoolMetrics, limiter: Optional[RateLimiter] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.metrics = metrics
+        self.limiter = limiter
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        if self.limiter is not None:
+            self.limiter.acquire(request_cost(request), current_priority())
+        self.metrics.started()
+        try:
+            response = super().handle_request(request)
+        except Exception:
+            self.metrics.finished(failed=True)
+            raise
+        self.metrics.finished()
+        self.metrics.seen(self._pool.connections)
+        if self.limiter is not None:
+            self.limiter.observe(response.status_code, response.headers)
+        return response
+
+
+class MeteredAsyncTransport(httpx.AsyncHTTPTransport):
+    """Async HTTP транспорт с учетом запросов, соединений и квот"""
+
+    def __init__(self, metrics: PoolMetrics, limiter: Optional[RateLimiter] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.metrics = metrics
+        self.limiter = limiter
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if self.limiter is not None:
+            await self.limiter.aacquire(request_cost(request), current_priority())
+        self.metrics.started()
+        try:
+            response = await super().handle_async_request(request)
+        except Exception:
+            self.metrics.finished(failed=True)
+            raise
+        self.metrics.finished()
+        self.metrics.seen(self._pool.connections)
+        if self.limiter is not None:
+            self.limiter.observe(response.status_code, response.headers)
+        return response
+
+
+class SharedTransport:
+    """Ленивая инициализация общих httpx клиентов процесса"""
+
+    def __init__(self, config: Optional[PoolConfig] = None, limiter: Optional[RateLimiter] = None):
+        self.config = config or PoolConfig.from_env()
+        self.limiter = limiter or shared_limiter()
+        self.metrics = PoolMetrics()
+        self.async_metrics = PoolMetrics()
+        self._client: Optional[httpx.Client] = None
+        self._async_client: Optional[httpx.AsyncClient] = None
+        self._lock = threading.Lock()
+
+    def _http2(self) -> bool:
+        if self.config.http2 and not http2_available():
+            logger.warning("OPENAI_HTTP2=true, но пакет h2 не установлен; используется HTTP/1.1")
+            return False
+        return self.config.http2
+
+    def client(self) -> httpx.Client:
+        """Синхронный клиент (потокобезопасен)"""
+        with self._lock:
+            if self._client is None or self._client.is_closed:
+                http2 = self._http2()
+                self._client = httpx.Client(
+                    transport=MeteredTransport(self.metrics, self.limiter, limits=self.config.limits(), http2=http2),
+                    timeout=self.config.timeout(),
+                    follow_redirects=True,
+                )
+            return self._client
+
+    def async_client(self) -> httpx.AsyncClient:
+        """Асинхронный клиент; используется из одного event loop"""
+        with self._lock:
+            if self._async_client is None or self._async_client.is_closed:
+                http2 = self._http2()
+                self._async_client = httpx.AsyncClient(
+                    transport=MeteredAsyncTransport(
+                        self.async_metrics, self.limiter, limits=self.config.limits(), http2=http2
+                    ),
+                    timeout=self.config.timeout(),
+                    follow_redirects=True,
+                )
+            return self._async_client
+
+    def stats(self) -> Dict[str, Any]:
+        """Метрики использования пулов"""
+        stats: Dict[str, Any] = {"http2": self.config.http2 and http2_available(), "rate_limit": self.limiter.stats()}
+        if self._client is not None:
+            stats["sync"] = self.metrics.snapshot(self._client._transport._pool, self.config)
+        if self._async_client is not None:
+            stats["async"] = self.async_metrics.snapshot(self._async_client._transport._pool, self.config)
+        return stats
+
+    def close(self) -> None:
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    async def aclose(self) -> None:
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+
+_shared: Optional[SharedTransport] = None
+_shared_lock = threading.Lock()
+
+
+def shared_transport() -> SharedTransport:
+    """Общий транспорт процесса"""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = SharedTransport()
+        return _shared
+
+
+def timeout_for(operation: str) -> httpx.Timeout:
+    """Таймаут операции по настройкам общего транспорта"""
+    return shared_transport().config.timeout(operation)
+
+
+def openai_client(**kwargs) -> OpenAI:
+    """Клиент OpenAI поверх общего пула соединений"""
+    return OpenAI(http_client=shared_transport().client(), **kwargs)
+
+
+def async_openai_client(**kwargs) -> AsyncOpenAI:
+    """Клиент AsyncOpenAI поверх общего пула соединений"""
+    return AsyncOpenAI(http_client=shared_transport().async_client(), **kwargs)
+
+
+def pool_stats() -> Dict[str, Any]:
+    """Метрики использования общего пула соединений"""
+    return shared_transport().stats()
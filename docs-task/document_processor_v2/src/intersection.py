@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Векторизованные метрики пересечения bbox для intersection_metric шаблонов.
+
+Метрика получает массив элементов разметки формы (N, 4) и массив областей
+извлечения формы (M, 4) в формате x1, y1, x2, y2 и возвращает матрицу
+оценок (M, N). Новые метрики регистрируются через register_metric.
+"""
+
+from typing import Dict, Callable
+
+import numpy as np
+
+Metric = Callable[[np.ndarray, np.ndarray], np.ndarray]
+
+# Защита от деления на ноль для вырожденных bbox
+EPS = 1e-9
+
+INTERSECTION_METRICS: Dict[str, Metric] = {}
+
+
+def register_metric(name: str) -> Callable[[Metric], Metric]:
+    """Регистрация метрики под именем, используемым в шаблонах"""
+    def decorator(metric: Metric) -> Metric:
+        INTERSECTION_METRICS[name] = metric
+        return metric
+    return decorator
+
+
+def get_metric(name: str) -> Metric:
+    """Метрика по имени из шаблона"""
+    try:
+        return INTERSECTION_METRICS[name]
+    except KeyError:
+        raise ValueError(f"Неизвестная метрика пересечения: {name}") from None
+
+
+def as_boxes(boxes) -> np.ndarray:
+    """Приведение списка bbox к массиву (N, 4)"""
+    return np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+
+
+def box_areas(boxes: np.ndarray) -> np.ndarray:
+    """Площади bbox"""
+    return np.maximum(boxes[:, 2] - boxes[:, 0], 0) * np.maximum(boxes[:, 3] - boxes[:, 1], 0)
+
+
+def intersection_areas(boxes: np.ndarray, areas: np.ndarray) -> np.ndarray:
+    """Площади пересечения каждой области с каждым bbox, форма (M, N)"""
+    width = np.minimum(areas[:, 2:3], boxes[:, 2])
+    width -= np.maximum(areas[:, 0:1], boxes[:, 0])
+    np.maximum(width, 0, out=width)
+    height = np.minimum(areas[:, 3:4], boxes[:, 3])
+    height -= np.maximum(areas[:, 1:2], boxes[:, 1])
+    np.maximum(height, 0, out=height)
+    width *= height
+    return width
+
+
+@register_metric("Overlap")
+def overlap(boxes: np.ndarray, areas: np.ndarray) -> np.ndarray:
+    """Доля площади элемента, попавшая в область извлечения"""
+    inter = intersection_areas(boxes, areas)
+    # У вырожденного bbox пересечение нулевое, поэтому деление на EPS дает 0
+    inter /= np.maximum(box_areas(boxes), EPS)
+    return inter
+
+
+@register_metric("IoU")
+def iou(boxes: np.ndarray, areas: np.ndarray) -> np.ndarray:
+    """Отношение площади пересечения к площади объединения"""
+    inter = intersection_areas(boxes, areas)
+    union = box_areas(boxes) + box_areas(areas)[:, np.newaxis]
+    union -= inter
+    np.maximum(union, EPS, out=union)
+    inter /= union
+    return inter
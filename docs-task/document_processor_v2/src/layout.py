@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+Отпечатки макета документа и переиспользование шаблонов между документами
+одного макета.
+
+Счета и УПД приходят от нескольких сотен поставщиков, и у каждого макет
+повторяется: метки "ИНН/КПП продавца", "Всего к оплате" стоят на тех же
+местах, меняются только значения. Отпечаток макета - положения устойчивых
+меток (LAYOUT_ANCHORS, нечеткий поиск text_index) в высотах строки текста:
+масштаб скана и разрешение на него не влияют, а сдвиг скана компенсируется
+при сравнении (отпечатки совмещаются по медианному смещению общих меток).
+
+Индекс макетов хранит для каждого отпечатка шаблоны, которые уже дали
+значение на документе этого макета. Новый документ, отпечаток которого
+совпал с сохраненным в пределах допуска, получает шаблон из индекса без
+запуска ассистента шаблонов; шаблон, не нашедший значения на новом
+документе, генерируется заново.
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from statistics import median
+from typing import Dict, Any, List, Optional, Tuple, Union, Iterator
+
+from .cache import normalize_query
+from .dsl_engine import DocumentIndex
+from .markup import Markup
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка между процессами недоступна
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Метки бланков, положение которых задает макет документа
+LAYOUT_ANCHORS = [
+    "Счет-фактура №",
+    "Исправление №",
+    "Универсальный передаточный документ",
+    "Счет на оплату №",
+    "Товарная накладная",
+    "ИНН/КПП продавца",
+    "ИНН/КПП покупателя",
+    "Продавец",
+    "Поставщик",
+    "Покупатель",
+    "Плательщик",
+    "Грузоотправитель",
+    "Грузополучатель",
+    "Адрес",
+    "К платежно-расчетному документу",
+    "Валюта: наименование, код",
+    "Банк получателя",
+    "Основание",
+    "Итого",
+    "В том числе НДС",
+    "Всего к оплате",
+    "Руководитель организации",
+    "Главный бухгалтер",
+    "Индивидуальный предприниматель",
+]
+
+# Порог сходства текста метки
+ANCHOR_THRESHOLD = 0.8
+
+# Меньше меток - документ не похож на бланк, отпечаток не строится
+MIN_ANCHORS = 3
+
+# Элементы с меньшим confidence не учитываются при оценке высоты строки
+MIN_CONFIDENCE = 50.0
+
+
+@dataclass
+class LayoutFingerprint:
+    """Центры найденных меток макета в высотах строки текста"""
+    anchors: Dict[str, Tuple[float, float]]
+
+    def to_dict(self) -> Dict[str, List[float]]:
+        return {anchor: [round(x, 2), round(y, 2)] for anchor, (x, y) in sorted(self.anchors.items())}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, List[float]]) -> "LayoutFingerprint":
+        return cls({anchor: (float(x), float(y)) for anchor, (x, y) in data.items()})
+
+    @property
+    def digest(self) -> str:
+        """Идентификатор отпечатка"""
+        payload = json.dumps(self.to_dict(), ensure_ascii=False, separators=(',', ':'))
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+    def similarity(self, other: "LayoutFingerprint", tolerance: float) -> float:
+        """Доля меток, совпавших по положению после совмещения
+
+        Совмещение - медианный сдвиг общих меток, так что сдвиг скана и
+        отдельные ошибки OCR не влияют на остальные метки. Доля считается от
+        меньшего отпечатка: метка, не найденная OCR в одном из документов,
+        не должна разделять макет.
+        """
+        common = [anchor for anchor in self.anchors if anchor in other.anchors]
+        if not common:
+            return 0.0
+        dx = median(other.anchors[anchor][0] - self.anchors[anchor][0] for anchor in common)
+        dy = median(other.anchors[anchor][1] - self.anchors[anchor][1] for anchor in common)
+        matched = sum(
+            1 for anchor in common
+            if abs(other.anchors[anchor][0] - self.anchors[anchor][0] - dx) <= tolerance
+            and abs(other.anchors[anchor][1] - self.anchors[anchor][1] - dy) <= tolerance
+        )
+        if matched < MIN_ANCHORS:
+            return 0.0
+        return matched / min(len(self.anchors), len(other.anchors))
+
+
+def layout_fingerprint(markup: Union[Dict[str, Any], Markup, DocumentIndex]) -> Optional[LayoutFingerprint]:
+    """Отпечаток макета разметки; None, если меток бланка слишком мало"""
+    document = markup if isinstance(markup, DocumentIndex) else DocumentIndex(markup)
+    heights = [
+        box[3] - box[1] for box, confidence in zip(document.boxes, document.confidences)
+        if confidence >= MIN_CONFIDENCE and box[3] > box[1]
+    ]
+    if not heights:
+        return None
+    unit = median(heights)
+
+    anchors: Dict[str, Tuple[float, float]] = {}
+    used = set()
+    for anchor in LAYOUT_ANCHORS:
+        matches = document.find_anchor(anchor, ANCHOR_THRESHOLD)
+        # Метка бланка встречается один раз; повторяющийся текст - содержимое таблиц.
+        # Элемент, уже занятый другой меткой ("Покупатель" в "ИНН/КПП покупателя"), не учитывается
+        if len(matches) != 1 or used.intersection(matches[0][0]):
+            continue
+        items, _, box = matches[0]
+        used.update(items)
+        anchors[anchor] = ((box[0] + box[2]) / 2 / unit, (box[1] + box[3]) / 2 / unit)
+
+    if len(anchors) < MIN_ANCHORS:
+        return None
+    return LayoutFingerprint(anchors)
+
+
+class LayoutIndex:
+    """Персистентный индекс макетов и проверенных шаблонов, общий для процессов
+
+    Запись макета: отпечаток, время обновления и шаблоны по нормализованному
+    запросу вместе с версией промпта шаблонов, при которой они получены.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        prompt_version: str = "",
+        tolerance: float = 0.75,
+        min_score: float = 0.8,
+        enabled: bool = True
+    ):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock_path = self.path.with_suffix(self.path.suffix + '.lock')
+        self.prompt_version = prompt_version
+        self.tolerance = tolerance
+        self.min_score = min_score
+        self.enabled = enabled
+        self.found = 0
+        self.misses = 0
+        self.rejected = 0
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._version: Optional[Tuple[int, int]] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, cache_dir: Union[str, Path]) -> "LayoutIndex":
+        """Параметры из LAYOUT_INDEX, LAYOUT_INDEX_PATH, LAYOUT_TOLERANCE и LAYOUT_MIN_SCORE"""
+        return cls(
+            os.getenv('LAYOUT_INDEX_PATH') or Path(cache_dir) / 'layouts.json',
+            tolerance=float(os.getenv('LAYOUT_TOLERANCE', 0.75)),
+            min_score=float(os.getenv('LAYOUT_MIN_SCORE', 0.8)),
+            enabled=os.getenv('LAYOUT_INDEX', 'true').lower() == 'true',
+        )
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """Эксклюзивная блокировка индекса между процессами"""
+        if fcntl is None:
+            yield
+            return
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self) -> Dict[str, Dict[str, Any]]:
+        """Записи индекса; файл перечитывается, только если его изменил другой процесс"""
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            return {}
+        version = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if version == self._version:
+                return self._entries
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Не удалось прочитать индекс макетов {self.path}: {e}")
+            return {}
+        with self._lock:
+            self._entries, self._version = entries, version
+        return entries
+
+    def _write(self, entries: Dict[str, Dict[str, Any]]) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, prefix='.layouts-')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(entries, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        stat = self.path.stat()
+        with self._lock:
+            self._entries, self._version = entries, (stat.st_mtime_ns, stat.st_size)
+
+    def _match(self, entries: Dict[str, Dict[str, Any]], fingerprint: LayoutFingerprint) -> Tuple[Optional[str], float]:
+        best_id, best_score = None, 0.0
+        for layout_id, entry in entries.items():
+            stored = entry["fingerprint"]
+            # Отпечатки с малым числом общих меток не могут пройти порог
+            common = sum(1 for anchor in fingerprint.anchors if anchor in stored)
+            if common < self.min_score * min(len(stored), len(fingerprint.anchors)):
+                continue
+            score = LayoutFingerprint.from_dict(stored).similarity(fingerprint, self.tolerance)
+            if score > best_score:
+                best_id, best_score = layout_id, score
+        if best_score < self.min_score:
+            return None, best_score
+        return best_id, best_score
+
+    def lookup(self, fingerprint: LayoutFingerprint, query: str) -> Optional[Tuple[str, str]]:
+        """Макет документа и его проверенный шаблон для запроса при текущей версии промпта"""
+        entries = self._read()
+        layout_id, score = self._match(entries, fingerprint)
+        entry = entries[layout_id]["templates"].get(normalize_query(query)) if layout_id else None
+        if entry is None or entry["prompt_version"] != self.prompt_version:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.found += 1
+        logger.info(f"Документ совпал с макетом {layout_id} (сходство {score:.2f}), шаблон для запроса '{query}' из индекса")
+        return layout_id, entry["template"]
+
+    def reject(self, layout_id: str, query: str) -> None:
+        """Учет шаблона из индекса, не нашедшего на новом документе значения нужного вида"""
+        with self._lock:
+            self.rejected += 1
+        logger.info(f"Шаблон макета {layout_id} для запроса '{query}' не подтвердился, генерация заново")
+
+    def add(self, fingerprint: LayoutFingerprint, query: str, template: str) -> str:
+        """Сохранение проверенного шаблона для макета документа; идентификатор макета"""
+        with self._locked():
+            entries = dict(self._read())
+            layout_id, _ = self._match(entries, fingerprint)
+            if layout_id is None:
+                layout_id = fingerprint.digest
+                entries[layout_id] = {
+                    "fingerprint": fingerprint.to_dict(),
+                    "templates": {},
+                    "created_at": int(time.time()),
+                }
+                logger.info(f"Новый макет {layout_id}: метки {sorted(fingerprint.anchors)}")
+            entry = dict(entries[layout_id])
+            entry["templates"] = dict(entry["templates"], **{
+                normalize_query(query): {"template": template, "prompt_version": self.prompt_version}
+            })
+            entry["updated_at"] = int(time.time())
+            entries[layout_id] = entry
+            self._write(entries)
+            return layout_id
+
+    def stats(self) -> Dict[str, int]:
+        """Число макетов и счетчики переиспользования шаблонов"""
+        layouts = len(self._read())
+        with self._lock:
+            return {
+                "layouts": layouts,
+                "hits": self.found - self.rejected,
+                "misses": self.misses + self.rejected,
+                "rejected": self.rejected,
+            }
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Компактное представление разметки документа в памяти.
+
+Разметка из json.loads - это словарь на каждый text_item со вложенным
+словарем bbox и отдельными float объектами, больше полукилобайта на
+элемент.
+Markup хранит координаты и confidence по столбцам в типизированных
+массивах (array('d')), номера страниц и ссылки на тексты - в
+целочисленных массивах, а сами тексты - в одной таблице строк без
+повторов. Элемент доступен через легкое представление TextItem со
+__slots__, которое создается по запросу.
+
+Преобразование в JSON формат разметки и обратно без потерь: целые и
+дробные числа различаются, элементы с дополнительными полями или
+нестандартной структурой хранятся как есть, поля верхнего уровня (pages,
+image) сохраняются. markup_hash исходной и восстановленной разметки
+совпадает.
+
+Markup.load читает файл кэша только при первом обращении к данным.
+"""
+
+import sys
+import json
+import math
+from array import array
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Union, Iterator
+
+from .spatial_index import Box
+
+BBOX_FIELDS = ("x1", "y1", "x2", "y2")
+ITEM_FIELDS = {"bbox", "text", "confidence", "page"}
+
+# Флаги элемента: какие числа в исходной разметке были целыми
+INT_COORDS = (1, 2, 4, 8)
+INT_CONFIDENCE = 16
+
+# Целые больше 2^53 не представимы в double без потерь
+MAX_EXACT_INT = 2 ** 53
+MAX_PAGE = 0xFFFF
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _exact(value: Any) -> bool:
+    """Число, которое хранится в double без потерь"""
+    if isinstance(value, float):
+        return not math.isnan(value)
+    return _is_number(value) and abs(value) < MAX_EXACT_INT
+
+
+def _compact(item: Any) -> bool:
+    """Элемент укладывается в столбцы без потерь"""
+    if not isinstance(item, dict) or not ITEM_FIELDS.issuperset(item):
+        return False
+    bbox = item.get("bbox")
+    if not isinstance(bbox, dict) or set(bbox) != set(BBOX_FIELDS):
+        return False
+    if not all(_exact(bbox[name]) for name in BBOX_FIELDS):
+        return False
+    if not isinstance(item.get("text"), str) or not _exact(item.get("confidence")):
+        return False
+    if "page" not in item:
+        return True
+    page = item["page"]
+    return isinstance(page, int) and not isinstance(page, bool) and 1 <= page <= MAX_PAGE
+
+
+def _as_float(value: Any, default: float) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+class TextItem:
+    """Представление элемента разметки поверх столбцов Markup"""
+
+    __slots__ = ('markup', 'index')
+
+    def __init__(self, markup: "Markup", index: int):
+        self.markup = markup
+        self.index = index
+
+    @property
+    def text(self) -> str:
+        return self.markup.text(self.index)
+
+    @property
+    def bbox(self) -> Box:
+        return self.markup.box(self.index)
+
+    @property
+    def confidence(self) -> float:
+        return self.markup.confidence[self.index]
+
+    @property
+    def page(self) -> Optional[int]:
+        return self.markup.page[self.index] or None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return self.markup.item_dict(self.index)
+
+    def __repr__(self) -> str:
+        return f"TextItem({self.index}, {self.text!r}, {self.bbox})"
+
+
+class Markup:
+    """Разметка документа со столбцовым хранением text_items"""
+
+    __slots__ = (
+        '_source', 'x1', 'y1', 'x2', 'y2', 'confidence', 'page',
+        'text_ids', 'strings', 'flags', 'extras', 'meta',
+    )
+
+    def __init__(self):
+        self._source: Optional[Path] = None
+        self.x1 = array('d')
+        self.y1 = array('d')
+        self.x2 = array('d')
+        self.y2 = array('d')
+        self.confidence = array('d')
+        self.page = array('H')       # 0 - страница не указана
+        self.text_ids = array('I')   # индекс текста в strings
+        self.strings: List[str] = []
+        self.flags = array('B')
+        # Элементы, которые не укладываются в столбцы, в исходном виде
+        self.extras: Dict[int, Dict[str, Any]] = {}
+        # Поля разметки, кроме text_items
+        self.meta: Dict[str, Any] = {}
+
+    @classmethod
+    def from_dict(cls, markup: Dict[str, Any]) -> "Markup":
+        """Markup из разметки в формате JSON"""
+        result = cls()
+        result._fill(markup)
+        return result
+
+    @classmethod
+    def from_json(cls, data: Union[str, bytes]) -> "Markup":
+        return cls.from_dict(json.loads(data))
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "Markup":
+        """Markup, который читает файл при первом обращении к данным"""
+        result = cls()
+        result._source = Path(path)
+        return result
+
+    @classmethod
+    def coerce(cls, markup: Union[Dict[str, Any], "Markup"]) -> "Markup":
+        return markup if isinstance(markup, Markup) else cls.from_dict(markup)
+
+    def _ensure(self) -> None:
+        if self._source is not None:
+            with open(self._source, 'rb') as f:
+                self._fill(json.loads(f.read()))
+            self._source = None
+
+    def _fill(self, markup: Dict[str, Any]) -> None:
+        columns = (self.x1, self.y1, self.x2, self.y2)
+        table: Dict[str, int] = {}
+        for index, item in enumerate(markup.get("text_items", [])):
+            flags = 0
+            if _compact(item):
+                bbox = item["bbox"]
+                for column, name, flag in zip(columns, BBOX_FIELDS, INT_COORDS):
+                    value = bbox[name]
+                    column.append(value)
+                    if isinstance(value, int):
+                        flags |= flag
+                confidence = item["confidence"]
+                if isinstance(confidence, int):
+                    flags |= INT_CONFIDENCE
+                self.confidence.append(confidence)
+                self.page.append(item.get("page") or 0)
+                text = item["text"]
+            else:
+                # Значения для индекса; при преобразовании в JSON отдается исходный элемент
+                self.extras[index] = item
+                fields = item if isinstance(item, dict) else {}
+                bbox = fields.get("bbox") if isinstance(fields.get("bbox"), dict) else {}
+                for column, name in zip(columns, BBOX_FIELDS):
+                    column.append(_as_float(bbox.get(name), 0.0))
+                self.confidence.append(_as_float(fields.get("confidence"), 100.0))
+                page = fields.get("page")
+                self.page.append(page if isinstance(page, int) and 1 <= page <= MAX_PAGE else 0)
+                text = str(fields.get("text", ""))
+            text_id = table.get(text)
+            if text_id is None:
+                text_id = table[text] = len(self.strings)
+                self.strings.append(sys.intern(text))
+            self.text_ids.append(text_id)
+            self.flags.append(flags)
+        self.meta = {key: value for key, value in markup.items() if key != "text_items"}
+
+    def __len__(self) -> int:
+        self._ensure()
+        return len(self.text_ids)
+
+    def __getitem__(self, index: int) -> TextItem:
+        self._ensure()
+        if index < 0:
+            index += len(self.text_ids)
+        if not 0 <= index < len(self.text_ids):
+            raise IndexError(index)
+        return TextItem(self, index)
+
+    def __iter__(self) -> Iterator[TextItem]:
+        self._ensure()
+        return (TextItem(self, index) for index in range(len(self.text_ids)))
+
+    def text(self, index: int) -> str:
+        self._ensure()
+        return self.strings[self.text_ids[index]]
+
+    def box(self, index: int) -> Box:
+        self._ensure()
+        return self.x1[index], self.y1[index], self.x2[index], self.y2[index]
+
+    def texts(self) -> List[str]:
+        self._ensure()
+        strings = self.strings
+        return [strings[text_id] for text_id in self.text_ids]
+
+    def boxes(self) -> List[Box]:
+        """Координаты элементов в пикселях их страниц"""
+        self._ensure()
+        return list(zip(self.x1, self.y1, self.x2, self.y2))
+
+    def pages(self) -> List[int]:
+        """Номера страниц элементов; 1, если страница не указана"""
+        self._ensure()
+        return [page or 1 for page in self.page]
+
+    @property
+    def paged(self) -> bool:
+        """Разметка многостраничного документа"""
+        self._ensure()
+        return bool(self.meta.get("pages"))
+
+    def item_dict(self, index: int) -> Dict[str, Any]:
+        """Элемент в формате JSON разметки"""
+        self._ensure()
+        if index in self.extras:
+            return self.extras[index]
+        flags = self.flags[index]
+        bbox = {}
+        for column, name, flag in zip((self.x1, self.y1, self.x2, self.y2), BBOX_FIELDS, INT_COORDS):
+            value = column[index]
+            bbox[name] = int(value) if flags & flag else value
+        confidence = self.confidence[index]
+        item = {
+            "bbox": bbox,
+            "text": self.strings[self.text_ids[index]],
+            "confidence": int(confidence) if flags & INT_CONFIDENCE else confidence,
+        }
+        if self.page[index]:
+            item["page"] = self.page[index]
+        return item
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Разметка в формате JSON"""
+        self._ensure()
+        markup = {"text_items": [self.item_dict(index) for index in range(len(self.text_ids))]}
+        markup.update(self.meta)
+        return markup
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), ensure_ascii=False)
+
+    def nbytes(self) -> int:
+        """Примерный объем столбцов и таблицы строк в памяти"""
+        self._ensure()
+        columns = (self.x1, self.y1, self.x2, self.y2, self.confidence, self.page, self.text_ids, self.flags)
+        return (
+            sum(column.itemsize * len(column) for column in columns)
+            + sum(sys.getsizeof(text) for text in self.strings)
+        )
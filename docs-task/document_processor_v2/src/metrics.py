@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+"""
+Метрики обработки документов.
+
+- длительность этапов (создание треда, загрузка файла, сообщение, запуск,
+  получение результата, ...) и число выполняющихся этапов по операции
+  (markup, template, analyze)
+- время запуска в очереди и время выполнения, токены из usage запуска
+- счетчики кэшей и реестра файлов, снимаемые в момент чтения метрик
+
+Этапы отмечаются декоратором timed_stage. Операция задается контекстом
+(metrics_operation), как класс приоритета в rate_limiter, поэтому этапы
+AssistantManager и DocumentAssistant не знают, для чего их вызвали.
+Метрики общие для процесса (shared_metrics()): render() отдает их в
+текстовом формате Prometheus, snapshot() - в JSON.
+"""
+
+import json
+import time
+import bisect
+import asyncio
+import logging
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple, Union, Callable, Iterable, Iterator
+
+logger = logging.getLogger(__name__)
+
+# Границы гистограмм длительности, сек
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+# Границы гистограммы токенов одного запуска
+TOKEN_BUCKETS = (500, 1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000)
+
+STAGE_SECONDS = "docproc_stage_seconds"
+STAGE_ERRORS = "docproc_stage_errors_total"
+STAGE_IN_FLIGHT = "docproc_stage_in_flight"
+RUNS = "docproc_runs_total"
+RUN_QUEUE_SECONDS = "docproc_run_queue_seconds"
+RUN_EXECUTION_SECONDS = "docproc_run_execution_seconds"
+RUN_TOKENS = "docproc_run_tokens"
+TOKENS = "docproc_tokens_total"
+
+# Выборка коллектора: имя, тип, описание, метки, значение
+Sample = Tuple[str, str, str, Dict[str, str], float]
+
+_operation: contextvars.ContextVar[str] = contextvars.ContextVar('metrics_operation', default='other')
+
+
+@contextmanager
+def metrics_operation(name: str):
+    """Операция, к которой относятся этапы и запуски внутри блока"""
+    token = _operation.set(name)
+    try:
+        yield
+    finally:
+        _operation.reset(token)
+
+
+def current_operation() -> str:
+    return _operation.get()
+
+
+def _number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(str(value))}"' for name, value in labels.items()) + '}'
+
+
+class Metric:
+    """Счетчик, показатель или гистограмма с фиксированным набором меток"""
+
+    def __init__(self, name: str, kind: str, help: str, labels: Tuple[str, ...],
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.values: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, values: Tuple[str, ...]) -> Tuple[str, ...]:
+        if len(values) != len(self.labels):
+            raise ValueError(f"Метрика {self.name}: ожидаются метки {self.labels}, получено {values}")
+        return tuple(str(value) for value in values)
+
+    def inc(self, *labels: str, value: float = 1.0) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0.0) + value
+
+    def dec(self, *labels: str, value: float = 1.0) -> None:
+        self.inc(*labels, value=-value)
+
+    def set(self, *labels: str, value: float) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = value
+
+    def observe(self, value: float, *labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self.values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.values[key] = (counts, total + value)
+
+    def items(self) -> List[Tuple[Dict[str, str], Any]]:
+        with self._lock:
+            return [
+                (dict(zip(self.labels, key)), (list(value[0]), value[1]) if self.kind == 'histogram' else value)
+                for key, value in sorted(self.values.items())
+            ]
+
+    def quantile(self, counts: List[int], q: float) -> Optional[float]:
+        """Оценка квантиля по корзинам (линейно внутри корзины, как histogram_quantile)"""
+        total = sum(counts)
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for index, count in enumerate(counts):
+            if seen + count >= rank and count:
+                if index == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0.0
+                return lower + (self.buckets[index] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class MetricsRegistry:
+    """Метрики процесса и коллекторы, снимаемые при чтении"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._collectors: Dict[str, Callable[[], Iterable[Sample]]] = {}
+        self._lock = threading.Lock()
+
+    def _metric(self, name: str, kind: str, help: str, labels: Tuple[str, ...],
+                buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Metric:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = Metric(name, kind, help, labels, buckets)
+            return metric
+
+    def counter(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Metric:
+        return self._metric(name, 'counter', help, labels)
+
+    def gauge(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Metric:
+        return self._metric(name, 'gauge', help, labels)
+
+    def histogram(self, name: str, help: str, labels: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Metric:
+        return self._metric(name, 'histogram', help, labels, buckets)
+
+    def collector(self, key: str, collect: Callable[[], Iterable[Sample]]) -> None:
+        """Регистрация коллектора; коллектор с тем же ключом заменяется"""
+        with self._lock:
+            self._collectors[key] = collect
+
+    def collected(self) -> Dict[str, Dict[str, Any]]:
+        """Выборки коллекторов, сгруппированные по имени метрики"""
+        with self._lock:
+            collectors = list(self._collectors.items())
+        grouped: Dict[str, Dict[str, Any]] = {}
+        for key, collect in collectors:
+            try:
+                samples = list(collect())
+            except Exception as e:
+                logger.warning(f"Не удалось снять метрики {key}: {e}")
+                continue
+            for name, kind, help, labels, value in samples:
+                entry = grouped.setdefault(name, {"type": kind, "help": help, "samples": []})
+                entry["samples"].append({"labels": labels, "value": value})
+        return grouped
+
+    def render(self) -> str:
+        """Метрики в текстовом формате Prometheus"""
+        lines: List[str] = []
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for labels, value in metric.items():
+                if metric.kind != 'histogram':
+                    lines.append(f"{metric.name}{_labels(labels)} {_number(value)}")
+                    continue
+                counts, total = value
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float('inf'),), counts):
+                    cumulative += count
+                    lines.append(f"{metric.name}_bucket{_labels(dict(labels, le=_number(bound)))} {cumulative}")
+                lines.append(f"{metric.name}_sum{_labels(labels)} {_number(total)}")
+                lines.append(f"{metric.name}_count{_labels(labels)} {cumulative}")
+        for name, entry in sorted(self.collected().items()):
+            lines.append(f"# HELP {name} {entry['help']}")
+            lines.append(f"# TYPE {name} {entry['type']}")
+            for sample in entry["samples"]:
+                lines.append(f"{name}{_labels(sample['labels'])} {_number(sample['value'])}")
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Метрики в виде JSON: для гистограмм - число, сумма, p50/p95 и число наблюдений в корзинах"""
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        result: Dict[str, Any] = {}
+        for metric in metrics:
+            samples = []
+            for labels, value in metric.items():
+                if metric.kind != 'histogram':
+                    samples.append({"labels": labels, "value": value})
+                    continue
+                counts, total = value
+                count = sum(counts)
+                p50, p95 = metric.quantile(counts, 0.5), metric.quantile(counts, 0.95)
+                samples.append({
+                    "labels": labels,
+                    "count": count,
+                    "sum": round(total, 6),
+                    "mean": round(total / count, 6) if count else None,
+                    "p50": round(p50, 6) if p50 is not None else None,
+                    "p95": round(p95, 6) if p95 is not None else None,
+                    "buckets": {_number(bound): n for bound, n in zip(metric.buckets + (float('inf'),), counts)},
+                })
+            result[metric.name] = {"type": metric.kind, "help": metric.help, "samples": samples}
+        result.update(self.collected())
+        return result
+
+    def write_json(self, path: Union[str, Path]) -> None:
+        """Сохранение snapshot() в файл"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False, indent=2)
+        logger.info(f"Метрики сохранены в {path}")
+
+
+_shared: Optional[MetricsRegistry] = None
+_shared_lock = threading.Lock()
+
+
+def shared_metrics() -> MetricsRegistry:
+    """Метрики, общие для процесса"""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = MetricsRegistry()
+        return _shared
+
+
+@contextmanager
+def measure_stage(stage: str) -> Iterator[None]:
+    """Длительность, ошибки и число выполняющихся экземпляров этапа текущей операции"""
+    registry = shared_metrics()
+    labels = (current_operation(), stage)
+    in_flight = registry.gauge(STAGE_IN_FLIGHT, "Выполняющиеся этапы обработки", ("operation", "stage"))
+    in_flight.inc(*labels)
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        registry.counter(STAGE_ERRORS, "Этапы обработки, завершившиеся ошибкой", ("operation", "stage")).inc(*labels)
+        raise
+    finally:
+        in_flight.dec(*labels)
+        registry.histogram(
+            STAGE_SECONDS, "Длительность этапов обработки, сек", ("operation", "stage")
+        ).observe(time.perf_counter() - started, *labels)
+
+
+def timed_stage(stage: str) -> Callable:
+    """Декоратор метода-этапа (синхронного или async) для measure_stage"""
+    def decorate(func: Callable) -> Callable:
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with measure_stage(stage):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with measure_stage(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def record_run(run: Any, queued: Optional[float], elapsed: float) -> None:
+    """Исход запуска, время в очереди и выполнения, токены из usage
+
+    queued - время от начала ожидания до первого статуса, отличного от
+    queued; если переход не наблюдался, оценивается по started_at запуска.
+    """
+    registry = shared_metrics()
+    operation = current_operation()
+    status = getattr(run, "status", None) or "unknown"
+    registry.counter(RUNS, "Завершенные запуски ассистентов по статусу", ("operation", "status")).inc(operation, status)
+    if status != "completed":
+        return
+
+    if queued is None:
+        created_at, started_at = getattr(run, "created_at", None), getattr(run, "started_at", None)
+        if created_at and started_at:
+            queued = min(max(started_at - created_at, 0.0), elapsed)
+    if queued is not None:
+        registry.histogram(
+            RUN_QUEUE_SECONDS, "Время запуска в статусе queued, сек", ("operation",)
+        ).observe(queued, operation)
+        registry.histogram(
+            RUN_EXECUTION_SECONDS, "Время выполнения запуска после очереди, сек", ("operation",)
+        ).observe(max(elapsed - queued, 0.0), operation)
+
+    usage = getattr(run, "usage", None)
+    if usage is None:
+        return
+    tokens = registry.counter(TOKENS, "Токены, израсходованные запусками", ("operation", "kind"))
+    for kind in ("prompt", "completion"):
+        value = getattr(usage, f"{kind}_tokens", None)
+        if value:
+            tokens.inc(operation, kind, value=value)
+    total = getattr(usage, "total_tokens", None)
+    if total:
+        registry.histogram(
+            RUN_TOKENS, "Токены одного запуска", ("operation",), buckets=TOKEN_BUCKETS
+        ).observe(total, operation)
+
+
+def cache_samples(cache: str, stats: Dict[str, int]) -> List[Sample]:
+    """Выборки счетчиков кэша из его stats()"""
+    samples: List[Sample] = []
+    for key, kind, help in (
+        ("hits", "counter", "Попадания в кэш"),
+        ("misses", "counter", "Промахи кэша"),
+        ("writes", "counter", "Записи в кэш"),
+        ("evictions", "counter", "Вытесненные из кэша записи"),
+        ("entries", "gauge", "Записи в кэше"),
+        ("bytes", "gauge", "Размер кэша, байт"),
+    ):
+        value = stats.get(key)
+        if value is None or value < 0:
+            continue
+        suffix = "_total" if kind == "counter" else ""
+        samples.append((f"docproc_cache_{key}{suffix}", kind, help, {"cache": cache}, value))
+    return samples
+
+
+def file_samples(stats: Dict[str, int]) -> List[Sample]:
+    """Выборки реестра загруженных в OpenAI файлов из FileRegistry.stats()"""
+    return [
+        ("docproc_uploaded_files", "gauge", "Файлы, загруженные в OpenAI", {"state": "registered"}, stats["files"]),
+        ("docproc_uploaded_files", "gauge", "Файлы, загруженные в OpenAI", {"state": "in_use"}, stats["in_use"]),
+        ("docproc_uploaded_files", "gauge", "Файлы, загруженные в OpenAI", {"state": "deleting"}, stats["deleting"]),
+        ("docproc_uploaded_file_bytes", "gauge", "Размер загруженных файлов, байт", {}, stats["bytes"]),
+    ]
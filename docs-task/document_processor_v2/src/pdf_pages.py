@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Разбиение PDF документов на страницы.
+
+Страницы рендерятся локально в PNG с фиксированным разрешением, поэтому
+неизменная страница повторно присланного документа дает те же байты и
+находит свою разметку в кэше по содержимому; заново размечаются только
+измененные страницы.
+
+Нужен пакет pypdfium2; без него PDF документы не обрабатываются.
+"""
+
+import logging
+from pathlib import Path
+from typing import Dict, Any, List, Union
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:  # pypdfium2 не установлен: PDF не поддерживается
+    pdfium = None
+
+logger = logging.getLogger(__name__)
+
+PDF_EXTENSIONS = {'.pdf'}
+PDF_MAGIC = b'%PDF-'
+
+# Разрешение рендеринга страниц по умолчанию, точек на дюйм
+DEFAULT_DPI = 200
+
+
+def is_pdf(path: Union[str, Path]) -> bool:
+    """PDF по расширению или сигнатуре файла"""
+    if Path(path).suffix.lower() in PDF_EXTENSIONS:
+        return True
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(PDF_MAGIC)) == PDF_MAGIC
+    except OSError:
+        return False
+
+
+def render_pages(pdf_path: Union[str, Path], output_dir: Union[str, Path], dpi: int = DEFAULT_DPI) -> List[str]:
+    """Рендеринг страниц PDF в PNG файлы output_dir; пути в порядке страниц"""
+    if pdfium is None:
+        raise RuntimeError("Для обработки PDF нужен пакет pypdfium2")
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    document = pdfium.PdfDocument(str(pdf_path))
+    try:
+        for number in range(len(document)):
+            page = document[number]
+            try:
+                image = page.render(scale=dpi / 72).to_pil()
+            finally:
+                page.close()
+            path = output_dir / f"page-{number + 1:04d}.png"
+            # Без метаданных и с фиксированным сжатием: одинаковые страницы дают одинаковые байты
+            image.save(path, format='PNG', compress_level=1)
+            paths.append(str(path))
+    finally:
+        document.close()
+    logger.info(f"PDF {Path(pdf_path).name}: {len(paths)} стр., {dpi} dpi")
+    return paths
+
+
+def merge_pages(pages: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Разметка документа из разметок страниц
+
+    Каждый text_item получает номер страницы (page, с 1), координаты
+    остаются в пикселях своей страницы. Размеры страниц, если они известны,
+    записываются в список pages.
+    """
+    text_items = []
+    page_info = []
+    for number, markup in enumerate(pages, start=1):
+        for item in markup.get("text_items", []):
+            text_items.append({**item, "page": number})
+        image = markup.get("image") or {}
+        page_info.append({
+            "page": number,
+            "width": image.get("width"),
+            "height": image.get("height"),
+        })
+    return {"text_items": text_items, "pages": page_info}
+
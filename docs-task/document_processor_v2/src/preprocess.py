@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Подготовка изображений перед загрузкой в OpenAI.
+
+Скан уменьшается до заданной длинной стороны, переводится в оттенки серого
+и перекодируется в JPEG с подбором качества под бюджет размера; ориентация
+из EXIF применяется к пикселям. Коэффициент масштаба сохраняется, и
+координаты bbox полученной разметки пересчитываются обратно в пиксели
+исходного изображения (в его EXIF ориентации, как его показывают
+просмотрщики).
+
+Нужен пакет Pillow; без него изображения загружаются как есть.
+"""
+
+import os
+import io
+import time
+import logging
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Any, Optional, Tuple
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow не установлен: подготовка отключается
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Тег EXIF с ориентацией изображения
+EXIF_ORIENTATION = 0x0112
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    return os.getenv(name, str(default)).lower() == 'true'
+
+
+@dataclass
+class PreprocessConfig:
+    """Параметры подготовки изображения"""
+    enabled: bool = True
+    max_long_edge: int = 2048      # длинная сторона после уменьшения, пикселей
+    grayscale: bool = True
+    quality: int = 85              # начальное качество JPEG
+    min_quality: int = 50          # нижняя граница качества при подборе под бюджет
+    max_bytes: int = 1024 * 1024   # бюджет размера файла
+
+    @classmethod
+    def from_env(cls) -> "PreprocessConfig":
+        """Параметры из переменных окружения IMAGE_*"""
+        return cls(
+            enabled=_env_bool('IMAGE_PREPROCESS', cls.enabled),
+            max_long_edge=int(os.getenv('IMAGE_MAX_EDGE', cls.max_long_edge)),
+            grayscale=_env_bool('IMAGE_GRAYSCALE', cls.grayscale),
+            quality=int(os.getenv('IMAGE_JPEG_QUALITY', cls.quality)),
+            min_quality=int(os.getenv('IMAGE_MIN_JPEG_QUALITY', cls.min_quality)),
+            max_bytes=int(os.getenv('IMAGE_MAX_BYTES', cls.max_bytes)),
+        )
+
+
+@dataclass
+class PreparedImage:
+    """Изображение для загрузки и данные для обратного пересчета координат
+
+    Размеры не заданы, если подготовка отключена.
+    """
+    path: str
+    original_size: Optional[Tuple[int, int]]
+    size: Optional[Tuple[int, int]]
+    original_bytes: int
+    bytes: int
+    quality: Optional[int] = None
+    duration: float = 0.0
+    temporary: bool = False
+
+    @property
+    def scale(self) -> Tuple[float, float]:
+        """Отношение размеров подготовленного изображения к исходному по осям"""
+        if not self.size or not self.original_size:
+            return 1.0, 1.0
+        return self.size[0] / self.original_size[0], self.size[1] / self.original_size[1]
+
+    def restore(self, markup: Dict[str, Any]) -> Dict[str, Any]:
+        """Разметка в координатах исходного изображения"""
+        if not self.original_size:
+            return markup
+        scale_x, scale_y = self.scale
+        if (scale_x, scale_y) != (1.0, 1.0):
+            for item in markup.get("text_items", []):
+                bbox = item.get("bbox")
+                if not bbox:
+                    continue
+                bbox["x1"] = round(float(bbox["x1"]) / scale_x, 1)
+                bbox["x2"] = round(float(bbox["x2"]) / scale_x, 1)
+                bbox["y1"] = round(float(bbox["y1"]) / scale_y, 1)
+                bbox["y2"] = round(float(bbox["y2"]) / scale_y, 1)
+        markup["image"] = {
+            "width": self.original_size[0],
+            "height": self.original_size[1],
+            "scale": round(min(scale_x, scale_y), 6),
+        }
+        return markup
+
+    def cleanup(self) -> None:
+        if self.temporary and os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "original_bytes": self.original_bytes,
+            "bytes": self.bytes,
+            "original_size": list(self.original_size) if self.original_size else None,
+            "size": list(self.size) if self.size else None,
+            "quality": self.quality,
+            "duration_ms": round(self.duration * 1000, 1),
+        }
+
+
+class ImagePreprocessor:
+    """Подготовка сканов к загрузке"""
+
+    def __init__(self, config: Optional[PreprocessConfig] = None, output_dir: Optional[str] = None):
+        self.config = config or PreprocessConfig.from_env()
+        self.output_dir = output_dir
+        if self.config.enabled and Image is None:
+            logger.warning("Pillow не установлен, изображения загружаются без подготовки")
+
+    @property
+    def enabled(self) -> bool:
+        return self.config.enabled and Image is not None
+
+    def _encode(self, image: "Image.Image") -> Tuple[bytes, int]:
+        """JPEG с наибольшим качеством, укладывающийся в бюджет размера"""
+        quality = self.config.quality
+        while True:
+            buffer = io.BytesIO()
+            image.save(buffer, format='JPEG', quality=quality, optimize=True)
+            data = buffer.getvalue()
+            if len(data) <= self.config.max_bytes or quality <= self.config.min_quality:
+                return data, quality
+            quality = max(quality - 10, self.config.min_quality)
+
+    def prepare(self, image_path: str) -> PreparedImage:
+        """Подготовленное изображение; исходный файл, если подготовка не уменьшает его"""
+        original_bytes = os.path.getsize(image_path)
+        if not self.enabled:
+            return PreparedImage(image_path, None, None, original_bytes, original_bytes)
+
+        started = time.perf_counter()
+        try:
+            with Image.open(image_path) as source:
+                rotated = source.getexif().get(EXIF_ORIENTATION, 1) != 1
+                image = ImageOps.exif_transpose(source)
+                original_size = image.size
+                image = image.convert('L' if self.config.grayscale else 'RGB')
+                if max(image.size) > self.config.max_long_edge:
+                    image.thumbnail((self.config.max_long_edge, self.config.max_long_edge), Image.LANCZOS)
+                data, quality = self._encode(image)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Не удалось подготовить {image_path}, загружается исходный файл: {e}")
+            return PreparedImage(image_path, None, None, original_bytes, original_bytes)
+
+        duration = time.perf_counter() - started
+        if len(data) >= original_bytes and not rotated and image.size == original_size:
+            # Подготовка ничего не дала: загружается исходный файл
+            return PreparedImage(image_path, original_size, original_size, original_bytes, original_bytes,
+                                 duration=duration)
+
+        fd, path = tempfile.mkstemp(suffix='.jpg', prefix='prepared-', dir=self.output_dir)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        prepared = PreparedImage(path, original_size, image.size, original_bytes, len(data), quality,
+                                 duration, temporary=True)
+        logger.info(
+            f"Изображение {Path(image_path).name}: {original_size[0]}x{original_size[1]} -> "
+            f"{image.size[0]}x{image.size[1]}, {original_bytes} -> {len(data)} байт"
+        )
+        return prepared
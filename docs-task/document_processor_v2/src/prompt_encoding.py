@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Компактное представление разметки в промптах генерации шаблонов.
+
+json.dumps(markup, indent=2) повторяет ключи "bbox", "x1", ... в каждом
+элементе, а отступы и дробные координаты еще больше увеличивают число
+токенов. Табличный формат передает по строке на элемент:
+
+    x1 y1 x2 y2 conf text
+
+со значениями через табуляцию, целыми координатами и confidence, а для
+многостраничных документов - с номером страницы в первом столбце.
+Элементы с confidence ниже порога можно не передавать.
+
+Токены считаются через tiktoken, если он установлен, иначе оцениваются по
+числу символов.
+"""
+
+import os
+import sys
+import json
+from dataclasses import dataclass
+from typing import Dict, Any, List, Union
+
+from .markup import Markup
+from .rate_limiter import estimate_tokens
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken не установлен: токены оцениваются по длине текста
+    tiktoken = None
+
+TABLE = "table"
+JSON = "json"
+FORMATS = (TABLE, JSON)
+
+# Кодировка токенизатора моделей GPT-4
+TOKEN_ENCODING = "cl100k_base"
+
+_encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """Число токенов текста: точное с tiktoken, иначе оценка"""
+    global _encoding
+    if tiktoken is None:
+        return estimate_tokens(text)
+    if _encoding is None:
+        _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+    return len(_encoding.encode(text))
+
+
+def _cell(text: str) -> str:
+    """Текст элемента без символов, разделяющих столбцы и строки"""
+    return ' '.join(text.split())
+
+
+@dataclass
+class MarkupEncoder:
+    """Представление разметки для сообщения ассистенту шаблонов"""
+    format: str = TABLE
+    min_confidence: float = 0.0   # элементы с меньшим confidence не передаются
+
+    def __post_init__(self):
+        if self.format not in FORMATS:
+            raise ValueError(f"Неизвестный формат разметки в промпте: {self.format}")
+
+    @classmethod
+    def from_env(cls) -> "MarkupEncoder":
+        """Параметры из PROMPT_MARKUP_FORMAT и PROMPT_MIN_CONFIDENCE"""
+        return cls(
+            format=os.getenv('PROMPT_MARKUP_FORMAT', TABLE).lower(),
+            min_confidence=float(os.getenv('PROMPT_MIN_CONFIDENCE', 0)),
+        )
+
+    @property
+    def signature(self) -> str:
+        """Параметры, от которых зависит текст промпта, для ключа кэша шаблонов"""
+        if self.format == JSON and not self.min_confidence:
+            return ""
+        return f"{self.format}:{self.min_confidence:g}"
+
+    def kept(self, markup: Markup) -> List[int]:
+        """Индексы передаваемых элементов"""
+        return [
+            index for index, confidence in enumerate(markup.confidence)
+            if confidence >= self.min_confidence
+        ]
+
+    def encode(self, markup: Union[Dict[str, Any], Markup]) -> str:
+        """Разметка для вставки в сообщение вместе с описанием формата"""
+        if self.format == JSON:
+            if self.min_confidence:
+                compact = Markup.coerce(markup)
+                markup = {"text_items": [compact.item_dict(index) for index in self.kept(compact)], **compact.meta}
+            elif isinstance(markup, Markup):
+                markup = markup.to_dict()
+            return json.dumps(markup, indent=2, ensure_ascii=False)
+
+        markup = Markup.coerce(markup)
+        paged = markup.paged
+        columns = ["x1", "y1", "x2", "y2", "conf", "text"]
+        if paged:
+            columns.insert(0, "page")
+        lines = [
+            "Разметка в виде таблицы: строка на текстовый элемент, столбцы через табуляцию, "
+            "координаты bbox в пикселях, conf - уверенность распознавания 0-100.",
+            '\t'.join(columns),
+        ]
+        for index in self.kept(markup):
+            x1, y1, x2, y2 = markup.box(index)
+            row = [
+                str(round(x1)), str(round(y1)), str(round(x2)), str(round(y2)),
+                str(round(markup.confidence[index])), _cell(markup.text(index)),
+            ]
+            if paged:
+                row.insert(0, str(markup.page[index] or 1))
+            lines.append('\t'.join(row))
+        return '\n'.join(lines)
+
+    def report(self, markup: Union[Dict[str, Any], Markup]) -> Dict[str, Any]:
+        """Токены разметки в формате JSON с отступами и в текущем формате"""
+        compact = Markup.coerce(markup)
+        before = count_tokens(json.dumps(compact.to_dict(), indent=2, ensure_ascii=False))
+        after = count_tokens(self.encode(compact))
+        return {
+            "format": self.format,
+            "items": len(compact),
+            "dropped": len(compact) - len(self.kept(compact)),
+            "json_tokens": before,
+            "tokens": after,
+            "ratio": round(after / before, 3) if before else 1.0,
+            "exact": tiktoken is not None,
+        }
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Токены разметки в промпте до и после сжатия')
+    parser.add_argument('markup_path', help='Путь к JSON разметке')
+    parser.add_argument('--format', choices=FORMATS, default=TABLE, help='Формат разметки в промпте')
+    parser.add_argument('--min-confidence', type=float, default=0.0, help='Порог confidence элементов')
+    parser.add_argument('--show', action='store_true', help='Вывести закодированную разметку')
+
+    args = parser.parse_args()
+    encoder = MarkupEncoder(args.format, args.min_confidence)
+    markup = Markup.load(args.markup_path)
+    if args.show:
+        print(encoder.encode(markup))
+    json.dump(encoder.report(markup), sys.stdout, ensure_ascii=False, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Канонические ключи запросов пользователя.
+
+Запросы приходят свободным текстом: "найди ИНН продавца", "ИНН продавца",
+"нужен инн поставщика" - это одно и то же поле. Ключ запроса строится
+локально, без обращения к API:
+
+- тип поля и уточнение определяются по таблицам синонимов query_pruning
+  ("поставщика" и "продавца" -> seller), служебные слова отбрасываются
+- остальные слова приводятся к основе отсечением окончаний
+- короткие слова, меняющие смысл ("с", "без", "не", "в т.ч."), сохраняются
+  как метки: "сумма с НДС" и "сумма НДС" - разные поля
+- кандидаты - известные запросы с тем же типом поля, теми же метками и
+  основами реквизитов (БИК, ОГРН, счет, НДС, ...), у которых каждой основе
+  запроса соответствует основа кандидата и наоборот (равная или продолжающая
+  ее: "расч" - "расчетны"); "код вида товара" - не "код товара"
+- среди кандидатов ищется ближайший по TF-IDF косинусу триграмм основ; при
+  сходстве не ниже порога запрос получает его ключ, иначе заводится новый
+
+Ключ используется вместо текста запроса в кэше шаблонов, индексе макетов,
+именах файлов шаблонов и манифесте пакетной обработки, поэтому
+перефразированные запросы переиспользуют уже сгенерированные шаблоны.
+"""
+
+import os
+import re
+import json
+import math
+import logging
+import tempfile
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple, Union, Iterator
+
+from .cache import normalize_query
+from .query_pruning import query_fields
+from .text_index import normalize_text, trigrams
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка между процессами недоступна
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Окончания, отсекаемые при приведении слова к основе (длинные раньше коротких)
+ENDINGS = sorted([
+    "ями", "ами", "ого", "его", "ому", "ему", "ыми", "ими", "иях", "ией",
+    "ях", "ах", "ов", "ев", "ей", "ой", "ый", "ий", "ая", "яя", "ое", "ее",
+    "ые", "ие", "ую", "юю", "ом", "ем", "ам", "ям", "ия", "ию",
+    "ы", "и", "а", "я", "о", "е", "у", "ю", "ь",
+], key=len, reverse=True)
+
+# Основа не короче этого числа букв
+MIN_STEM = 3
+
+# Порог сходства запросов по умолчанию
+DEFAULT_THRESHOLD = 0.75
+
+# Слова, меняющие смысл запроса, и их метки в основах ("в т.ч." раньше "с")
+POLARITY: List[Tuple[str, str]] = [
+    ("втч", r"в\s+т\.?\s*ч\.?|в\s+том\s+числе|включая"),
+    ("без", r"без"),
+    ("не", r"не"),
+    ("с", r"со?"),
+]
+
+# Сокращения реквизитов, раскрываемые до разбора запроса
+ABBREVIATIONS = {
+    "р/с": "расчетный счет",
+    "к/с": "корреспондентский счет",
+    "л/с": "лицевой счет",
+}
+
+# Основы реквизитов: запросы с разными реквизитами не объединяются при любом сходстве
+IDENTIFYING = {
+    "бик", "огрн", "огрнип", "окпо", "оквэд", "снилс", "счет", "ндс", "акциз", "кбк", "октмо",
+}
+
+
+def stem(word: str) -> str:
+    """Основа слова: отсечение самого длинного подходящего окончания"""
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def polarity_markers(query: str) -> Tuple[str, List[str]]:
+    """Запрос без слов, меняющих смысл, и метки этих слов"""
+    text = normalize_text(query)
+    for short, full in ABBREVIATIONS.items():
+        text = re.sub(rf'(?<![\w/]){short}(?![\w/])', full, text)
+    markers = []
+    for marker, pattern in POLARITY:
+        # Отдельное слово: "с" в "и/с" - часть сокращения, а не предлог
+        text, found = re.subn(rf'(?<![\w/.]){pattern}(?![\w/])', ' ', text)
+        if found:
+            markers.append(marker)
+    return text, sorted(markers)
+
+
+def query_signature(query: str) -> Tuple[str, List[str]]:
+    """Тип поля с уточнениями, основы остальных слов запроса и метки смысла"""
+    text, markers = polarity_markers(query)
+    # Короткие слова вроде "НДС" отличают поле ("сумма НДС" - не "сумма к оплате")
+    field_types, qualifiers, extra = query_fields(text, min_length=3)
+    field = '+'.join(sorted(field_types))
+    if qualifiers:
+        field += '_' + '+'.join(sorted(qualifiers))
+    # "счет-фактуры" и "счет фактуры" дают одни и те же основы
+    return field, [stem(part) for word in extra for part in word.split('-') if part] + markers
+
+
+def hard_features(stems: List[str]) -> set:
+    """Метки смысла и основы реквизитов: они должны совпадать у запросов одного ключа"""
+    markers = {marker for marker, _ in POLARITY}
+    return {value for value in stems if value in markers or value in IDENTIFYING}
+
+
+def _counterpart(value: str, others: List[str]) -> bool:
+    """У основы есть равная или продолжающая ее основа среди others"""
+    return any(
+        value == other
+        or (min(len(value), len(other)) >= MIN_STEM and (value.startswith(other) or other.startswith(value)))
+        for other in others
+    )
+
+
+def aligned(stems: List[str], other: List[str]) -> bool:
+    """Основы двух запросов попарно соответствуют друг другу: лишнее слово меняет поле"""
+    return all(_counterpart(value, other) for value in stems) and all(_counterpart(value, stems) for value in other)
+
+
+def display_stems(query: str, stems: List[str]) -> List[str]:
+    """Основы в исходном написании для ключа: "email" не становится смесью латиницы и кириллицы"""
+    parts = [part for word in re.findall(r'[\w№-]+', query.lower().replace('ё', 'е')) for part in word.split('-') if part]
+    originals = {normalize_text(part): part for part in parts}
+    result = []
+    for value in stems:
+        source = next((part for folded, part in originals.items() if stem(folded) == value), None)
+        # Нормализация заменяет буквы одну на одну, поэтому основа - начало исходного слова
+        result.append(source[:len(value)] if source is not None else value)
+    return result
+
+
+def _slug(field: str, stems: List[str]) -> str:
+    """Ключ, пригодный для имени файла"""
+    parts = ([field] if field else []) + stems
+    return re.sub(r'[^\w+-]+', '_', '_'.join(parts)).strip('_') or 'query'
+
+
+class QueryIndex:
+    """Персистентное отображение запросов на канонические ключи, общее для процессов
+
+    Запись ключа: тип поля, основы слов и формулировки, которые на него
+    отображены. Точное совпадение нормализованной формулировки проверяется
+    до вычисления сходства.
+    """
+
+    def __init__(self, path: Union[str, Path], threshold: float = DEFAULT_THRESHOLD, enabled: bool = True):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock_path = self.path.with_suffix(self.path.suffix + '.lock')
+        self.threshold = threshold
+        self.enabled = enabled
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._aliases: Dict[str, str] = {}
+        self._version: Optional[Tuple[int, int]] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, cache_dir: Union[str, Path]) -> "QueryIndex":
+        """Параметры из QUERY_INDEX, QUERY_INDEX_PATH и QUERY_SIMILARITY_THRESHOLD"""
+        return cls(
+            os.getenv('QUERY_INDEX_PATH') or Path(cache_dir) / 'queries.json',
+            threshold=float(os.getenv('QUERY_SIMILARITY_THRESHOLD', DEFAULT_THRESHOLD)),
+            enabled=os.getenv('QUERY_INDEX', 'true').lower() == 'true',
+        )
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """Эксклюзивная блокировка индекса между процессами"""
+        if fcntl is None:
+            yield
+            return
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load(self, entries: Dict[str, Dict[str, Any]], version: Optional[Tuple[int, int]]) -> None:
+        aliases = {alias: key for key, entry in entries.items() for alias in entry["aliases"]}
+        with self._lock:
+            self._entries, self._aliases, self._version = entries, aliases, version
+
+    def _read(self) -> Dict[str, Dict[str, Any]]:
+        """Записи индекса; файл перечитывается, только если его изменил другой процесс"""
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            return self._entries
+        version = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if version == self._version:
+                return self._entries
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Не удалось прочитать индекс запросов {self.path}: {e}")
+            return self._entries
+        self._load(entries, version)
+        return entries
+
+    def _write(self, entries: Dict[str, Dict[str, Any]]) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, prefix='.queries-')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(entries, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        stat = self.path.stat()
+        self._load(entries, (stat.st_mtime_ns, stat.st_size))
+
+    @staticmethod
+    def _vectors(documents: List[List[str]]) -> List[Dict[str, float]]:
+        """TF-IDF векторы триграмм основ (нормированные)"""
+        counts = [Counter() for _ in documents]
+        for count, stems in zip(counts, documents):
+            for word in stems:
+                count.update(trigrams(word))
+        frequency = Counter(gram for count in counts for gram in count)
+        vectors = []
+        for count in counts:
+            vector = {
+                gram: tf * (math.log((1 + len(documents)) / (1 + frequency[gram])) + 1)
+                for gram, tf in count.items()
+            }
+            norm = math.sqrt(sum(weight * weight for weight in vector.values())) or 1.0
+            vectors.append({gram: weight / norm for gram, weight in vector.items()})
+        return vectors
+
+    def similar(self, entries: Dict[str, Dict[str, Any]], field: str, stems: List[str]) -> Tuple[Optional[str], float]:
+        """Ближайший известный ключ с тем же типом поля, метками, реквизитами и основами и его сходство"""
+        features = hard_features(stems)
+        candidates = [
+            key for key, entry in entries.items()
+            if entry["field"] == field and hard_features(entry["stems"]) == features
+            and aligned(stems, entry["stems"])
+        ]
+        if not candidates:
+            return None, 0.0
+        if not stems:
+            # Запрос без лишних слов совпадает только с таким же запросом
+            exact = [key for key in candidates if not entries[key]["stems"]]
+            return (exact[0], 1.0) if exact else (None, 0.0)
+        vectors = self._vectors([stems] + [entries[key]["stems"] for key in candidates])
+        best_key, best_score = None, 0.0
+        for key, vector in zip(candidates, vectors[1:]):
+            score = sum(weight * vector.get(gram, 0.0) for gram, weight in vectors[0].items())
+            if score > best_score:
+                best_key, best_score = key, score
+        return best_key, best_score
+
+    def key(self, query: str, count: bool = True) -> str:
+        """Канонический ключ запроса; новый запрос сохраняется в индексе
+
+        count=False - повторное обращение за ключом того же запроса, не
+        учитываемое в счетчиках попаданий.
+        """
+        normalized = normalize_query(query)
+        if not self.enabled:
+            return normalized
+        self._read()
+        with self._lock:
+            key = self._aliases.get(normalized)
+            if key is not None:
+                self.exact_hits += count
+                return key
+
+        field, stems = query_signature(query)
+        if not field and not stems:
+            # Запрос из одних служебных слов: ключ - сама формулировка
+            field, stems = '', [stem(word) for word in re.split(r'[\s-]+', normalized) if word]
+        with self._locked():
+            entries = dict(self._read())
+            with self._lock:
+                known = self._aliases.get(normalized)
+            if known is not None:
+                # Формулировку только что добавил другой процесс
+                with self._lock:
+                    self.exact_hits += count
+                return known
+            key, score = self.similar(entries, field, stems)
+            if key is not None and score >= self.threshold:
+                logger.info(f"Запрос '{query}' отнесен к ключу {key} (сходство {score:.2f})")
+                with self._lock:
+                    self.semantic_hits += count
+            else:
+                base = key = _slug(field, display_stems(query, stems))
+                suffix = 1
+                while key in entries and (entries[key]["field"], entries[key]["stems"]) != (field, stems):
+                    suffix += 1
+                    key = f"{base}_{suffix}"
+                entries.setdefault(key, {"field": field, "stems": stems, "aliases": []})
+                with self._lock:
+                    self.misses += count
+            entry = dict(entries[key])
+            entry["aliases"] = entry["aliases"] + [normalized]
+            entries[key] = entry
+            self._write(entries)
+        return key
+
+    def stats(self) -> Dict[str, Any]:
+        """Число ключей и доля запросов, отнесенных к уже известным ключам"""
+        keys = len(self._read())
+        with self._lock:
+            total = self.exact_hits + self.semantic_hits + self.misses
+            return {
+                "keys": keys,
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.exact_hits + self.semantic_hits) / total, 3) if total else 0.0,
+            }
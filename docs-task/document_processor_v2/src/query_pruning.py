@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Отбор части разметки, нужной для запроса, перед генерацией шаблона.
+
+Для запроса "найди ИНН продавца" ассистенту шаблонов достаточно
+окрестности якорей "ИНН/КПП" и "Продавец", а не всей страницы. Локальный
+предварительный проход:
+
+- по словам запроса определяет тип поля (ИНН, дата, сумма, ...) и
+  уточнения (продавец, покупатель) по таблице синонимов из промпта
+  шаблонов, включая типичные искажения OCR
+- ищет якоря нечетко (text_index) вместе со значимыми словами запроса
+- оставляет элементы в окрестности найденных якорей (в высотах якоря:
+  значение обычно правее или ниже метки)
+
+Если якорь типа поля не найден, найден неуверенно или окрестности
+покрывают большую часть страницы, передается вся разметка. Все вхождения
+найденных якорей сохраняются, поэтому repetition_index шаблона остается
+верным и для полной страницы; шаблон, который на полной разметке дает
+другое значение, чем на отобранной, генерируется заново по полной.
+"""
+
+import os
+import re
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Optional, Tuple, Union
+
+from .dsl_engine import DocumentIndex, TemplateEngine
+from .markup import Markup
+from .text_index import normalize_text
+
+logger = logging.getLogger(__name__)
+
+# Типы полей: основы слов запроса и якоря, которыми поле обозначается в документах
+FIELD_TYPES: Dict[str, Dict[str, List[str]]] = {
+    "inn": {
+        "query": ["инн"],
+        "anchors": ["ИНН", "ИНН/КПП", "VHH", "ЯННИКПИ"],
+    },
+    "kpp": {
+        "query": ["кпп"],
+        "anchors": ["КПП", "ИНН/КПП"],
+    },
+    "date": {
+        "query": ["дат", "число"],
+        "anchors": ["от", "дата", "Дата составления"],
+    },
+    "number": {
+        "query": ["номер", "№"],
+        "anchors": ["№", "номер", "Счет-фактура №", "УПД №"],
+    },
+    "amount": {
+        "query": ["сумм", "итог", "всего", "оплат", "стоимост"],
+        "anchors": ["Итого", "Всего", "Сумма", "Всего к оплате"],
+    },
+    "name": {
+        "query": ["наименован", "назван", "организац"],
+        "anchors": ["Наименование", "Продавец", "Покупатель"],
+    },
+}
+
+# Вид значения для типа поля: шаблон, нашедший значение другого вида, ищет не то поле
+VALUE_PATTERNS: Dict[str, str] = {
+    "inn": r"(?<!\d)(\d{10}|\d{12})(?!\d)",
+    "kpp": r"(?<!\d)\d{9}(?!\d)",
+    "date": r"\d{1,2}[./-]\d{1,2}[./-]\d{2,4}|\d{1,2}\s+[^\W\d_]+\s+\d{4}",
+    "number": r"\d",
+    "amount": r"\d[\d\s]*([.,]\d{1,2})?",
+    "name": r"[^\W\d_]{2}",
+}
+
+# Уточнения: чье значение нужно найти
+QUALIFIERS: Dict[str, Dict[str, List[str]]] = {
+    "seller": {
+        "query": ["продав", "поставщ", "грузоотправ", "исполнител"],
+        "anchors": ["Продавец", "продавца", "Поставщик", "Грузоотправитель"],
+    },
+    "buyer": {
+        "query": ["покупат", "грузополуч", "плательщ", "заказчик"],
+        "anchors": ["Покупатель", "покупателя", "Грузополучатель", "Плательщик"],
+    },
+}
+
+# Слова запроса, не обозначающие поле
+STOP_WORDS = {
+    "найди", "найти", "извлеки", "извлечь", "получи", "покажи", "укажи", "выведи", "определи",
+    "нужен", "нужна", "нужно", "какой", "какая", "значение", "поле", "документа",
+}
+
+# Окрестность якоря в его высотах: (влево, вверх, вправо, вниз)
+NEIGHBOURHOOD = (2.0, 2.0, 30.0, 6.0)
+
+# Пороги сходства якорей: тип поля и уточнения, слова запроса
+ANCHOR_THRESHOLD = 0.8
+WORD_THRESHOLD = 0.7
+
+
+def _stems(stems: List[str]) -> List[str]:
+    return [normalize_text(stem) for stem in stems]
+
+
+def _matches(words: List[str], stems: List[str]) -> bool:
+    return any(word.startswith(stem) for word in words for stem in _stems(stems))
+
+
+def query_words(query: str) -> List[str]:
+    """Слова запроса после нормализации, без кавычек и разделителей"""
+    return re.findall(r'[\w№-]+', normalize_text(query))
+
+
+def query_fields(query: str, min_length: int = 4) -> Tuple[List[str], List[str], List[str]]:
+    """Типы поля (FIELD_TYPES), уточнения (QUALIFIERS) и остальные значимые слова запроса"""
+    words = query_words(query)
+    stop_words = set(_stems(sorted(STOP_WORDS)))
+    found: Tuple[List[str], List[str]] = ([], [])
+    known: List[str] = []
+    for table, target in zip((FIELD_TYPES, QUALIFIERS), found):
+        for name, entry in table.items():
+            if _matches(words, entry["query"]):
+                target.append(name)
+                known.extend(_stems(entry["query"]))
+    extra = [
+        word for word in words
+        if len(word) >= min_length and word not in stop_words and not any(word.startswith(stem) for stem in known)
+    ]
+    return found[0], found[1], extra
+
+
+def value_matches(query: str, value: str) -> bool:
+    """Значение подходит по виду к одному из типов поля запроса; True, если тип неизвестен"""
+    field_types = query_fields(query)[0]
+    if not field_types:
+        return True
+    return any(re.search(VALUE_PATTERNS[name], value) for name in field_types)
+
+
+def query_terms(query: str) -> Tuple[List[str], List[str], List[str]]:
+    """Якоря типа поля, якоря уточнений и значимые слова запроса"""
+    field_types, qualifiers, extra = query_fields(query)
+    field_anchors: List[str] = []
+    qualifier_anchors: List[str] = []
+    for names, table, target in ((field_types, FIELD_TYPES, field_anchors), (qualifiers, QUALIFIERS, qualifier_anchors)):
+        for name in names:
+            target.extend(anchor for anchor in table[name]["anchors"] if anchor not in target)
+    return field_anchors, qualifier_anchors, extra
+
+
+@dataclass
+class PruneResult:
+    """Разметка для промпта и сведения об отборе"""
+    markup: Union[Dict[str, Any], Markup]
+    pruned: bool
+    kept: int
+    total: int
+    confidence: float
+    anchors: List[str] = field(default_factory=list)
+    document: Optional[DocumentIndex] = None
+    _pruned_document: Optional[DocumentIndex] = field(default=None, repr=False)
+
+    @property
+    def pruned_document(self) -> DocumentIndex:
+        """Индекс отобранной разметки; строится один раз для всех проверяемых шаблонов"""
+        if self._pruned_document is None:
+            self._pruned_document = DocumentIndex(self.markup)
+        return self._pruned_document
+
+
+class MarkupPruner:
+    """Отбор окрестности якорей запроса в разметке"""
+
+    def __init__(self, enabled: bool = True, min_confidence: float = ANCHOR_THRESHOLD,
+                 max_share: float = 0.7, neighbourhood: Tuple[float, float, float, float] = NEIGHBOURHOOD):
+        self.enabled = enabled
+        self.min_confidence = min_confidence
+        self.max_share = max_share
+        self.neighbourhood = neighbourhood
+
+    @classmethod
+    def from_env(cls) -> "MarkupPruner":
+        """Параметры из PROMPT_PRUNING, PROMPT_PRUNING_MIN_SCORE и PROMPT_PRUNING_MAX_SHARE"""
+        return cls(
+            enabled=os.getenv('PROMPT_PRUNING', 'true').lower() == 'true',
+            min_confidence=float(os.getenv('PROMPT_PRUNING_MIN_SCORE', ANCHOR_THRESHOLD)),
+            max_share=float(os.getenv('PROMPT_PRUNING_MAX_SHARE', 0.7)),
+        )
+
+    @property
+    def signature(self) -> str:
+        """Параметры, от которых зависит текст промпта, для ключа кэша шаблонов"""
+        if not self.enabled:
+            return ""
+        area = ','.join(f"{value:g}" for value in self.neighbourhood)
+        return f"prune:{self.min_confidence:g}:{self.max_share:g}:{area}"
+
+    def area(self, box: Tuple[float, float, float, float]) -> Tuple[float, float, float, float]:
+        """Окрестность якоря"""
+        left, top, right, bottom = self.neighbourhood
+        height = max(box[3] - box[1], 1.0)
+        return box[0] - left * height, box[1] - top * height, box[2] + right * height, box[3] + bottom * height
+
+    def prune(self, markup: Union[Dict[str, Any], Markup], queries: List[str],
+              document: Optional[DocumentIndex] = None) -> PruneResult:
+        """Окрестности якорей всех запросов; вся разметка, если отбор ненадежен
+
+        document - уже построенный индекс этой разметки, если он есть.
+        """
+        compact = document.markup if document is not None else Markup.coerce(markup)
+        total = len(compact)
+        if not self.enabled or not total:
+            return PruneResult(markup, False, total, total, 0.0, document=document)
+
+        if document is None:
+            document = DocumentIndex(compact)
+        selected = set()
+        anchors: List[str] = []
+        confidence = 1.0
+        for query in queries:
+            field_anchors, qualifier_anchors, words = query_terms(query)
+            # Уверенность запроса - лучший якорь типа поля, а если тип неизвестен - уточнения или слова запроса
+            best = 0.0
+            terms = [(anchor, ANCHOR_THRESHOLD, True) for anchor in field_anchors]
+            terms += [(anchor, ANCHOR_THRESHOLD, not field_anchors) for anchor in qualifier_anchors]
+            terms += [(word, WORD_THRESHOLD, not field_anchors) for word in words]
+            for text, threshold, decisive in terms:
+                matches = document.find_anchor(text, threshold)
+                if not matches:
+                    continue
+                anchors.append(text)
+                for items, score, box in matches:
+                    if decisive:
+                        best = max(best, score)
+                    selected.update(items)
+                    selected.update(document.spatial.query(self.area(box)))
+            confidence = min(confidence, best)
+
+        share = len(selected) / total
+        if confidence < self.min_confidence or share > self.max_share:
+            logger.info(
+                f"Отбор разметки для {queries} ненадежен (уверенность {confidence:.2f}, "
+                f"доля {share:.2f}), передается вся разметка"
+            )
+            return PruneResult(markup, False, total, total, confidence, anchors, document)
+
+        kept = sorted(selected)
+        pruned = {"text_items": [compact.item_dict(index) for index in kept], **compact.meta}
+        logger.info(f"Разметка для {queries}: {len(kept)} из {total} элементов, якоря {anchors}")
+        return PruneResult(pruned, True, len(kept), total, confidence, anchors, document)
+
+    @staticmethod
+    def consistent(template: str, result: PruneResult) -> bool:
+        """Шаблон дает на полной разметке то же непустое значение, что и на отобранной"""
+        try:
+            engine = TemplateEngine(template)
+            value = engine.apply(result.pruned_document)["value"]
+            return value is not None and engine.apply(result.document)["value"] == value
+        except Exception as e:
+            logger.warning(f"Не удалось проверить шаблон на полной разметке: {e}")
+            return False
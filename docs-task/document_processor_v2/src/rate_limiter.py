@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Клиентский планировщик запросов к OpenAI API с учетом квот.
+
+Каждый HTTP запрос общего транспорта (http_pool) проходит через RateLimiter:
+
+- два токен-бакета: запросы в минуту (OPENAI_RPM) и токены в минуту
+  (OPENAI_TPM); токены списываются при создании запуска по оценке,
+  переданной через request_budget
+- классы приоритета: запросы INTERACTIVE (/analyze) получают квоту раньше
+  DEFAULT и BULK (пакетная обработка), внутри класса - в порядке очереди
+- ответ 429 с Retry-After приостанавливает выдачу квоты всем ожидающим,
+  а заголовки x-ratelimit-remaining-* не дают бакетам обогнать сервер
+
+Если квоты не заданы, планировщик пропускает запросы без ожидания.
+"""
+
+import os
+import math
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, Callable, List, Tuple, Mapping
+
+logger = logging.getLogger(__name__)
+
+# Классы приоритета: меньшее значение обслуживается раньше
+INTERACTIVE = 0
+DEFAULT = 1
+BULK = 2
+
+PRIORITY_NAMES = {INTERACTIVE: "interactive", DEFAULT: "default", BULK: "bulk"}
+
+# Грубая оценка: символов на токен для смеси русского текста и JSON
+CHARS_PER_TOKEN = 3
+# Оценка стоимости изображения и ответа ассистента разметки, токенов
+IMAGE_TOKENS = 1500
+MARKUP_OUTPUT_TOKENS = 4000
+# Оценка длины ответа ассистента шаблонов на один запрос, токенов
+TEMPLATE_OUTPUT_TOKENS = 800
+
+_priority: contextvars.ContextVar[int] = contextvars.ContextVar("openai_priority", default=DEFAULT)
+_tokens: contextvars.ContextVar[int] = contextvars.ContextVar("openai_tokens", default=0)
+
+
+def estimate_tokens(text: str) -> int:
+    """Оценка числа токенов текста"""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+@contextmanager
+def request_priority(priority: int):
+    """Класс приоритета для запросов, выполняемых внутри блока"""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+@contextmanager
+def request_budget(tokens: int):
+    """Оценка токенов, списываемая при создании запуска внутри блока"""
+    token = _tokens.set(tokens)
+    try:
+        yield
+    finally:
+        _tokens.reset(token)
+
+
+def current_priority() -> int:
+    return _priority.get()
+
+
+def current_tokens() -> int:
+    return _tokens.get()
+
+
+def consumes_tokens(method: str, path: str) -> bool:
+    """Запрос, за который модель тратит токены: создание запуска"""
+    return method == "POST" and path.rstrip('/').endswith('/runs')
+
+
+def retry_after_seconds(headers: Mapping[str, str]) -> Optional[float]:
+    """Пауза из заголовков retry-after-ms или retry-after"""
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return None
+
+
+class TokenBucket:
+    """Токен-бакет с непрерывным пополнением
+
+    Емкость ограничивает всплеск (по умолчанию 5 секунд квоты). Запрос
+    дороже емкости ждет полного бакета и уводит его в минус, поэтому
+    средняя скорость не превышает квоту.
+    """
+
+    def __init__(self, per_minute: float, burst_seconds: float = 5.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.rate = per_minute / 60.0
+        self.capacity = max(self.rate * burst_seconds, 1.0)
+        self.level = self.capacity
+        self.clock = clock
+        self.updated = clock()
+
+    def _refill(self) -> None:
+        now = self.clock()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Время до момента, когда можно списать amount"""
+        self._refill()
+        needed = min(amount, self.capacity)
+        if self.level >= needed:
+            return 0.0
+        return (needed - self.level) / self.rate
+
+    def consume(self, amount: float) -> None:
+        self._refill()
+        self.level -= amount
+
+    def limit(self, remaining: float) -> None:
+        """Синхронизация с остатком, который сообщил сервер"""
+        self._refill()
+        self.level = min(self.level, remaining)
+
+
+class RateLimiter:
+    """Очередь с приоритетами над бакетами запросов и токенов"""
+
+    def __init__(self, requests_per_minute: Optional[float] = None,
+                 tokens_per_minute: Optional[float] = None, burst_seconds: float = 5.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self.requests = TokenBucket(requests_per_minute, burst_seconds, clock) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute, burst_seconds, clock) if tokens_per_minute else None
+        self.blocked_until = 0.0
+        self._queue: List[Tuple[int, int]] = []
+        self._cancelled: set = set()
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self.granted: Dict[str, int] = {name: 0 for name in PRIORITY_NAMES.values()}
+        self.waited: Dict[str, float] = {name: 0.0 for name in PRIORITY_NAMES.values()}
+        self.throttled = 0
+
+    @classmethod
+    def from_env(cls) -> "RateLimiter":
+        """Квоты из OPENAI_RPM и OPENAI_TPM (0 или пусто - без ограничения)"""
+        rpm = float(os.getenv('OPENAI_RPM') or 0)
+        tpm = float(os.getenv('OPENAI_TPM') or 0)
+        burst = float(os.getenv('OPENAI_RATE_BURST', 5.0))
+        return cls(rpm or None, tpm or None, burst)
+
+    @property
+    def enabled(self) -> bool:
+        return self.requests is not None or self.tokens is not None
+
+    def _head(self) -> Optional[Tuple[int, int]]:
+        while self._queue and self._queue[0] in self._cancelled:
+            self._cancelled.discard(heapq.heappop(self._queue))
+        return self._queue[0] if self._queue else None
+
+    def _enqueue(self, priority: int) -> Tuple[int, int]:
+        ticket = (priority, next(self._sequence))
+        heapq.heappush(self._queue, ticket)
+        return ticket
+
+    def _try_acquire(self, ticket: Tuple[int, int], tokens: int) -> Optional[float]:
+        """0 - квота выдана; >0 - время ожидания; None - впереди другие запросы"""
+        if self._head() != ticket:
+            return None
+        now = self.clock()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.wait_time(1))
+        if self.tokens is not None and tokens:
+            wait = max(wait, self.tokens.wait_time(tokens))
+        if wait > 0:
+            return wait
+        if self.requests is not None:
+            self.requests.consume(1)
+        if self.tokens is not None and tokens:
+            self.tokens.consume(tokens)
+        heapq.heappop(self._queue)
+        self._condition.notify_all()
+        return 0.0
+
+    def _record(self, priority: int, waited: float) -> None:
+        name = PRIORITY_NAMES.get(priority, str(priority))
+        self.granted[name] = self.granted.get(name, 0) + 1
+        self.waited[name] = self.waited.get(name, 0.0) + waited
+
+    def acquire(self, tokens: int = 0, priority: int = DEFAULT) -> float:
+        """Ожидание квоты на один запрос; возвращает время ожидания"""
+        if not self.enabled:
+            return 0.0
+        started = self.clock()
+        with self._condition:
+            ticket = self._enqueue(priority)
+            try:
+                while True:
+                    wait = self._try_acquire(ticket, tokens)
+                    if wait == 0:
+                        break
+                    self._condition.wait(0.05 if wait is None else wait)
+            except BaseException:
+                self._cancelled.add(ticket)
+                raise
+            waited = self.clock() - started
+            self._record(priority, waited)
+        return waited
+
+    async def aacquire(self, tokens: int = 0, priority: int = DEFAULT) -> float:
+        """Асинхронное ожидание квоты на один запрос"""
+        if not self.enabled:
+            return 0.0
+        started = self.clock()
+        with self._condition:
+            ticket = self._enqueue(priority)
+        try:
+            while True:
+                with self._condition:
+                    wait = self._try_acquire(ticket, tokens)
+                if wait == 0:
+                    break
+                await asyncio.sleep(0.01 if wait is None else wait)
+        except BaseException:
+            with self._condition:
+                self._cancelled.add(ticket)
+            raise
+        waited = self.clock() - started
+        with self._condition:
+            self._record(priority, waited)
+        return waited
+
+    def observe(self, status_code: int, headers: Mapping[str, str]) -> None:
+        """Учет ответа: Retry-After при 429 и остатки квот из заголовков"""
+        with self._condition:
+            if status_code == 429:
+                self.throttled += 1
+                pause = retry_after_seconds(headers) or 1.0
+                self.blocked_until = max(self.blocked_until, self.clock() + pause)
+                logger.warning(f"Получен ответ 429, выдача квоты приостановлена на {pause:.1f} с")
+            for header, bucket in (
+                ("x-ratelimit-remaining-requests", self.requests),
+                ("x-ratelimit-remaining-tokens", self.tokens),
+            ):
+                value = headers.get(header)
+                if bucket is not None and value is not None:
+                    try:
+                        bucket.limit(float(value))
+                    except ValueError:
+                        pass
+
+    def stats(self) -> Dict[str, Any]:
+        """Выданные квоты и суммарное ожидание по классам приоритета"""
+        with self._condition:
+            return {
+                "enabled": self.enabled,
+                "granted": dict(self.granted),
+                "waited_seconds": {name: round(value, 3) for name, value in self.waited.items()},
+                "throttled": self.throttled,
+                "queued": len(self._queue) - len(self._cancelled),
+            }
+
+
+_shared: Optional[RateLimiter] = None
+_shared_lock = threading.Lock()
+
+
+def shared_limiter() -> RateLimiter:
+    """Планировщик, общий для процесса"""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = RateLimiter.from_env()
+        return _shared
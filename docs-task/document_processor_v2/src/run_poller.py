@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Ожидание завершения запусков ассистентов.
+
+Два режима:
+- опрос runs.retrieve с адаптивным интервалом: пока запуск в очереди,
+  опрос идет реже; после смены статуса интервал сбрасывается к минимальному
+  и растет экспоненциально со случайным разбросом; если известна типичная
+  длительность запусков (RunDurations), первые опросы пропускаются до ее
+  большей части; общее ожидание ограничено сроком (deadline)
+- потоковые события запуска (runs.create(stream=True)): завершение видно
+  сразу по событию thread.run.completed, без опроса
+
+Временные ошибки API повторяются внутри того же цикла ожидания, не начиная
+его заново. Исход запуска, время в очереди и токены попадают в метрики
+(metrics.record_run).
+"""
+
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Callable, Awaitable, Iterable, AsyncIterable
+
+import openai
+
+from .metrics import record_run
+
+logger = logging.getLogger(__name__)
+
+FAILED_STATUSES = ("failed", "cancelled", "expired", "requires_action")
+
+# Ошибки, после которых опрос продолжается
+TRANSIENT_ERRORS = (
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+
+class RunFailedError(RuntimeError):
+    """Запуск завершился неуспешно"""
+
+    def __init__(self, run_id: Optional[str], status: str, detail: Optional[str] = None):
+        message = f"Выполнение завершилось с ошибкой: {status}"
+        if detail:
+            message = f"{message} ({detail})"
+        super().__init__(message)
+        self.run_id = run_id
+        self.status = status
+
+
+class RunTimeoutError(TimeoutError):
+    """Запуск не завершился за отведенное время"""
+
+
+@dataclass
+class PollPolicy:
+    """Параметры адаптивного опроса"""
+    initial_delay: float = 0.25  # первый интервал после смены статуса, сек
+    queued_delay: float = 0.5    # первый интервал, пока запуск в очереди, сек
+    multiplier: float = 1.4      # рост интервала при неизменном статусе
+    max_delay: float = 2.0       # верхняя граница интервала, сек
+    jitter: float = 0.2          # относительный случайный разброс интервала
+    deadline: float = 600.0      # предельное время ожидания запуска, сек
+    max_errors: int = 3          # временных ошибок API подряд до отказа
+    expected_fraction: float = 0.8  # доля ожидаемой длительности, которую можно не опрашивать
+
+    @classmethod
+    def from_env(cls) -> "PollPolicy":
+        """Параметры из RUN_POLL_MAX_DELAY и RUN_DEADLINE"""
+        return cls(
+            max_delay=float(os.getenv('RUN_POLL_MAX_DELAY', cls.max_delay)),
+            deadline=float(os.getenv('RUN_DEADLINE', cls.deadline)),
+        )
+
+    def delay(self, status: str, attempt: int) -> float:
+        """Интервал перед следующим опросом"""
+        base = self.queued_delay if status == "queued" else self.initial_delay
+        delay = min(base * self.multiplier ** attempt, self.max_delay)
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+def streaming_enabled() -> bool:
+    """Включен ли режим потоковых событий (RUN_STREAMING)"""
+    return os.getenv('RUN_STREAMING', 'false').lower() == 'true'
+
+
+def run_error_detail(run: Any) -> Optional[str]:
+    last_error = getattr(run, "last_error", None)
+    return getattr(last_error, "message", None) if last_error else None
+
+
+class RunDurations:
+    """Скользящая оценка длительности запусков по ключу (например, ассистенту)"""
+
+    def __init__(self, alpha: float = 0.3):
+        self.alpha = alpha
+        self._values: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def expected(self, key: str) -> Optional[float]:
+        with self._lock:
+            return self._values.get(key)
+
+    def record(self, key: str, duration: float) -> None:
+        with self._lock:
+            previous = self._values.get(key)
+            self._values[key] = duration if previous is None else (
+                previous + self.alpha * (duration - previous)
+            )
+
+
+class RunWaiter:
+    """Состояние ожидания одного запуска, общее для синхронного и async кода"""
+
+    def __init__(self, run_id: Optional[str], policy: Optional[PollPolicy] = None,
+                 expected: Optional[float] = None, clock: Callable[[], float] = time.monotonic):
+        self.run_id = run_id
+        self.policy = policy or PollPolicy()
+        self.expected = expected
+        self.clock = clock
+        self.started = clock()
+        self.status: Optional[str] = None
+        self.attempt = 0
+        self.errors = 0
+        self.polls = 0
+        # Ожидание до первого статуса после queued (время в очереди)
+        self.queued: Optional[float] = None
+
+    def elapsed(self) -> float:
+        return self.clock() - self.started
+
+    def remaining(self) -> float:
+        return self.policy.deadline - (self.clock() - self.started)
+
+    def _seen(self, run: Any) -> None:
+        """Учет смены статуса: конец очереди и метрики завершенного запуска"""
+        if self.queued is None and self.status == "queued" and run.status != "queued":
+            self.queued = self.elapsed()
+        if run.status == "completed" or run.status in FAILED_STATUSES:
+            # Если переход из queued не наблюдался, время в очереди оценивается по started_at
+            record_run(run, self.queued, self.elapsed())
+
+    def _bounded(self, delay: float) -> float:
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise RunTimeoutError(
+                f"Запуск {self.run_id} не завершился за {self.policy.deadline:.0f} с (статус: {self.status})"
+            )
+        return min(delay, remaining)
+
+    def observe(self, run: Any) -> Optional[float]:
+        """Обработка статуса: None, если запуск завершен, иначе пауза до опроса"""
+        self.polls += 1
+        self.errors = 0
+        self._seen(run)
+        if run.status == "completed":
+            logger.info(f"Запуск {run.id} завершен за {self.elapsed():.2f} с, опросов: {self.polls}")
+            return None
+        if run.status in FAILED_STATUSES:
+            raise RunFailedError(run.id, run.status, run_error_detail(run))
+        if run.status != self.status:
+            self.status, self.attempt = run.status, 0
+        else:
+            self.attempt += 1
+        if self.expected:
+            # До большей части типичной длительности запуск почти наверняка не завершится
+            skip = self.expected * self.policy.expected_fraction - self.elapsed()
+            if skip > self.policy.initial_delay:
+                return self._bounded(skip)
+        return self._bounded(self.policy.delay(self.status, self.attempt))
+
+    def failed(self, error: Exception) -> float:
+        """Обработка ошибки опроса: пауза перед повтором или исключение"""
+        if not isinstance(error, TRANSIENT_ERRORS):
+            raise error
+        self.errors += 1
+        if self.errors > self.policy.max_errors:
+            raise error
+        logger.warning(f"Попытка {self.errors} из {self.policy.max_errors} не удалась: {error}")
+        return self._bounded(self.policy.delay("queued", self.errors))
+
+    def event(self, event: Any) -> Optional[Any]:
+        """Обработка потокового события: запуск, если он завершен, иначе None"""
+        self._bounded(0)
+        name = getattr(event, "event", "")
+        if not name.startswith("thread.run.") or name.startswith("thread.run.step"):
+            return None
+        run = event.data
+        self._seen(run)
+        self.run_id, self.status = run.id, run.status
+        if name == "thread.run.completed":
+            logger.info(f"Запуск {run.id} завершен за {self.elapsed():.2f} с (поток событий)")
+            return run
+        if run.status in FAILED_STATUSES:
+            raise RunFailedError(run.id, run.status, run_error_detail(run))
+        return None
+
+
+def _wait(waiter: RunWaiter, retrieve: Callable[[], Any]) -> float:
+    while True:
+        try:
+            delay = waiter.observe(retrieve())
+        except TRANSIENT_ERRORS as e:
+            delay = waiter.failed(e)
+        if delay is None:
+            return waiter.elapsed()
+        time.sleep(delay)
+
+
+async def _await(waiter: RunWaiter, retrieve: Callable[[], Awaitable[Any]]) -> float:
+    while True:
+        try:
+            delay = waiter.observe(await retrieve())
+        except TRANSIENT_ERRORS as e:
+            delay = waiter.failed(e)
+        if delay is None:
+            return waiter.elapsed()
+        await asyncio.sleep(delay)
+
+
+def poll_run(retrieve: Callable[[], Any], run_id: Optional[str] = None,
+             policy: Optional[PollPolicy] = None, expected: Optional[float] = None) -> float:
+    """Опрос запуска до завершения; возвращает время ожидания, сек"""
+    return _wait(RunWaiter(run_id, policy, expected), retrieve)
+
+
+async def apoll_run(retrieve: Callable[[], Awaitable[Any]], run_id: Optional[str] = None,
+                    policy: Optional[PollPolicy] = None, expected: Optional[float] = None) -> float:
+    """Асинхронный опрос запуска до завершения; возвращает время ожидания, сек"""
+    return await _await(RunWaiter(run_id, policy, expected), retrieve)
+
+
+def stream_run(events: Iterable[Any], retrieve: Callable[[str], Any],
+               policy: Optional[PollPolicy] = None, expected: Optional[float] = None) -> str:
+    """Ожидание запуска по потоку событий; возвращает ID запуска
+
+    Если поток оборвался до финального события, ожидание продолжается опросом
+    в пределах того же срока (deadline), отсчитанного от начала потока.
+    """
+    waiter = RunWaiter(None, policy, expected)
+    try:
+        for event in events:
+            run = waiter.event(event)
+            if run is not None:
+                return run.id
+    except TRANSIENT_ERRORS as e:
+        if waiter.run_id is None:
+            raise
+        logger.warning(f"Поток событий запуска {waiter.run_id} прерван: {e}")
+    if waiter.run_id is None:
+        raise RuntimeError("Поток событий завершился до создания запуска")
+    run_id = waiter.run_id
+    _wait(waiter, lambda: retrieve(run_id))
+    return run_id
+
+
+async def astream_run(events: AsyncIterable[Any], retrieve: Callable[[str], Awaitable[Any]],
+                      policy: Optional[PollPolicy] = None, expected: Optional[float] = None) -> str:
+    """Асинхронное ожидание запуска по потоку событий; возвращает ID запуска"""
+    waiter = RunWaiter(None, policy, expected)
+    try:
+        async for event in events:
+            run = waiter.event(event)
+            if run is not None:
+                return run.id
+    except TRANSIENT_ERRORS as e:
+        if waiter.run_id is None:
+            raise
+        logger.warning(f"Поток событий запуска {waiter.run_id} прерван: {e}")
+    if waiter.run_id is None:
+        raise RuntimeError("Поток событий завершился до создания запуска")
+    run_id = waiter.run_id
+    await _await(waiter, lambda: retrieve(run_id))
+    return run_id
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+import json
+import math
+import hashlib
+from collections import defaultdict
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+Box = Tuple[float, float, float, float]
+
+DIRECTIONS = ("top", "right", "bottom", "left")
+
+# Версия формата сериализованного индекса
+INDEX_VERSION = 2
+
+
+def boxes_digest(boxes: Sequence[Box]) -> str:
+    """Хэш координат элементов: индекс подходит только к разметке с теми же bbox"""
+    payload = json.dumps([list(box) for box in boxes], separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class SpatialIndex:
+    """Пространственный индекс над bbox элементов разметки
+
+    Равномерная сетка отвечает на запрос "элементы, пересекающие прямоугольник",
+    просматривая только ячейки этого прямоугольника. Граф ближайших соседей по
+    направлениям (top/right/bottom/left) строится один раз и сохраняется в кэше
+    рядом с разметкой.
+    """
+
+    def __init__(self, boxes: Sequence[Box], cell_size: Optional[float] = None,
+                 neighbours: Optional[Dict[str, List[int]]] = None):
+        self.boxes = list(boxes)
+        self.cell_size = cell_size or self._default_cell_size(self.boxes)
+        self.grid: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+        for index, box in enumerate(self.boxes):
+            for cell in self._cells(box):
+                self.grid[cell].append(index)
+        if self.boxes:
+            self.max_col = max(cell[0] for cell in self.grid)
+            self.max_row = max(cell[1] for cell in self.grid)
+            self.min_col = min(cell[0] for cell in self.grid)
+            self.min_row = min(cell[1] for cell in self.grid)
+        else:
+            self.max_col = self.max_row = self.min_col = self.min_row = 0
+        self.neighbours = neighbours or self._build_neighbours()
+
+    @staticmethod
+    def _default_cell_size(boxes: Sequence[Box]) -> float:
+        """Размер ячейки: четыре медианные высоты строки"""
+        if not boxes:
+            return 1.0
+        heights = sorted(max(box[3] - box[1], 1.0) for box in boxes)
+        return heights[len(heights) // 2] * 4
+
+    def _cell_range(self, box: Box) -> Tuple[int, int, int, int]:
+        size = self.cell_size
+        return (
+            math.floor(box[0] / size), math.floor(box[1] / size),
+            math.floor(box[2] / size), math.floor(box[3] / size),
+        )
+
+    def _cells(self, box: Box):
+        col1, row1, col2, row2 = self._cell_range(box)
+        for col in range(col1, col2 + 1):
+            for row in range(row1, row2 + 1):
+                yield col, row
+
+    def query(self, area: Box) -> List[int]:
+        """Элементы, пересекающиеся с прямоугольником"""
+        col1, row1, col2, row2 = self._cell_range(area)
+        col1, row1 = max(col1, self.min_col), max(row1, self.min_row)
+        col2, row2 = min(col2, self.max_col), min(row2, self.max_row)
+        found = set()
+        for col in range(col1, col2 + 1):
+            for row in range(row1, row2 + 1):
+                found.update(self.grid.get((col, row), ()))
+        x1, y1, x2, y2 = area
+        return sorted(
+            index for index in found
+            if self.boxes[index][0] < x2 and self.boxes[index][2] > x1
+            and self.boxes[index][1] < y2 and self.boxes[index][3] > y1
+        )
+
+    def nearest(self, index: int, direction: str) -> Optional[int]:
+        """Ближайший элемент в направлении top/right/bottom/left"""
+        neighbour = self.neighbours[direction][index]
+        return neighbour if neighbour >= 0 else None
+
+    def _build_neighbours(self) -> Dict[str, List[int]]:
+        return {
+            direction: [self._search(index, direction) for index in range(len(self.boxes))]
+            for direction in DIRECTIONS
+        }
+
+    def _search(self, index: int, direction: str) -> int:
+        """Поиск ближайшего соседа, расширяясь от элемента по полосе ячеек"""
+        x1, y1, x2, y2 = self.boxes[index]
+        tolerance = (y2 - y1) * 0.25
+        col1, row1, col2, row2 = self._cell_range(self.boxes[index])
+        horizontal = direction in ("left", "right")
+
+        if direction == "right":
+            steps = range(col2, self.max_col + 1)
+        elif direction == "left":
+            steps = range(col1, self.min_col - 1, -1)
+        elif direction == "bottom":
+            steps = range(row2, self.max_row + 1)
+        else:
+            steps = range(row1, self.min_row - 1, -1)
+
+        best, best_gap = -1, None
+        for step in steps:
+            # Ячейки дальше найденного соседа уже не могут дать меньший зазор
+            if best_gap is not None:
+                if direction == "right":
+                    edge = step * self.cell_size - x2
+                elif direction == "left":
+                    edge = x1 - (step + 1) * self.cell_size
+                elif direction == "bottom":
+                    edge = step * self.cell_size - y2
+                else:
+                    edge = y1 - (step + 1) * self.cell_size
+                if edge > best_gap:
+                    break
+
+            cells = (
+                ((step, row) for row in range(row1, row2 + 1)) if horizontal
+                else ((col, step) for col in range(col1, col2 + 1))
+            )
+            for cell in cells:
+                for other in self.grid.get(cell, ()):
+                    if other == index:
+                        continue
+                    ox1, oy1, ox2, oy2 = self.boxes[other]
+                    if horizontal and (oy1 >= y2 or oy2 <= y1):
+                        continue
+                    if not horizontal and (ox1 >= x2 or ox2 <= x1):
+                        continue
+                    if direction == "right" and ox1 >= x2 - tolerance:
+                        gap = ox1 - x2
+                    elif direction == "left" and ox2 <= x1 + tolerance:
+                        gap = x1 - ox2
+                    elif direction == "bottom" and oy1 >= y2 - tolerance:
+                        gap = oy1 - y2
+                    elif direction == "top" and oy2 <= y1 + tolerance:
+                        gap = y1 - oy2
+                    else:
+                        continue
+                    if best_gap is None or gap < best_gap or (gap == best_gap and other < best):
+                        best, best_gap = other, gap
+        return best
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Сериализация для хранения в кэше разметки"""
+        return {
+            "version": INDEX_VERSION,
+            "size": len(self.boxes),
+            "boxes": boxes_digest(self.boxes),
+            "cell_size": self.cell_size,
+            "neighbours": self.neighbours,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], boxes: Sequence[Box]) -> Optional["SpatialIndex"]:
+        """Восстановление индекса; None, если данные не подходят к разметке"""
+        if data.get("version") != INDEX_VERSION or data.get("size") != len(boxes):
+            return None
+        # Разметка могла быть вытеснена и сгенерирована заново с другими bbox
+        if data.get("boxes") != boxes_digest(boxes):
+            return None
+        return cls(boxes, cell_size=data["cell_size"], neighbours=data["neighbours"])
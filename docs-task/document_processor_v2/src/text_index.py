@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Нечеткий поиск якорей в тексте разметки.
+
+Сходство якоря с текстом: 1 - d / max(len), где d - расстояние Левенштейна
+после нормализации (регистр, ё/й, латинские буквы, похожие на кириллические:
+"VHH/KNN" -> "инн/кпп"). Текст элемента сравнивается окнами из стольких же
+слов, сколько в якоре, поэтому "ИНН/КПП" находится в "ИНН/КПП 7707083893/770701001".
+
+Кандидаты отбираются по триграммному инвертированному индексу: при пороге t
+допустимо не больше k = (1 - t) * len / t правок, а каждая правка разрушает
+не больше трех триграмм якоря. Окна, разделяющие с якорем меньше триграмм,
+гарантированно ниже порога, поэтому отбор не теряет совпадений.
+"""
+
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple, Callable, Sequence
+
+# Латинские буквы, которые OCR путает с кириллическими (после lower), и ё/й.
+# Цифры не приводятся: значения (ИНН, даты, суммы) состоят из цифр, и замена
+# 0/3 на О/З смешала бы их с текстом; путаницу 0/О и 3/З в значениях
+# учитывают регулярные выражения шаблонов ("[ОЗ0-9]").
+CONFUSABLES = str.maketrans({
+    'a': 'а', 'b': 'в', 'c': 'с', 'e': 'е', 'h': 'н', 'k': 'к', 'm': 'м',
+    'n': 'п', 'o': 'о', 'p': 'р', 'r': 'г', 't': 'т', 'u': 'и', 'v': 'и',
+    'x': 'х', 'y': 'у', 'ё': 'е', 'й': 'и',
+})
+
+GRAM_SIZE = 3
+
+Window = Tuple[int, ...]
+
+
+def normalize_text(text: str) -> str:
+    """Нормализация текста для сравнения с якорем"""
+    return ' '.join(text.lower().translate(CONFUSABLES).split())
+
+
+def trigrams(text: str) -> Dict[str, int]:
+    """Триграммы строки с краевыми заполнителями и их кратность"""
+    padded = f"\x02\x02{text}\x03\x03"
+    grams: Dict[str, int] = defaultdict(int)
+    for start in range(len(padded) - GRAM_SIZE + 1):
+        grams[padded[start:start + GRAM_SIZE]] += 1
+    return grams
+
+
+def levenshtein(a: str, b: str, limit: Optional[int] = None) -> int:
+    """Расстояние Левенштейна; при превышении limit возвращается limit + 1"""
+    if len(a) < len(b):
+        a, b = b, a
+    if limit is not None and len(a) - len(b) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b),
+            ))
+        if limit is not None and min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def max_edits(length: int, threshold: float) -> int:
+    """Наибольшее число правок, при котором сходство еще может достичь порога"""
+    if threshold <= 0:
+        return length * 2 + 1
+    return int((1 - threshold) * length / threshold + 1e-9)
+
+
+def windows(words: Sequence[str], width: int) -> List[str]:
+    """Последовательности из width слов; короткий текст сравнивается целиком"""
+    if len(words) <= width:
+        return [' '.join(words)] if words else []
+    return [' '.join(words[start:start + width]) for start in range(len(words) - width + 1)]
+
+
+def text_similarity(anchor: str, text: str) -> float:
+    """Сходство якоря с текстом элемента (0..1) без индекса"""
+    anchor = normalize_text(anchor)
+    if not anchor:
+        return 0.0
+    best = 0.0
+    for window in windows(normalize_text(text).split(), len(anchor.split())):
+        distance = levenshtein(anchor, window)
+        best = max(best, 1 - distance / max(len(anchor), len(window)))
+    return best
+
+
+class WindowIndex:
+    """Триграммный индекс окон одной ширины"""
+
+    def __init__(self):
+        self.texts: List[str] = []
+        self.owners: List[Window] = []
+        self.postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        self.by_length: Dict[int, List[int]] = defaultdict(list)
+        self._ids: Dict[str, int] = {}
+        self._owners: List[List[Window]] = []
+
+    def add(self, text: str, owner: Window) -> None:
+        window_id = self._ids.get(text)
+        if window_id is None:
+            # Одинаковые окна (частые слова) хранятся и проверяются один раз
+            window_id = self._ids[text] = len(self.texts)
+            self.texts.append(text)
+            self._owners.append([])
+            self.by_length[len(text)].append(window_id)
+            for gram, count in trigrams(text).items():
+                self.postings[gram].append((window_id, count))
+        self._owners[window_id].append(owner)
+
+    def search(self, anchor: str, threshold: float) -> List[Tuple[Window, float]]:
+        """Владельцы окон со сходством не ниже порога"""
+        limit = max_edits(len(anchor), threshold)
+        # Лемма о q-граммах: каждая правка разрушает не больше GRAM_SIZE триграмм
+        required = len(anchor) + GRAM_SIZE - 1 - limit * GRAM_SIZE
+        if required > 0:
+            shared: Dict[int, int] = defaultdict(int)
+            for gram, count in trigrams(anchor).items():
+                for window_id, window_count in self.postings.get(gram, ()):
+                    shared[window_id] += min(count, window_count)
+            candidates = [window_id for window_id, value in shared.items() if value >= required]
+        else:
+            candidates = [
+                window_id
+                for length in range(max(len(anchor) - limit, 0), len(anchor) + limit + 1)
+                for window_id in self.by_length.get(length, ())
+            ]
+
+        found = []
+        for window_id in candidates:
+            text = self.texts[window_id]
+            if abs(len(text) - len(anchor)) > limit:
+                continue
+            distance = levenshtein(anchor, text, limit)
+            if distance > limit:
+                continue
+            score = 1 - distance / max(len(anchor), len(text))
+            if score >= threshold:
+                found.extend((owner, score) for owner in self._owners[window_id])
+        return found
+
+
+class AnchorIndex:
+    """Индекс текста разметки для поиска якорей
+
+    Индексы окон строятся лениво для каждой встреченной ширины якоря (в словах)
+    и вместе с результатами поиска переиспользуются всеми шаблонами документа.
+    """
+
+    def __init__(self, texts: Sequence[str], below: Callable[[int], Optional[int]]):
+        self.words = [normalize_text(text).split() for text in texts]
+        self.below = below
+        self._single: Dict[int, WindowIndex] = {}
+        self._joined: Dict[int, WindowIndex] = {}
+        self._results: Dict[Tuple[str, float, bool], List[Tuple[List[int], float]]] = {}
+
+    def single(self, width: int) -> WindowIndex:
+        """Окна внутри отдельных элементов"""
+        if width not in self._single:
+            index = WindowIndex()
+            for item, words in enumerate(self.words):
+                for text in windows(words, width):
+                    index.add(text, (item,))
+            self._single[width] = index
+        return self._single[width]
+
+    def joined(self, width: int) -> WindowIndex:
+        """Окна, переходящие с элемента на элемент под ним (multiline якоря)"""
+        if width not in self._joined:
+            index = WindowIndex()
+            for item, words in enumerate(self.words):
+                next_item = self.below(item)
+                if next_item is None or not words or not self.words[next_item]:
+                    continue
+                joined = words + self.words[next_item]
+                if len(joined) <= width:
+                    index.add(' '.join(joined), (item, next_item))
+                    continue
+                # Только окна, захватывающие слова обоих элементов
+                first = max(len(words) - width + 1, 0)
+                for start in range(first, len(words)):
+                    if start + width <= len(joined):
+                        index.add(' '.join(joined[start:start + width]), (item, next_item))
+            self._joined[width] = index
+        return self._joined[width]
+
+    def search(self, text: str, threshold: float, multiline: bool = False) -> List[Tuple[List[int], float]]:
+        """Лучшее совпадение для каждого элемента: (элементы якоря, сходство)"""
+        anchor = normalize_text(text)
+        key = (anchor, threshold, multiline)
+        if key in self._results:
+            return self._results[key]
+        if not anchor:
+            return []
+
+        width = len(anchor.split())
+        best: Dict[int, Tuple[List[int], float]] = {}
+        for owner, score in self.single(width).search(anchor, threshold):
+            if owner[0] not in best or score > best[owner[0]][1]:
+                best[owner[0]] = (list(owner), score)
+        if multiline:
+            for owner, score in self.joined(width).search(anchor, threshold):
+                if owner[0] not in best or score > best[owner[0]][1]:
+                    best[owner[0]] = (list(owner), score)
+
+        self._results[key] = list(best.values())
+        return self._results[key]
@@ -0,0 +1,43 @@
+from types import SimpleNamespace
+
+import pytest
+
+from benchmarks.eval_prompt_encoding import mock_template
+from document_processor_v2.src.cache import TemplateCache
+from document_processor_v2.src.document_processor import DocumentProcessor
+from document_processor_v2.src.layout import LayoutIndex
+from document_processor_v2.src.prompt_encoding import MarkupEncoder
+from document_processor_v2.src.query_pruning import MarkupPruner
+
+
+class CountingLayoutIndex(LayoutIndex):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lookups = 0
+
+    def lookup(self, fingerprint, query):
+        self.lookups += 1
+        return super().lookup(fingerprint, query)
+
+
+@pytest.fixture
+def offline_processor(tmp_path):
+    """DocumentProcessor с кэшами во временном каталоге; ассистент шаблонов отвечает шаблоном ИНН продавца"""
+    processor = DocumentProcessor.__new__(DocumentProcessor)
+    processor.assistant_manager = SimpleNamespace(
+        cache_enabled=True,
+        template_cache=TemplateCache(tmp_path / 'templates'),
+        layout_index=CountingLayoutIndex(tmp_path / 'layouts.json'),
+        query_index=SimpleNamespace(enabled=False),
+    )
+    processor.encoder = MarkupEncoder()
+    processor.pruner = MarkupPruner()
+    processor.response = mock_template()
+    processor.messages = []
+
+    def run_template_assistant(message, queries=1):
+        processor.messages.append(message)
+        return processor.response
+
+    processor.run_template_assistant = run_template_assistant
+    return processor
@@ -0,0 +1,55 @@
+import asyncio
+
+from document_processor_v2.src.assistant_registry import AssistantRegistry
+
+ARGS = ("DSL Template Generator", "gpt-4-turbo-preview", "промпт", [{"type": "code_interpreter"}])
+
+
+def test_async_lock_does_not_block_event_loop(tmp_path):
+    created = []
+    ticks = []
+
+    async def create():
+        # Сетевой вызов, во время которого блокировка реестра занята
+        await asyncio.sleep(0.2)
+        created.append("asst_1")
+        return "asst_1"
+
+    async def ticker():
+        for _ in range(10):
+            ticks.append(1)
+            await asyncio.sleep(0.02)
+
+    async def scenario():
+        first = AssistantRegistry(tmp_path / 'assistants.json')
+        # Второй экземпляр - как реестр другого воркера с тем же файлом
+        second = AssistantRegistry(tmp_path / 'assistants.json')
+        task = asyncio.create_task(first.aget_or_create(*ARGS, create=create))
+        await asyncio.sleep(0.05)
+        return await asyncio.gather(task, second.aget_or_create(*ARGS, create=create), ticker())
+
+    first_id, second_id, _ = asyncio.run(asyncio.wait_for(scenario(), 5))
+    assert first_id == second_id == "asst_1"
+    assert created == ["asst_1"]
+    assert len(ticks) == 10
+
+
+def test_cancelled_waiter_releases_lock(tmp_path):
+    registry = AssistantRegistry(tmp_path / 'assistants.json')
+
+    async def create():
+        await asyncio.sleep(0.1)
+        return "asst_2"
+
+    async def scenario():
+        holder = asyncio.create_task(registry.aget_or_create(*ARGS, create=create))
+        await asyncio.sleep(0.02)
+        waiter = asyncio.create_task(registry.aget_or_create(*ARGS, create=create))
+        await asyncio.sleep(0.02)
+        waiter.cancel()
+        assert await holder == "asst_2"
+        await asyncio.sleep(0.1)
+        # Блокировку, полученную потоком отмененного ожидания, можно взять снова
+        return await registry.aget_or_create(*ARGS, create=create)
+
+    assert asyncio.run(asyncio.wait_for(scenario(), 5)) == "asst_2"
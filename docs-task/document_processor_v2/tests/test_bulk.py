@@ -0,0 +1,89 @@
+import threading
+import time
+from concurrent.futures import as_completed
+
+import pytest
+
+from document_processor_v2.src import bulk
+from document_processor_v2.src.bulk import BulkProcessor, Manifest, collect_inputs, queries_key
+
+
+class StubProcessor:
+    """Процессор без обращений к API: документы с 'slow' в имени ждут release"""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.started = []
+        self.processed = []
+
+    def query_key(self, query, count=True):
+        return query.lower()
+
+    def process_document(self, image_path, query, output_dir=None):
+        self.started.append(image_path)
+        if 'slow' in image_path:
+            self.release.wait(5)
+        self.processed.append(image_path)
+        return {"markup_path": f"{image_path}.json", "template_path": f"{image_path}.yml"}
+
+
+def make_images(directory, names):
+    paths = []
+    for name in names:
+        path = directory / name
+        path.write_bytes(b'image')
+        paths.append(path)
+    return paths
+
+
+def test_collect_inputs_deduplicates_and_reads_lists(tmp_path):
+    images = make_images(tmp_path, ['a.png', 'b.jpg', 'notes.md'])
+    (tmp_path / 'batch.txt').write_text('a.png\n# comment\nb.jpg\n', encoding='utf-8')
+    found = collect_inputs([str(tmp_path / 'batch.txt'), str(tmp_path)])
+    assert sorted(path.name for path in found) == ['a.png', 'b.jpg']
+    assert len(found) == len({path.resolve() for path in images[:2]})
+
+
+def test_manifest_skips_corrupted_line_and_keeps_last_record(tmp_path):
+    manifest = Manifest(tmp_path / 'manifest.jsonl')
+    key = queries_key(['инн'])
+    manifest.append({"key": "a", "status": "error", "queries_key": key})
+    manifest.append({"key": "a", "status": "ok", "queries_key": key})
+    with open(manifest.path, 'a', encoding='utf-8') as f:
+        f.write('{"key": "b", "sta')
+    assert set(manifest.completed(['инн'])) == {"a"}
+    assert manifest.completed(['кпп']) == {}
+
+
+def test_resume_skips_completed_documents(tmp_path):
+    images = make_images(tmp_path, ['a.png', 'b.png'])
+    processor = StubProcessor()
+    first = BulkProcessor(processor, tmp_path / 'out', concurrency=2).run(images, ['ИНН'])
+    assert first == {"total": 2, "skipped": 0, "ok": 2, "error": 0}
+
+    # Тот же набор запросов в другом регистре дает те же канонические ключи
+    second = BulkProcessor(processor, tmp_path / 'out', concurrency=2).run(images, ['инн'])
+    assert second == {"total": 2, "skipped": 2, "ok": 0, "error": 0}
+    assert len(processor.processed) == 2
+
+
+def test_interrupt_records_documents_in_flight(tmp_path, monkeypatch):
+    images = make_images(tmp_path, ['fast.png', 'slow-1.png', 'slow-2.png', 'queued.png'])
+    processor = StubProcessor()
+
+    def interrupted(futures):
+        # Первый результат обработан, затем пользователь нажимает Ctrl+C
+        yield next(as_completed(futures))
+        while not any('slow-2' in path for path in processor.started):
+            time.sleep(0.01)
+        threading.Timer(0.2, processor.release.set).start()
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(bulk, 'as_completed', interrupted)
+    runner = BulkProcessor(processor, tmp_path / 'out', concurrency=2)
+    with pytest.raises(KeyboardInterrupt):
+        runner.run(images, ['ИНН'])
+
+    completed = runner.manifest.completed(runner.query_keys(['ИНН']))
+    assert {str(path.resolve()) for path in images[:3]} == set(completed)
+    assert str(images[3].resolve()) not in completed
@@ -0,0 +1,35 @@
+import os
+import time
+
+from document_processor_v2.src.cache import DiskCache, MarkupCache
+
+
+def test_index_reads_do_not_count_as_lookups(tmp_path):
+    cache = MarkupCache(tmp_path)
+    cache.put("a" * 64, {"text_items": []})
+    cache.get("a" * 64)
+    assert cache.get_index("a" * 64) is None
+    cache.put_index("a" * 64, {"version": 0})
+    assert cache.get_index("a" * 64) == {"version": 0}
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 0)
+
+
+def test_evict_removes_least_recently_used_down_to_target(tmp_path):
+    cache = DiskCache(tmp_path, max_bytes=1000, suffix='.bin')
+    keys = [f"{index:02d}" * 32 for index in range(4)]
+    now = time.time()
+    for age, key in zip([400, 300, 200, 100], keys):
+        cache.put_bytes(key, b'x' * 240)
+        os.utime(cache.path_for(key), (now - age, now - age))
+    # Чтение обновляет позицию в LRU: самая старая запись становится самой новой
+    assert cache.get_bytes(keys[0]) is not None
+
+    cache.put_bytes("ff" * 32, b'y' * 240)
+
+    assert cache.size() <= 900
+    assert cache.get_bytes(keys[0]) is not None
+    assert cache.get_bytes(keys[1]) is None
+    assert cache.get_bytes(keys[2]) is None
+    assert cache.get_bytes(keys[3]) is not None
+    assert cache.stats()["evictions"] == 2
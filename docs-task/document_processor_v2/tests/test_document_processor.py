@@ -0,0 +1,26 @@
+import sys
+
+from benchmarks.synthetic import upd_markup
+from document_processor_v2.src import document_processor
+from document_processor_v2.src.dsl_engine import DocumentIndex
+from document_processor_v2.src.markup import Markup
+
+
+def test_main_extract_loads_document_once(offline_processor, tmp_path, monkeypatch, capsys):
+    image = tmp_path / 'upd.png'
+    image.write_bytes(b'image')
+    loaded = []
+
+    def load_document(image_path):
+        loaded.append(image_path)
+        return DocumentIndex(Markup.from_dict(upd_markup(1)["markup"]))
+
+    offline_processor.load_document = load_document
+    monkeypatch.setattr(document_processor, 'DocumentProcessor', lambda: offline_processor)
+    monkeypatch.setattr(sys, 'argv', [
+        'document_processor', str(image), 'ИНН продавца', '--output-dir', str(tmp_path / 'out'), '--extract',
+    ])
+    document_processor.main()
+
+    assert loaded == [str(image)]
+    assert 'Значение (ИНН продавца):' in capsys.readouterr().out
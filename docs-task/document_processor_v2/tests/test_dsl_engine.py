@@ -0,0 +1,123 @@
+import pytest
+
+from document_processor_v2.src.dsl_engine import DocumentIndex, TemplateEngine, extraction_box, resolve_references
+
+DIGITS = {"instance_name": "RegExpPostprocessor", "params": {"regexp_value": "[0-9]{10}(?=[^0-9])"}}
+
+
+def item(text, x1, y1, x2, y2):
+    return {"bbox": {"x1": x1, "y1": y1, "x2": x2, "y2": y2}, "text": text, "confidence": 100}
+
+
+# Якорь высотой 20 и по значению с каждой стороны от него
+AROUND = {"text_items": [
+    item("ИНН", 300, 100, 340, 120),
+    item("1111111111", 350, 100, 500, 120),
+    item("2222222222", 100, 100, 290, 120),
+    item("3333333333", 300, 125, 450, 145),
+    item("4444444444", 300, 75, 450, 95),
+]}
+
+
+def anchor_template(text, relation, area, **anchor):
+    return {
+        "intersection_metric": {"name": "Overlap", "threshold": 0.5},
+        "extraction_area": area,
+        "params": {
+            "anchors": [dict({
+                "text": text, "text_threshold": 0.9, "relation": relation,
+                "intersection_metric": "${intersection_metric}", "extraction_area": "${extraction_area}",
+            }, **anchor)],
+            "postprocessing_pipe": [DIGITS],
+        },
+    }
+
+
+def test_deltas_are_multiples_of_anchor_height():
+    anchor = (300, 100, 340, 120)
+    area = {"delta_x1": 0.5, "delta_y1": -0.25, "delta_x2": 10, "delta_y2": 0.25}
+    assert extraction_box(anchor, "right", area) == (350, 95, 540, 125)
+    assert extraction_box(anchor, "left", area) == (100, 95, 290, 125)
+    with pytest.raises(ValueError):
+        extraction_box(anchor, "diagonal", area)
+
+
+@pytest.mark.parametrize("relation, area, expected", [
+    ("right", {"delta_x1": 0, "delta_y1": -0.2, "delta_x2": 10, "delta_y2": 0.2}, "1111111111"),
+    ("left", {"delta_x1": 0, "delta_y1": -0.2, "delta_x2": 10, "delta_y2": 0.2}, "2222222222"),
+    ("bottom", {"delta_x1": 0, "delta_y1": 0, "delta_x2": 6, "delta_y2": 1.5}, "3333333333"),
+    ("top", {"delta_x1": 0, "delta_y1": 0, "delta_x2": 6, "delta_y2": 1.5}, "4444444444"),
+])
+def test_relation_selects_side_of_anchor(relation, area, expected):
+    result = TemplateEngine(anchor_template("ИНН", relation, area)).apply(AROUND)
+    assert result["value"] == expected
+    assert result["anchors_used"][0]["text"] == "ИНН"
+
+
+def test_main_relation_falls_back_to_anchor_text():
+    markup = {"text_items": [item("ИНН 7707083893", 10, 10, 200, 30), item("Итого", 10, 300, 60, 320)]}
+    area = {"delta_x1": 0, "delta_y1": 0, "delta_x2": 0, "delta_y2": 0}
+    assert TemplateEngine(anchor_template("ИНН", "main", area, text_threshold=0.3)).apply(markup)["value"] == "7707083893"
+
+
+def test_repetition_index_selects_occurrence_in_reading_order():
+    markup = {"text_items": [
+        item("ИНН", 10, 200, 50, 220), item("2222222222", 60, 200, 200, 220),
+        item("ИНН", 10, 100, 50, 120), item("1111111111", 60, 100, 200, 120),
+    ]}
+    area = {"delta_x1": 0, "delta_y1": -0.2, "delta_x2": 10, "delta_y2": 0.2}
+    values = [
+        TemplateEngine(anchor_template("ИНН", "right", area, repetition_index=index)).apply(markup)["value"]
+        for index in range(3)
+    ]
+    assert values == ["1111111111", "2222222222", None]
+
+
+def test_multiline_anchor_spans_two_lines():
+    markup = {"text_items": [
+        item("ИНН/КПП", 10, 100, 90, 120), item("продавца:", 10, 122, 100, 142),
+        item("7707083893", 120, 110, 260, 130),
+    ]}
+    area = {"delta_x1": 0, "delta_y1": -0.1, "delta_x2": 5, "delta_y2": 0.1}
+    single = TemplateEngine(anchor_template("ИНН/КПП продавца:", "right", area)).apply(markup)
+    multiline = TemplateEngine(anchor_template("ИНН/КПП продавца:", "right", area, multiline=True)).apply(markup)
+    assert single["value"] is None
+    assert multiline["value"] == "7707083893"
+    assert multiline["anchors_used"][0]["text"] == "ИНН/КПП продавца:"
+
+
+def test_chain_attributes_follow_priority():
+    area = {"delta_x1": 0, "delta_y1": -0.2, "delta_x2": 10, "delta_y2": 0.2}
+
+    def attribute(text, priority):
+        params = anchor_template(text, "right", area)["params"]
+        return {"type": "AnchorsBasedAttribute", "priority": priority, "params": params}
+
+    chain = {
+        "intersection_metric": {"name": "Overlap", "threshold": 0.5},
+        "extraction_area": area,
+        "params": {"attributes": [attribute("ИНН", 2), attribute("КПП", 1)]},
+    }
+    markup = {"text_items": AROUND["text_items"] + [item("КПП", 300, 300, 340, 320), item("5555555555", 350, 300, 500, 320)]}
+    assert TemplateEngine(chain).apply(markup)["value"] == "5555555555"
+    # Атрибут с меньшим priority не нашел якорь: используется следующий
+    assert TemplateEngine(chain).apply(AROUND)["value"] == "1111111111"
+
+
+def test_references_are_resolved_and_checked():
+    template = {"base": {"area": {"delta_x2": 3}}, "area": "${base.area}", "nested": ["${ area }"]}
+    resolved = resolve_references(template, template)
+    assert resolved["area"] == {"delta_x2": 3}
+    assert resolved["nested"] == [{"delta_x2": 3}]
+    with pytest.raises(ValueError):
+        TemplateEngine({"extraction_area": "${missing.node}"})
+    looped = {"a": "${b}", "b": "${a}"}
+    with pytest.raises(ValueError):
+        resolve_references(looped, looped)
+
+
+def test_document_index_is_reused_across_templates():
+    document = DocumentIndex(AROUND)
+    area = {"delta_x1": 0, "delta_y1": -0.2, "delta_x2": 10, "delta_y2": 0.2}
+    assert TemplateEngine(anchor_template("ИНН", "right", area)).apply(document)["value"] == "1111111111"
+    assert TemplateEngine(anchor_template("ИНН", "left", area)).apply(document)["value"] == "2222222222"
@@ -0,0 +1,96 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from document_processor_v2.src.file_registry import (
+    AsyncFileCollector, FileCollector, FileRegistry, upload_name
+)
+
+OLD = time.time() - 7200
+
+
+def remote(file_id, filename, created_at=OLD):
+    return SimpleNamespace(id=file_id, filename=filename, created_at=created_at)
+
+
+class FakeFiles:
+    def __init__(self, files):
+        self.files = files
+        self.deleted = []
+
+    def list(self, purpose):
+        return iter(self.files)
+
+    def delete(self, file_id):
+        self.deleted.append(file_id)
+
+
+class AsyncPages:
+    """Асинхронный пагинатор: файлы отдаются двумя страницами"""
+
+    def __init__(self, files):
+        self.pages = [files[:1], files[1:]]
+
+    async def __aiter__(self):
+        for page in self.pages:
+            await asyncio.sleep(0)
+            for file in page:
+                yield file
+
+
+class AsyncFakeFiles(FakeFiles):
+    def list(self, purpose):
+        return AsyncPages(self.files)
+
+    async def delete(self, file_id):
+        self.deleted.append(file_id)
+
+
+def test_registry_id_is_stable_and_unique(tmp_path):
+    first = FileRegistry(tmp_path / 'a' / 'files.json')
+    assert FileRegistry(tmp_path / 'a' / 'files.json').prefix == first.prefix
+    assert FileRegistry(tmp_path / 'b' / 'files.json').prefix != first.prefix
+    assert upload_name('f' * 64, 'scan.PNG', first.prefix) == f"{first.prefix}{'f' * 16}.png"
+
+
+def test_acquire_reuses_file_and_collects_after_release(tmp_path):
+    registry = FileRegistry(tmp_path / 'files.json', ttl=0)
+    assert registry.register('abc', 'file-1', 10) == 'file-1'
+    # TTL истек: файл больше не выдается, но пока есть ссылка - не удаляется
+    assert registry.acquire('abc') is None
+    assert registry.collect() == []
+    registry.release('file-1')
+    assert registry.collect() == ['file-1']
+
+
+def test_parallel_duplicate_is_collected(tmp_path):
+    registry = FileRegistry(tmp_path / 'files.json')
+    registry.register('abc', 'file-1', 10)
+    assert registry.register('abc', 'file-2', 10) == 'file-1'
+    assert registry.collect() == ['file-2']
+
+
+def test_sweep_skips_orphans_of_other_registry(tmp_path):
+    own = FileRegistry(tmp_path / 'package' / 'files.json')
+    other = FileRegistry(tmp_path / 'api' / 'files.json')
+    other.register('def', 'file-other-known', 10)
+    files = FakeFiles([
+        remote('file-own', upload_name('a' * 64, 'x.png', own.prefix)),
+        remote('file-own-fresh', upload_name('b' * 64, 'x.png', own.prefix), created_at=time.time()),
+        remote('file-other', upload_name('c' * 64, 'x.png', other.prefix)),
+        remote('file-user', 'invoice.png'),
+    ])
+    collector = FileCollector(own, SimpleNamespace(files=files))
+    assert collector.sweep() == 1
+    assert files.deleted == ['file-own']
+
+
+def test_async_sweep_reads_all_pages(tmp_path):
+    registry = FileRegistry(tmp_path / 'files.json')
+    files = AsyncFakeFiles([
+        remote('file-other', upload_name('c' * 64, 'x.png', 'dp-00000000-')),
+        remote('file-own', upload_name('a' * 64, 'x.png', registry.prefix)),
+    ])
+    collector = AsyncFileCollector(registry, SimpleNamespace(files=files))
+    assert asyncio.run(collector.sweep()) == 1
+    assert files.deleted == ['file-own']
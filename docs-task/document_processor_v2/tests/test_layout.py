@@ -0,0 +1,78 @@
+import yaml
+
+from benchmarks.synthetic import upd_markup
+from document_processor_v2.src import dsl_engine
+from document_processor_v2.src.dsl_engine import DocumentIndex
+from document_processor_v2.src.layout import layout_fingerprint
+from document_processor_v2.src.markup import Markup
+from document_processor_v2.src.query_pruning import value_matches
+
+QUERY = "ИНН продавца"
+
+
+def document(seed, layout):
+    return DocumentIndex(Markup.from_dict(upd_markup(seed, layout=layout)["markup"]))
+
+
+def date_template():
+    """Шаблон, который находит дату документа вместо ИНН"""
+    return yaml.safe_dump({
+        "intersection_metric": {"name": "Overlap", "threshold": 0.5},
+        "extraction_area": {"delta_x1": 0, "delta_y1": -0.3, "delta_x2": 10, "delta_y2": 0.3},
+        "params": {"anchors": [{
+            "text": "от", "text_threshold": 1.0, "relation": "right",
+            "intersection_metric": "${intersection_metric}", "extraction_area": "${extraction_area}",
+        }]},
+    }, allow_unicode=True)
+
+
+def count_indexes(monkeypatch):
+    built = []
+    original = dsl_engine.DocumentIndex.__init__
+
+    def init(self, *args, **kwargs):
+        built.append(self)
+        original(self, *args, **kwargs)
+
+    monkeypatch.setattr(dsl_engine.DocumentIndex, "__init__", init)
+    return built
+
+
+def test_fingerprint_matches_same_layout_only():
+    first = layout_fingerprint(document(1, layout=1))
+    same = layout_fingerprint(document(2, layout=1))
+    other = layout_fingerprint(document(3, layout=2))
+    assert first.similarity(same, 0.75) >= 0.8
+    assert first.similarity(other, 0.75) < 0.8
+
+
+def test_value_matches_field_type():
+    assert value_matches("ИНН продавца", "7707083893")
+    assert not value_matches("ИНН продавца", "12.03.2021")
+    assert value_matches("КПП покупателя", "770701001")
+    assert value_matches("дата счет-фактуры", "12.03.2021")
+    assert not value_matches("сумма к оплате", "ООО Ромашка")
+    assert value_matches("подпись руководителя", "Иванов")
+
+
+def test_same_layout_reuses_template_without_new_index(offline_processor, monkeypatch):
+    offline_processor.generate_template(document(1, layout=1), QUERY)
+    assert len(offline_processor.messages) == 1
+
+    second = document(2, layout=1)
+    built = count_indexes(monkeypatch)
+    template = offline_processor.generate_template(second, QUERY)
+    assert len(offline_processor.messages) == 1
+    assert built == []
+    value = offline_processor.extract_data(second, {QUERY: template})[QUERY]["value"]
+    assert value == upd_markup(2, layout=1)["expected"][QUERY]
+
+
+def test_reused_template_with_wrong_value_type_is_rejected(offline_processor):
+    layout_index = offline_processor.assistant_manager.layout_index
+    layout_index.add(layout_fingerprint(document(1, layout=1)), QUERY, date_template())
+
+    template = offline_processor.generate_template(document(2, layout=1), QUERY)
+    assert layout_index.stats()["rejected"] == 1
+    assert len(offline_processor.messages) == 1
+    assert "ИНН/КПП продавца:" in template
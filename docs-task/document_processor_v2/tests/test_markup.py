@@ -0,0 +1,64 @@
+import json
+from types import SimpleNamespace
+
+from document_processor_v2.src.cache import MarkupCache, markup_hash
+from document_processor_v2.src.document_processor import DocumentProcessor
+from document_processor_v2.src.markup import Markup
+from document_processor_v2.src.prompt_encoding import MarkupEncoder
+from document_processor_v2.src.query_pruning import MarkupPruner
+
+MARKUP = {
+    "text_items": [
+        {"bbox": {"x1": 10, "y1": 10, "x2": 60, "y2": 30}, "text": "ИНН", "confidence": 98},
+        {"bbox": {"x1": 70.5, "y1": 10, "x2": 200, "y2": 30}, "text": "7707083893", "confidence": 97.5},
+        {"bbox": {"x1": 10, "y1": 900, "x2": 90, "y2": 920}, "text": "Итого", "confidence": 20},
+        {"text": "без bbox", "extra": True},
+    ],
+    "image": {"width": 1000, "height": 1400},
+}
+
+
+def test_roundtrip_and_hash_are_lossless():
+    compact = Markup.from_dict(MARKUP)
+    assert compact.to_dict() == MARKUP
+    assert markup_hash(compact) == markup_hash(MARKUP)
+
+
+def test_cache_returns_compact_markup(tmp_path):
+    cache = MarkupCache(tmp_path)
+    cache.put("a" * 64, MARKUP)
+    cached = cache.get("a" * 64)
+    assert isinstance(cached, Markup)
+    assert cached.to_dict() == MARKUP
+
+    cache.put_bytes("b" * 64, b'[1, 2')
+    assert cache.get("b" * 64) is None
+
+
+def test_json_encoding_same_for_dict_and_markup():
+    encoder = MarkupEncoder("json", min_confidence=50)
+    encoded = encoder.encode(Markup.from_dict(MARKUP))
+    assert encoded == encoder.encode(MARKUP)
+    assert [item["text"] for item in json.loads(encoded)["text_items"]] == ["ИНН", "7707083893", "без bbox"]
+
+
+def test_pruner_keeps_markup_without_conversion():
+    compact = Markup.from_dict(MARKUP)
+    result = MarkupPruner(enabled=False).prune(compact, ["найди ИНН"])
+    assert result.markup is compact
+
+
+def test_empty_cached_markup_is_a_hit(tmp_path):
+    image = tmp_path / 'blank.png'
+    image.write_bytes(b'blank page')
+    cache = MarkupCache(tmp_path / 'markup')
+    cache.put(cache.key_for_file(image), {"text_items": []})
+
+    def create_thread():
+        raise AssertionError("разметка из кэша не должна запускать ассистента")
+
+    processor = DocumentProcessor.__new__(DocumentProcessor)
+    processor.assistant_manager = SimpleNamespace(cache_enabled=True, markup_cache=cache, create_thread=create_thread)
+    key, markup = processor.markup_with_key(str(image))
+    assert key == cache.key_for_file(image)
+    assert len(markup) == 0
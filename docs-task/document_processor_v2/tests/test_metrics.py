@@ -0,0 +1,86 @@
+from types import SimpleNamespace
+
+import pytest
+
+from document_processor_v2.src import metrics
+from document_processor_v2.src.metrics import MetricsRegistry, metrics_operation, record_run
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = MetricsRegistry()
+    monkeypatch.setattr(metrics, '_shared', registry)
+    return registry
+
+
+def lines(registry, prefix):
+    return [line for line in registry.render().splitlines() if line.startswith(prefix)]
+
+
+def test_histogram_render_is_cumulative(registry):
+    histogram = registry.histogram("docproc_test_seconds", "Тест", ("operation",), buckets=(1.0, 2.0))
+    for value in (0.5, 1.0, 1.5, 2.0, 5.0):
+        histogram.observe(value, "markup")
+
+    assert lines(registry, "docproc_test_seconds") == [
+        'docproc_test_seconds_bucket{operation="markup",le="1"} 2',
+        'docproc_test_seconds_bucket{operation="markup",le="2"} 4',
+        'docproc_test_seconds_bucket{operation="markup",le="+Inf"} 5',
+        'docproc_test_seconds_sum{operation="markup"} 10',
+        'docproc_test_seconds_count{operation="markup"} 5',
+    ]
+    assert "# TYPE docproc_test_seconds histogram" in registry.render()
+
+
+def test_label_values_are_escaped(registry):
+    registry.counter("docproc_test_total", "Тест", ("path",)).inc('a"b\\c\nd', value=2)
+    assert lines(registry, "docproc_test_total") == ['docproc_test_total{path="a\\"b\\\\c\\nd"} 2']
+
+
+def test_collectors_are_rendered_and_failures_skipped(registry):
+    registry.collector("cache", lambda: metrics.cache_samples("markup", {"hits": 3, "misses": 1, "bytes": -1}))
+
+    def broken():
+        raise OSError("нет доступа")
+
+    registry.collector("broken", broken)
+    assert lines(registry, "docproc_cache_") == [
+        'docproc_cache_hits_total{cache="markup"} 3',
+        'docproc_cache_misses_total{cache="markup"} 1',
+    ]
+
+
+def test_snapshot_quantiles_interpolate_within_bucket(registry):
+    histogram = registry.histogram("docproc_test_seconds", "Тест", (), buckets=(1.0, 2.0, 4.0))
+    for value in [0.5] * 5 + [1.5] * 5:
+        histogram.observe(value)
+    sample = registry.snapshot()["docproc_test_seconds"]["samples"][0]
+    assert (sample["count"], sample["sum"], sample["mean"]) == (10, 10.0, 1.0)
+    assert sample["p50"] == pytest.approx(1.0)
+    assert sample["p95"] == pytest.approx(1.9)
+    assert sample["buckets"] == {"1": 5, "2": 5, "4": 0, "+Inf": 0}
+
+    # Значения выше последней границы: квантиль ограничен ею
+    histogram.observe(100.0)
+    assert histogram.quantile([0, 0, 0, 3], 0.5) == 4.0
+
+
+def test_record_run_estimates_queue_time_from_started_at(registry):
+    run = SimpleNamespace(
+        status="completed", created_at=100, started_at=103,
+        usage=SimpleNamespace(prompt_tokens=1000, completion_tokens=200, total_tokens=1200),
+    )
+    with metrics_operation("template"):
+        record_run(run, None, 10.0)
+        record_run(SimpleNamespace(status="failed"), None, 1.0)
+
+    snapshot = registry.snapshot()
+    queue = snapshot[metrics.RUN_QUEUE_SECONDS]["samples"][0]
+    execution = snapshot[metrics.RUN_EXECUTION_SECONDS]["samples"][0]
+    assert queue["labels"] == {"operation": "template"}
+    assert (queue["count"], queue["sum"]) == (1, 3.0)
+    assert (execution["count"], execution["sum"]) == (1, 7.0)
+    runs = {sample["labels"]["status"]: sample["value"] for sample in snapshot[metrics.RUNS]["samples"]}
+    assert runs == {"completed": 1.0, "failed": 1.0}
+    tokens = {sample["labels"]["kind"]: sample["value"] for sample in snapshot[metrics.TOKENS]["samples"]}
+    assert tokens == {"prompt": 1000.0, "completion": 200.0}
@@ -0,0 +1,50 @@
+from document_processor_v2.src.dsl_engine import DocumentIndex, TemplateEngine
+from document_processor_v2.src.pdf_pages import is_pdf, merge_pages
+
+
+def page(text, width=None, height=None):
+    markup = {"text_items": [
+        {"bbox": {"x1": 10, "y1": 100, "x2": 50, "y2": 120}, "text": "ИНН", "confidence": 100},
+        {"bbox": {"x1": 60, "y1": 100, "x2": 200, "y2": 120}, "text": text, "confidence": 100},
+    ]}
+    if width:
+        markup["image"] = {"width": width, "height": height, "scale": 0.5}
+    return markup
+
+
+def test_merge_pages_numbers_items_and_keeps_page_coordinates():
+    merged = merge_pages([page("1111111111", 1000, 1400), page("2222222222"), page("3333333333", 1000, 1500)])
+    assert [item["page"] for item in merged["text_items"]] == [1, 1, 2, 2, 3, 3]
+    assert [item["text"] for item in merged["text_items"][1::2]] == ["1111111111", "2222222222", "3333333333"]
+    assert all(item["bbox"]["y1"] == 100 for item in merged["text_items"])
+    assert merged["pages"] == [
+        {"page": 1, "width": 1000, "height": 1400},
+        {"page": 2, "width": None, "height": None},
+        {"page": 3, "width": 1000, "height": 1500},
+    ]
+    assert "image" not in merged
+
+
+def test_merged_pages_do_not_mix_in_document_index():
+    merged = merge_pages([page("1111111111", 1000, 1400), page("2222222222", 1000, 1400)])
+    document = DocumentIndex(merged)
+    # Вторая страница располагается под первой, на высоту первой из pages
+    assert document.offsets == {1: 0.0, 2: 1400.0}
+
+    template = {
+        "params": {"anchors": [{
+            "text": "ИНН", "text_threshold": 0.9, "relation": "right", "repetition_index": 1,
+            "intersection_metric": {"name": "Overlap", "threshold": 0.5},
+            "extraction_area": {"delta_x1": 0, "delta_y1": -0.2, "delta_x2": 10, "delta_y2": 0.2},
+        }]},
+    }
+    result = TemplateEngine(template).apply(document)
+    assert result["value"] == "2222222222"
+    assert result["bbox"] == {"x1": 60.0, "y1": 100.0, "x2": 200.0, "y2": 120.0, "page": 2}
+
+
+def test_is_pdf_by_signature(tmp_path):
+    path = tmp_path / 'scan.bin'
+    path.write_bytes(b'%PDF-1.7\n')
+    assert is_pdf(path)
+    assert not is_pdf(tmp_path / 'missing.png')
@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+from document_processor_v2.src.preprocess import EXIF_ORIENTATION, ImagePreprocessor, PreprocessConfig
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def preprocessor(max_long_edge):
+    return ImagePreprocessor(PreprocessConfig(max_long_edge=max_long_edge, max_bytes=10 * 1024 * 1024))
+
+
+def markup(x1, y1, x2, y2):
+    return {"text_items": [{"bbox": {"x1": x1, "y1": y1, "x2": x2, "y2": y2}, "text": "ИНН", "confidence": 99}]}
+
+
+def test_downscaled_coordinates_are_restored(tmp_path):
+    path = tmp_path / 'scan.png'
+    Image.new('RGB', (4000, 3000), 'white').save(path)
+    prepared = preprocessor(2000).prepare(str(path))
+    try:
+        assert prepared.temporary and prepared.path != str(path)
+        assert prepared.original_size == (4000, 3000)
+        assert prepared.size == (2000, 1500)
+        with Image.open(prepared.path) as uploaded:
+            assert uploaded.size == (2000, 1500)
+
+        restored = prepared.restore(markup(100, 50, 200, 100.25))
+        assert restored["text_items"][0]["bbox"] == {"x1": 200.0, "y1": 100.0, "x2": 400.0, "y2": 200.5}
+        assert restored["image"] == {"width": 4000, "height": 3000, "scale": 0.5}
+    finally:
+        prepared.cleanup()
+    assert not os.path.exists(prepared.path)
+
+
+def test_exif_rotation_is_applied_before_scaling(tmp_path):
+    path = tmp_path / 'rotated.jpg'
+    # Пиксели хранятся альбомно, EXIF 6 поворачивает их на 90° по часовой стрелке
+    exif = Image.Exif()
+    exif[EXIF_ORIENTATION] = 6
+    Image.new('RGB', (400, 200), 'white').save(path, exif=exif)
+    prepared = preprocessor(150).prepare(str(path))
+    try:
+        assert prepared.original_size == (200, 400)
+        assert prepared.size == (75, 150)
+        with Image.open(prepared.path) as uploaded:
+            assert uploaded.size == (75, 150)
+            assert uploaded.getexif().get(EXIF_ORIENTATION, 1) == 1
+
+        restored = prepared.restore(markup(15, 30, 60, 75))
+        assert restored["text_items"][0]["bbox"] == {"x1": 40.0, "y1": 80.0, "x2": 160.0, "y2": 200.0}
+        assert restored["image"]["width"] == 200 and restored["image"]["height"] == 400
+    finally:
+        prepared.cleanup()
+
+
+def test_small_image_is_uploaded_as_is(tmp_path):
+    path = tmp_path / 'small.png'
+    Image.new('L', (100, 50), 'white').save(path)
+    prepared = preprocessor(2000).prepare(str(path))
+    assert prepared.path == str(path) and not prepared.temporary
+    assert prepared.scale == (1.0, 1.0)
+    restored = prepared.restore(markup(1, 2, 3, 4))
+    assert restored["text_items"][0]["bbox"] == {"x1": 1, "y1": 2, "x2": 3, "y2": 4}
+    assert restored["image"] == {"width": 100, "height": 50, "scale": 1.0}
@@ -0,0 +1,54 @@
+import pytest
+
+from benchmarks.bench_query_index import grouping, query_stream
+from document_processor_v2.src.query_index import QueryIndex, query_signature
+
+
+@pytest.fixture
+def index(tmp_path):
+    return QueryIndex(tmp_path / 'queries.json')
+
+
+def test_paraphrases_share_key(index):
+    assert index.key("найди ИНН продавца") == index.key("нужен инн поставщика")
+    assert index.key("сумма с НДС") == index.key("всего с НДС")
+    assert index.key("р/с продавца") == index.key("расчетный счет продавца")
+
+
+def test_polarity_words_split_keys(index):
+    keys = {index.key(query) for query in ["сумма НДС", "сумма с НДС", "сумма без НДС", "сумма, в т.ч. НДС"]}
+    assert len(keys) == 4
+
+
+def test_polarity_is_checked_at_any_threshold(tmp_path):
+    index = QueryIndex(tmp_path / 'queries.json', threshold=0.0)
+    assert index.key("итого НДС") != index.key("итого с НДС")
+    assert index.key("не оплачено") != index.key("оплачено")
+
+
+def test_identifying_stem_is_hard_mismatch(tmp_path):
+    index = QueryIndex(tmp_path / 'queries.json', threshold=0.0)
+    assert index.key("банк продавца") != index.key("БИК банка продавца")
+    assert index.key("адрес продавца") != index.key("ОГРН продавца")
+
+
+def test_abbreviation_slash_is_not_preposition():
+    field, stems = query_signature("р/с продавца")
+    assert "с" not in stems
+    assert "счет" in stems
+
+
+def test_bench_grouping_keeps_confusable_fields_apart():
+    report = grouping(query_stream(300), threshold=0.5)
+    assert report["merged_keys"] == []
+
+
+def test_extra_stem_is_hard_mismatch(tmp_path):
+    index = QueryIndex(tmp_path / 'queries.json', threshold=0.0)
+    assert index.key("код товара") != index.key("код вида товара")
+    assert index.key("расчетный счет продавца") == index.key("расч. счет продавца")
+
+
+def test_slug_keeps_original_alphabet(index):
+    assert index.key("email продавца") == "seller_email"
+    assert index.key("ИНН продавца") == "inn_seller"
@@ -0,0 +1,62 @@
+from benchmarks.eval_prompt_encoding import mock_template
+from benchmarks.synthetic import upd_markup
+from document_processor_v2.src.document_processor import DocumentProcessor
+from document_processor_v2.src import query_pruning
+from document_processor_v2.src.dsl_engine import DocumentIndex
+from document_processor_v2.src.markup import Markup
+from document_processor_v2.src.query_pruning import MarkupPruner
+
+QUERY = "ИНН продавца"
+
+
+def test_prune_keeps_anchor_neighbourhood():
+    markup = upd_markup(1)["markup"]
+    result = MarkupPruner().prune(markup, [QUERY])
+    assert result.pruned
+    assert result.kept < result.total
+    texts = [item["text"] for item in result.markup["text_items"]]
+    assert "ИНН/КПП продавца:" in texts
+
+
+def test_prune_uses_prebuilt_index(monkeypatch):
+    document = DocumentIndex(Markup.from_dict(upd_markup(1)["markup"]))
+
+    def forbidden(*args, **kwargs):
+        raise AssertionError("индекс полной разметки строится повторно")
+
+    monkeypatch.setattr(query_pruning, "DocumentIndex", forbidden)
+    result = MarkupPruner().prune(document.markup, [QUERY], document)
+    assert result.document is document
+
+
+def test_pruned_index_is_built_once():
+    pruner = MarkupPruner()
+    result = pruner.prune(upd_markup(2)["markup"], [QUERY, "ИНН покупателя"])
+    template = DocumentProcessor.extract_yaml(mock_template())
+    assert pruner.consistent(template, result)
+    first = result.pruned_document
+    assert pruner.consistent(template, result)
+    assert result.pruned_document is first
+
+
+def test_single_pending_query_skips_repeated_lookups(offline_processor):
+    markup = Markup.from_dict(upd_markup(3)["markup"])
+    templates = offline_processor.generate_templates(markup, [QUERY])
+    assert len(offline_processor.messages) == 1
+    # Кэш и индекс макетов проверяются один раз, в generate_templates
+    assert offline_processor.assistant_manager.layout_index.lookups == 1
+    assert "ИНН/КПП продавца:" in templates[QUERY]
+
+
+def test_malformed_batch_reply_falls_back_to_single_queries(offline_processor):
+    replies = ["```yaml\nfield_1: [unclosed\n```", mock_template(), mock_template()]
+
+    def run_template_assistant(message, queries=1):
+        offline_processor.messages.append(message)
+        return replies[len(offline_processor.messages) - 1]
+
+    offline_processor.run_template_assistant = run_template_assistant
+    markup = Markup.from_dict(upd_markup(4)["markup"])
+    templates = offline_processor.generate_templates(markup, [QUERY, "ИНН покупателя"])
+    assert len(offline_processor.messages) == 3
+    assert set(templates) == {QUERY, "ИНН покупателя"}
@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+
+from document_processor_v2.src.rate_limiter import (
+    BULK, INTERACTIVE, RateLimiter, TokenBucket, consumes_tokens, retry_after_seconds
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket_refills_and_goes_negative():
+    clock = FakeClock()
+    bucket = TokenBucket(60, burst_seconds=5, clock=clock)
+    assert bucket.capacity == 5
+    assert bucket.wait_time(5) == 0
+    bucket.consume(5)
+    assert bucket.wait_time(1) == pytest.approx(1.0)
+    clock.now += 2
+    assert bucket.wait_time(2) == 0
+
+    # Запрос дороже емкости ждет полного бакета и уводит его в минус
+    clock.now += 10
+    assert bucket.wait_time(50) == 0
+    bucket.consume(50)
+    assert bucket.level == pytest.approx(-45)
+    assert bucket.wait_time(1) == pytest.approx(46.0)
+
+
+def test_token_bucket_follows_server_remaining():
+    bucket = TokenBucket(600, clock=FakeClock())
+    bucket.limit(2)
+    assert bucket.level == 2
+
+
+def test_retry_after_headers():
+    assert retry_after_seconds({"retry-after-ms": "250"}) == 0.25
+    assert retry_after_seconds({"retry-after": "3"}) == 3.0
+    assert retry_after_seconds({"retry-after": "Wed, 21 Oct"}) is None
+    assert consumes_tokens("POST", "/v1/threads/t/runs")
+    assert not consumes_tokens("GET", "/v1/threads/t/runs")
+
+
+def test_disabled_limiter_does_not_wait():
+    limiter = RateLimiter()
+    assert not limiter.enabled
+    assert limiter.acquire(tokens=10_000) == 0.0
+
+
+def test_interactive_is_served_before_bulk():
+    limiter = RateLimiter(requests_per_minute=600, burst_seconds=0.1)
+    limiter.acquire()
+    order = []
+
+    async def request(name, priority):
+        await limiter.aacquire(priority=priority)
+        order.append(name)
+
+    async def scenario():
+        # Пакетный запрос встал в очередь раньше, но интерактивный получает квоту первым
+        await asyncio.gather(request("bulk", BULK), request("interactive", INTERACTIVE))
+
+    asyncio.run(scenario())
+    assert order == ["interactive", "bulk"]
+    assert limiter.stats()["granted"]["interactive"] == 1
+    assert limiter.stats()["queued"] == 0
+
+
+def test_429_pauses_all_requests():
+    clock = FakeClock()
+    limiter = RateLimiter(requests_per_minute=6000, clock=clock)
+    limiter.observe(429, {"retry-after": "2"})
+    with limiter._condition:
+        ticket = limiter._enqueue(INTERACTIVE)
+        assert limiter._try_acquire(ticket, 0) == pytest.approx(2.0)
+        clock.now += 2
+        assert limiter._try_acquire(ticket, 0) == 0
+    assert limiter.stats()["throttled"] == 1
+
+
+def test_cancelled_request_does_not_block_queue():
+    limiter = RateLimiter(requests_per_minute=6000, clock=FakeClock())
+    with limiter._condition:
+        first = limiter._enqueue(INTERACTIVE)
+        second = limiter._enqueue(BULK)
+        assert limiter._try_acquire(second, 0) is None
+        limiter._cancelled.add(first)
+        assert limiter._try_acquire(second, 0) == 0
@@ -0,0 +1,50 @@
+import time
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+from document_processor_v2.src.run_poller import PollPolicy, RunTimeoutError, poll_run, stream_run
+
+
+def run_event(name, status, run_id="run_1"):
+    return SimpleNamespace(event=name, data=SimpleNamespace(id=run_id, status=status, last_error=None))
+
+
+def broken_stream(pause):
+    yield run_event("thread.run.created", "queued")
+    time.sleep(pause)
+    raise openai.APIConnectionError(request=httpx.Request("GET", "http://mock"))
+
+
+def test_stream_returns_on_completed_event():
+    events = [run_event("thread.run.created", "queued"), run_event("thread.run.step.created", "in_progress"),
+              SimpleNamespace(event="thread.run.completed",
+                              data=SimpleNamespace(id="run_1", status="completed", last_error=None,
+                                                   created_at=None, started_at=None, usage=None))]
+    assert stream_run(events, lambda run_id: pytest.fail("опрос не нужен")) == "run_1"
+
+
+def test_stream_fallback_keeps_remaining_deadline():
+    policy = PollPolicy(initial_delay=0.02, queued_delay=0.02, max_delay=0.05, deadline=0.4)
+    started = time.monotonic()
+    with pytest.raises(RunTimeoutError):
+        stream_run(broken_stream(0.3), lambda run_id: SimpleNamespace(id=run_id, status="in_progress"), policy)
+    # Опрос после обрыва получает остаток срока, а не новый deadline
+    assert time.monotonic() - started < 0.6
+
+
+def test_poll_skips_to_expected_duration():
+    calls = []
+
+    def retrieve():
+        calls.append(time.monotonic())
+        status = "completed" if len(calls) > 1 else "in_progress"
+        return SimpleNamespace(id="run_1", status=status, last_error=None,
+                               created_at=None, started_at=None, usage=None)
+
+    policy = PollPolicy(initial_delay=0.01, max_delay=0.02, deadline=5)
+    elapsed = poll_run(retrieve, "run_1", policy, expected=0.3)
+    assert len(calls) == 2
+    assert elapsed >= 0.2
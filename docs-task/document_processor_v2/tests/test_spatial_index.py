@@ -0,0 +1,62 @@
+import json
+import os
+import time
+
+from document_processor_v2.src.cache import MarkupCache
+from document_processor_v2.src.spatial_index import SpatialIndex
+
+
+def grid_boxes(shift: float = 0.0):
+    return [
+        (10.0 + shift, 10.0, 60.0, 30.0), (80.0, 10.0, 140.0, 30.0),
+        (10.0, 50.0, 60.0, 70.0), (80.0 + shift, 50.0, 140.0, 70.0),
+    ]
+
+
+def test_nearest_neighbours():
+    index = SpatialIndex(grid_boxes())
+    assert index.nearest(0, "right") == 1
+    assert index.nearest(0, "bottom") == 2
+    assert index.nearest(3, "top") == 1
+    assert index.nearest(3, "right") is None
+    assert index.query((0, 0, 70, 35)) == [0]
+
+
+def test_from_dict_roundtrip():
+    index = SpatialIndex(grid_boxes())
+    restored = SpatialIndex.from_dict(json.loads(json.dumps(index.to_dict())), grid_boxes())
+    assert restored is not None
+    assert restored.neighbours == index.neighbours
+
+
+def test_from_dict_rejects_other_boxes_of_same_size():
+    data = SpatialIndex(grid_boxes()).to_dict()
+    assert SpatialIndex.from_dict(data, grid_boxes(shift=500.0)) is None
+
+
+def test_from_dict_rejects_other_version():
+    data = dict(SpatialIndex(grid_boxes()).to_dict(), version=1)
+    assert SpatialIndex.from_dict(data, grid_boxes()) is None
+
+
+def test_put_drops_index_of_previous_markup(tmp_path):
+    cache = MarkupCache(tmp_path)
+    cache.put("a" * 64, {"text_items": []})
+    cache.put_index("a" * 64, {"version": 0})
+    cache.put("a" * 64, {"text_items": []})
+    assert cache.get_index("a" * 64) is None
+
+
+def test_markup_and_index_are_evicted_together(tmp_path):
+    cache = MarkupCache(tmp_path, max_bytes=3000)
+    old, new = "a" * 64, "b" * 64
+    cache.put(old, {"text_items": [], "pad": "x" * 1000})
+    cache.put_index(old, {"pad": "y" * 200})
+    # Индекс старой разметки читался недавно, сама разметка - давно
+    stale = time.time() - 3600
+    os.utime(cache.path_for(old), (stale, stale))
+    cache.put(new, {"text_items": [], "pad": "z" * 1800})
+
+    assert not cache.path_for(old).exists()
+    assert not cache.path_for(old, suffix='.index.json').exists()
+    assert cache.get(new) is not None
@@ -2,14 +2,16 @@
 
 import os
 import sys
-import time
 import json
 import logging
 import argparse
 from pathlib import Path
 from typing import Optional, Dict, Any
 import openai
-from openai import OpenAI
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from document_processor_v2.src.http_pool import openai_client, timeout_for
+from document_processor_v2.src.run_poller import PollPolicy, RunFailedError, RunTimeoutError, poll_run
 
 # Настройка логирования
 logging.basicConfig(
@@ -25,7 +27,7 @@ class DocumentAssistant:
         if not self.api_key:
             raise ValueError("Не установлена переменная окружения OPENAI_API_KEY")
         
-        self.client = OpenAI()
+        self.client = openai_client()
         self.script_dir = Path(__file__).parent
 
     def load_prompts(self) -> tuple[str, str]:
@@ -90,7 +92,8 @@ class DocumentAssistant:
             with open(file_path, 'rb') as f:
                 file = self.client.files.create(
                     file=f,
-                    purpose='assistants'
+                    purpose='assistants',
+                    timeout=timeout_for("upload")
                 )
             return file.id
         except (openai.OpenAIError, IOError) as e:
@@ -132,22 +135,19 @@ class DocumentAssistant:
             raise
 
     def wait_for_completion(self, thread_id: str, run_id: str) -> None:
-        """Ожидание завершения выполнения"""
+        """Ожидание завершения выполнения с адаптивным опросом"""
         logger.info("Ожидание результата...")
-        while True:
-            try:
-                run = self.client.beta.threads.runs.retrieve(
-                    thread_id=thread_id,
-                    run_id=run_id
-                )
-                if run.status == "completed":
-                    break
-                elif run.status in ["failed", "cancelled", "expired"]:
-                    raise RuntimeError(f"Выполнение завершилось с ошибкой: {run.status}")
-                time.sleep(1)
-            except openai.OpenAIError as e:
-                logger.error(f"Ошибка при проверке статуса: {e}")
-                raise
+        try:
+            poll_run(
+                lambda: self.client.beta.threads.runs.retrieve(
+                    thread_id=thread_id, run_id=run_id, timeout=timeout_for("poll")
+                ),
+                run_id,
+                PollPolicy.from_env()
+            )
+        except (openai.OpenAIError, RunFailedError, RunTimeoutError) as e:
+            logger.error(f"Ошибка при проверке статуса: {e}")
+            raise
 
     def get_result(self, thread_id: str) -> str:
         """Получение результата"""
@@ -156,7 +156,8 @@ class DocumentAssistant:
             messages = self.client.beta.threads.messages.list(
                 thread_id=thread_id,
                 order="desc",
-                limit=1
+                limit=1,
+                timeout=timeout_for("list")
             )
             return messages.data[0].content[0].text.value
         except openai.OpenAIError as e:
@@ -1,12 +1,16 @@
 #!/usr/bin/env python3
 
 import os
+import sys
 import json
 import logging
 from pathlib import Path
 from typing import Optional, Dict, Any, List
 import openai
-from openai import OpenAI
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from document_processor_v2.src.http_pool import openai_client, timeout_for
+from document_processor_v2.src.run_poller import PollPolicy, poll_run
 
 # Настройка логирования
 logging.basicConfig(
@@ -24,7 +28,7 @@ class AssistantManager:
         if not self.api_key:
             raise ValueError("Не установлена переменная окружения OPENAI_API_KEY")
         
-        self.client = OpenAI()
+        self.client = openai_client()
         self.script_dir = Path(__file__).parent.parent
         self.assistants: Dict[str, str] = {}
         self.cache_dir = self.script_dir / 'cache'
@@ -73,7 +77,8 @@ class AssistantManager:
             with open(file_path, 'rb') as f:
                 file = self.client.files.create(
                     file=f,
-                    purpose='assistants'
+                    purpose='assistants',
+                    timeout=timeout_for("upload")
                 )
             return file.id
         except Exception as e:
@@ -112,28 +117,19 @@ class AssistantManager:
             raise
 
     def wait_for_completion(self, thread_id: str, run_id: str, max_retries: int = 3) -> None:
-        """Ожидание завершения выполнения с механизмом повторных попыток"""
-        import time
-        retries = 0
-        
-        while retries < max_retries:
-            try:
-                while True:
-                    run = self.client.beta.threads.runs.retrieve(
-                        thread_id=thread_id,
-                        run_id=run_id
-                    )
-                    if run.status == "completed":
-                        return
-                    elif run.status in ["failed", "cancelled", "expired"]:
-                        raise RuntimeError(f"Выполнение завершилось с ошибкой: {run.status}")
-                    time.sleep(1)
-            except Exception as e:
-                retries += 1
-                if retries >= max_retries:
-                    raise
-                logger.warning(f"Попытка {retries} из {max_retries} не удалась: {e}")
-                time.sleep(2 ** retries)  # Экспоненциальная задержка
+        """Ожидание завершения выполнения с адаптивным опросом
+
+        Временные ошибки API повторяются внутри опроса (не больше max_retries подряд).
+        """
+        policy = PollPolicy.from_env()
+        policy.max_errors = max_retries
+        poll_run(
+            lambda: self.client.beta.threads.runs.retrieve(
+                thread_id=thread_id, run_id=run_id, timeout=timeout_for("poll")
+            ),
+            run_id,
+            policy
+        )
 
     def get_result(self, thread_id: str) -> str:
         """Получение результата выполнения"""
@@ -141,7 +137,8 @@ class AssistantManager:
             messages = self.client.beta.threads.messages.list(
                 thread_id=thread_id,
                 order="desc",
-                limit=1
+                limit=1,
+                timeout=timeout_for("list")
             )
             return messages.data[0].content[0].text.value
         except Exception as e:
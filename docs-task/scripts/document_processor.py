@@ -1,13 +1,18 @@
 #!/usr/bin/env python3
 
 import os
+import sys
 import json
 import yaml
 import logging
 from pathlib import Path
 from typing import Optional, Dict, Any
 import openai
-from openai import OpenAI
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from document_processor_v2.src.assistant_registry import AssistantRegistry
+from document_processor_v2.src.http_pool import openai_client, timeout_for
+from document_processor_v2.src.run_poller import PollPolicy, RunFailedError, RunTimeoutError, poll_run
 
 # Настройка логирования
 logging.basicConfig(
@@ -23,16 +28,20 @@ class DocumentProcessor:
         if not self.api_key:
             raise ValueError("Не установлена переменная окружения OPENAI_API_KEY")
         
-        self.client = OpenAI()
+        self.client = openai_client()
         self.script_dir = Path(__file__).parent.parent
+        self.registry = AssistantRegistry(
+            os.getenv('ASSISTANT_REGISTRY_PATH') or self.script_dir / 'cache' / 'assistants.json'
+        )
+        self.assistants: Dict[str, str] = {}
 
     def load_prompts(self) -> tuple[str, str]:
         """Загрузка промптов"""
         try:
-            with open(self.script_dir / 'instructions/markup_generator.prompt') as f:
+            with open(self.script_dir / 'scripts/instructions/markup_generator.prompt') as f:
                 markup_prompt = f.read()
             
-            with open(self.script_dir / 'instructions/template_generator.prompt') as f:
+            with open(self.script_dir / 'scripts/instructions/template_generator.prompt') as f:
                 template_prompt = f.read()
             
             return markup_prompt, template_prompt
@@ -40,34 +49,62 @@ class DocumentProcessor:
             logger.error(f"Не удалось загрузить промпты: {e}")
             raise
 
-    def create_markup_assistant(self, markup_prompt: str) -> str:
-        """Создание ассистента для разметки"""
-        logger.info("Создание ассистента для разметки...")
+    def assistant_exists(self, assistant_id: str) -> bool:
+        """Проверка, что ассистент из реестра существует в OpenAI"""
         try:
+            self.client.beta.assistants.retrieve(assistant_id)
+            return True
+        except openai.NotFoundError:
+            logger.warning(f"Ассистент {assistant_id} не найден, будет создан заново")
+            return False
+
+    def get_or_create_assistant(self, name: str, description: str, model: str, instructions: str) -> str:
+        """Получение ассистента из реестра или его создание при изменении промпта"""
+        tools = [{"type": "code_interpreter"}]
+        key = AssistantRegistry.make_key(name, model, instructions, tools)
+        if key in self.assistants:
+            return self.assistants[key]
+
+        def create() -> str:
+            logger.info(f"Создание ассистента {name}...")
             assistant = self.client.beta.assistants.create(
+                name=name,
+                description=description,
+                model=model,
+                instructions=instructions,
+                tools=tools
+            )
+            return assistant.id
+
+        self.assistants[key] = self.registry.get_or_create(
+            name, model, instructions, tools,
+            create=create,
+            exists=self.assistant_exists
+        )
+        return self.assistants[key]
+
+    def create_markup_assistant(self, markup_prompt: str) -> str:
+        """Получение ассистента для разметки"""
+        try:
+            return self.get_or_create_assistant(
                 name="Document Markup Generator",
                 description="Создает JSON разметку документов с координатами элементов",
                 model="gpt-4-vision-preview",
-                instructions=markup_prompt,
-                tools=[{"type": "code_interpreter"}]
+                instructions=markup_prompt
             )
-            return assistant.id
         except openai.OpenAIError as e:
             logger.error(f"Ошибка при создании ассистента для разметки: {e}")
             raise
 
     def create_template_assistant(self, template_prompt: str) -> str:
-        """Создание ассистента для генерации шаблонов"""
-        logger.info("Создание ассистента для генерации шаблонов...")
+        """Получение ассистента для генерации шаблонов"""
         try:
-            assistant = self.client.beta.assistants.create(
+            return self.get_or_create_assistant(
                 name="DSL Template Generator",
                 description="Создает YAML шаблоны на основе разметки",
                 model="gpt-4-turbo-preview",
-                instructions=template_prompt,
-                tools=[{"type": "code_interpreter"}]
+                instructions=template_prompt
             )
-            return assistant.id
         except openai.OpenAIError as e:
             logger.error(f"Ошибка при создании ассистента для шаблонов: {e}")
             raise
@@ -89,7 +126,8 @@ class DocumentProcessor:
             with open(file_path, 'rb') as f:
                 file = self.client.files.create(
                     file=f,
-                    purpose='assistants'
+                    purpose='assistants',
+                    timeout=timeout_for("upload")
                 )
             return file.id
         except (openai.OpenAIError, IOError) as e:
@@ -131,22 +169,19 @@ class DocumentProcessor:
             raise
 
     def wait_for_completion(self, thread_id: str, run_id: str) -> None:
-        """Ожидание завершения выполнения"""
+        """Ожидание завершения выполнения с адаптивным опросом"""
         logger.info("Ожидание результата...")
-        while True:
-            try:
-                run = self.client.beta.threads.runs.retrieve(
-                    thread_id=thread_id,
-                    run_id=run_id
-                )
-                if run.status == "completed":
-                    break
-                elif run.status in ["failed", "cancelled", "expired"]:
-                    raise RuntimeError(f"Выполнение завершилось с ошибкой: {run.status}")
-                time.sleep(1)
-            except openai.OpenAIError as e:
-                logger.error(f"Ошибка при проверке статуса: {e}")
-                raise
+        try:
+            poll_run(
+                lambda: self.client.beta.threads.runs.retrieve(
+                    thread_id=thread_id, run_id=run_id, timeout=timeout_for("poll")
+                ),
+                run_id,
+                PollPolicy.from_env()
+            )
+        except (openai.OpenAIError, RunFailedError, RunTimeoutError) as e:
+            logger.error(f"Ошибка при проверке статуса: {e}")
+            raise
 
     def get_result(self, thread_id: str) -> str:
         """Получение результата"""
@@ -155,7 +190,8 @@ class DocumentProcessor:
             messages = self.client.beta.threads.messages.list(
                 thread_id=thread_id,
                 order="desc",
-                limit=1
+                limit=1,
+                timeout=timeout_for("list")
             )
             return messages.data[0].content[0].text.value
         except openai.OpenAIError as e: